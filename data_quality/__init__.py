@@ -6,11 +6,8 @@ from __future__ import unicode_literals
 
 import os
 import io
-from . import tasks
-from . import main
-from . import generators
-from . import compat
-from . import utilities
+import sys
+import importlib
 
 def get_version():
     version_path = os.path.join(os.path.dirname(__file__), 'VERSION')
@@ -20,3 +17,22 @@ __version__ = get_version()
 
 __all__ = ['main', 'tasks', 'generators', 'compat']
 
+
+if sys.version_info < (3, 7):
+    # Module `__getattr__` is only called from Python 3.7
+    from . import tasks
+    from . import main
+    from . import generators
+    from . import compat
+    from . import utilities
+
+
+def __getattr__(name):
+    """Import the modules of the package when they are first used, so the CLI
+       doesn't import all of them (Python 3.7+)
+    """
+
+    if name in __all__ or name == 'utilities':
+        return importlib.import_module('.{0}'.format(name), __name__)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import copy
+import multiprocessing
+from goodtables import pipeline
+from .timings import StageTimer
+from .tasks.aggregate import get_row_count
+
+_worker_state = {}
+# Processor options a Pipeline sets on its own, which may hold its report
+_pipeline_processor_options = ('row_limit', 'report_limit', 'report_stream',
+                               'fail_fast', 'report', 'transform', 'header_index')
+
+
+class TimedBatch(pipeline.Batch):
+
+    """Run a pipeline batch process, timing how long each source takes to
+    fetch and validate.
+
+    Each pipeline gets a StageTimer as its `timer` attribute, with the
+    validation stage left running for its post task to stop.
+
+    """
+
+    def pipeline_factory(self, data, schema, format, encoding):
+        """Construct a pipeline, which fetches its data, and time it."""
+
+        timer = StageTimer()
+        with timer.time('fetch'):
+            pipeline_instance = super(TimedBatch, self).pipeline_factory(
+                data, schema, format, encoding)
+        pipeline_instance.timer = timer
+        # Batch.run runs each pipeline as soon as it is constructed
+        timer.start('validate')
+        return pipeline_instance
+
+
+class ParallelBatch(pipeline.Batch):
+
+    """Run a pipeline batch process over a pool of worker processes.
+
+    Sources are validated and scored by the workers, while the aggregator
+    adds their outcomes in the order of the sources file, so results are
+    written in the same order as by a sequential batch.
+
+    Args:
+    * `aggregator`: Aggregator the outcome of each source is added to
+    * `workers`: number of worker processes, defaults to the number of CPUs
+    * other arguments are the same as for `goodtables.pipeline.Batch`,
+      except `sleep` and `pipeline_post_task` which are ignored
+
+    """
+
+    def __init__(self, source, aggregator, workers=None, **kwargs):
+        kwargs.pop('pipeline_post_task', None)
+        kwargs.pop('sleep', None)
+        super(ParallelBatch, self).__init__(source, **kwargs)
+        self.aggregator = aggregator
+        self.workers = workers or multiprocessing.cpu_count()
+
+    def run(self):
+        """Run the batch."""
+
+        jobs = [(data, self.aggregator.get_scoring_source(data['data']))
+                for data in self.dataset]
+        initargs = (self.aggregator.get_scorer(),
+                    get_worker_pipeline_options(self.pipeline_options),
+                    self.aggregator.fetched_cache)
+        pool = multiprocessing.Pool(self.workers, initializer=init_worker,
+                                    initargs=initargs)
+        valid = True
+        try:
+            for outcome in pool.imap(validate_source, jobs):
+                self.aggregator.add_outcome(outcome)
+                valid = valid and outcome['valid']
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if self.post_task:
+            self.post_task(self)
+
+        return valid
+
+
+def get_worker_pipeline_options(pipeline_options):
+    """Return the pipeline options without those set by previous pipelines"""
+
+    options = dict(pipeline_options or {})
+    if options.get('options'):
+        options['options'] = {
+            processor: {key: value for key, value in processor_options.items()
+                        if key not in _pipeline_processor_options}
+            for processor, processor_options in options['options'].items()}
+    return options
+
+
+def init_worker(scorer, pipeline_options, fetched_cache):
+    """Keep what a worker process needs to validate sources"""
+
+    _worker_state['scorer'] = scorer
+    _worker_state['pipeline_options'] = pipeline_options
+    _worker_state['fetched_cache'] = fetched_cache
+
+
+def validate_source(job):
+    """Validate and score a source in a worker process
+
+    Args:
+        job: tuple with the batch dataset entry of the source and its entry
+             in the sources file
+    """
+
+    data, source = job
+    timer = StageTimer()
+    with timer.time('fetch'):
+        pipeline_instance = make_pipeline(data, _worker_state['pipeline_options'])
+    with timer.time('validate'):
+        valid, report = pipeline_instance.run()
+    with timer.time('score'):
+        score, error_stats = _worker_state['scorer'].score_report(report, source)
+    blob = None
+    if pipeline_instance.data:
+        with timer.time('cache'):
+            blob = _worker_state['fetched_cache'].store_blob(
+                pipeline_instance.data.stream, pipeline_instance.data.encoding)
+    return {'data_source': data['data'], 'valid': valid, 'score': score,
+            'error_stats': error_stats, 'blob': blob, 'timings': timer.durations,
+            'rows': get_row_count(pipeline_instance)}
+
+
+def make_pipeline(data, pipeline_options):
+    """Construct a pipeline for a batch dataset entry, as `Batch` does"""
+
+    options = copy.deepcopy(pipeline_options or {})
+    if options.get('options') is None:
+        options['options'] = {}
+    if data['schema'] is not None:
+        if options['options'].get('schema') is None:
+            options['options']['schema'] = {}
+        options['options']['schema']['schema'] = data['schema']
+    if data['encoding']:
+        options['encoding'] = data['encoding']
+    if data['format']:
+        options['format'] = data['format']
+
+    return pipeline.Pipeline(data['data'], **options)
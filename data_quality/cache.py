@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import gzip
+import codecs
+import shutil
+import hashlib
+import tempfile
+from . import compat
+
+
+class FetchedDataCache(object):
+
+    """A content-addressed cache for the data of fetched sources.
+
+       Each distinct payload is stored once in `.blobs`, named by the SHA-256
+       hash of its bytes, and linked into `cache_dir` under the name of the
+       source. Payloads are the data of the source in its own encoding. The
+       manifest maps each source id to its blob.
+    """
+
+    blob_dir_name = '.blobs'
+    manifest_name = '.manifest.json'
+
+    def __init__(self, cache_dir, compress=False):
+        self.cache_dir = cache_dir
+        self.compress = compress
+        self.blob_dir = os.path.join(cache_dir, self.blob_dir_name)
+        self.manifest_path = os.path.join(cache_dir, self.manifest_name)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        """Return the saved manifest or an empty one"""
+
+        try:
+            with io.open(self.manifest_path, mode='rt', encoding='utf-8') as manifest_file:
+                return json.loads(manifest_file.read())
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def store(self, source_id, name, data_stream, encoding='utf-8'):
+        """Cache the content of `data_stream` as `name` and return its hash
+
+        Args:
+            source_id: id of the source the data belongs to
+            name: file name the data should be available as in `cache_dir`
+            data_stream: stream with the data of the source
+            encoding: encoding used if the stream has to be read as text
+        """
+
+        digest, size = self.store_blob(data_stream, encoding)
+        self.add(source_id, name, digest, size)
+        return digest
+
+    def store_blob(self, data_stream, encoding='utf-8'):
+        """Store the content of `data_stream` as a blob, if not stored yet,
+           and return its hash and size.
+
+        Blobs are written atomically, so this is safe to call from several
+        processes sharing the same `cache_dir`.
+        """
+
+        payload = stream_payload(data_stream, encoding)
+        try:
+            digest = hashlib.sha256(payload).hexdigest()
+            blob_path = self.blob_path(digest)
+            if not os.path.exists(blob_path):
+                self.write_blob(blob_path, payload)
+            size = len(payload)
+        finally:
+            if isinstance(payload, memoryview):
+                payload.release()
+        return digest, size
+
+    def add(self, source_id, name, digest, size):
+        """Make a stored blob available as `name` and record it for `source_id`"""
+
+        file_name = name + '.gz' if self.compress else name
+        link_file(self.blob_path(digest), os.path.join(self.cache_dir, file_name))
+        self.manifest[source_id] = {'blob': digest, 'name': file_name,
+                                    'size': size, 'gzip': self.compress}
+
+    def blob_path(self, digest, compressed=None):
+        """Return the path of the blob for a payload with hash `digest`"""
+
+        if compressed is None:
+            compressed = self.compress
+        blob_name = digest + '.gz' if compressed else digest
+        return os.path.join(self.blob_dir, digest[:2], blob_name)
+
+    def write_blob(self, blob_path, payload):
+        """Write a payload to `blob_path` in one go, atomically"""
+
+        blob_dir = os.path.dirname(blob_path)
+        if not os.path.isdir(blob_dir):
+            os.makedirs(blob_dir)
+        temp_fd, temp_path = tempfile.mkstemp(dir=blob_dir)
+        try:
+            with io.open(temp_fd, mode='wb') as blob_file:
+                if self.compress:
+                    with gzip.GzipFile(fileobj=blob_file, mode='wb') as gzip_file:
+                        gzip_file.write(payload)
+                else:
+                    blob_file.write(payload)
+            os.chmod(temp_path, 0o644)
+            os.rename(temp_path, blob_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def save(self, source_ids=None):
+        """Save the manifest and remove what it doesn't reference anymore
+
+        Args:
+            source_ids: ids of the sources whose data should be kept,
+                        all sources in the manifest are kept if missing
+        """
+
+        if source_ids is not None:
+            self.manifest = {source_id: entry for source_id, entry
+                             in self.manifest.items() if source_id in source_ids}
+        file_names = set(entry['name'] for entry in self.manifest.values())
+        blob_paths = set(self.blob_path(entry['blob'], entry['gzip'])
+                         for entry in self.manifest.values())
+
+        for file_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file_name)
+            if file_name.startswith('.') or file_name in file_names:
+                continue
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+            else:
+                os.unlink(file_path)
+        if os.path.isdir(self.blob_dir):
+            for root, dirs, files in os.walk(self.blob_dir):
+                for blob_name in files:
+                    blob_path = os.path.join(root, blob_name)
+                    if blob_path not in blob_paths:
+                        os.unlink(blob_path)
+
+        temp_path = '{0}.tmp'.format(self.manifest_path)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as manifest_file:
+            manifest_file.write(compat.str(json.dumps(self.manifest, indent=4,
+                                                      sort_keys=True)))
+        os.rename(temp_path, self.manifest_path)
+
+
+def stream_payload(data_stream, encoding='utf-8'):
+    """Return the bytes of a data stream in `encoding`, without copying them
+       if possible
+
+    goodtables keeps the data it fetched in an in-memory buffer, re-encoded
+    as UTF-8; a view of that buffer is returned for UTF-8 sources. The data
+    of other sources is encoded back to their own encoding, with characters
+    that couldn't be decoded replaced.
+    """
+
+    encoding = encoding or 'utf-8'
+    data_stream.flush()
+    binary_stream = getattr(data_stream, 'buffer', None)
+    raw_stream = getattr(binary_stream, 'raw', None)
+    stream_encoding = getattr(data_stream, 'encoding', None) or 'utf-8'
+    same_encoding = codecs.lookup(encoding).name == codecs.lookup(stream_encoding).name
+    if same_encoding and isinstance(raw_stream, io.BytesIO):
+        if compat.is_py3:
+            return raw_stream.getbuffer()
+        return raw_stream.getvalue()
+    data_stream.seek(0)
+    if same_encoding and binary_stream is not None:
+        return binary_stream.read()
+    return data_stream.read().encode(encoding, 'replace')
+
+
+def link_file(source_path, link_path):
+    """Make `link_path` a hard link to `source_path`, or a copy of it"""
+
+    if os.path.exists(link_path):
+        if os.path.samefile(source_path, link_path):
+            return
+        os.unlink(link_path)
+    try:
+        os.link(source_path, link_path)
+    except (OSError, AttributeError):
+        shutil.copyfile(source_path, link_path)
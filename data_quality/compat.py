@@ -10,7 +10,6 @@ import io
 import csv
 import os
 
-
 _ver = sys.version_info
 is_py2 = (_ver[0] == 2)
 is_py3 = (_ver[0] == 3)
@@ -50,6 +49,19 @@ def to_builtin_str(str):
     else:
         return str
 
+
+def get_numpy():
+    """Return the `numpy` module, or None if it isn't installed.
+
+    It is imported when first needed rather than with this module, as it is
+    slow to import.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
 class UnicodeWriter(object):
     """
         This class provides functionality for writing CSV files
@@ -90,6 +102,14 @@ class UnicodeWriter(object):
         for row in rows:
             self.writerow(row)
 
+    def writetextrow(self, row):
+        """Write a row of text values, as serialized by a RowConverter,
+           without checking their types
+        """
+        if is_py2:
+            row = [val.encode(self.encoding) for val in row]
+        self.writer.writerow(row)
+
 
 class UnicodeAppender(UnicodeWriter):
     """
@@ -107,6 +127,118 @@ class UnicodeAppender(UnicodeWriter):
         return self
 
 
+class UnicodeBufferedAppender(UnicodeWriter):
+    """
+       This class provides functionality for appending to CSV files
+       in a given encoding, python 2 and 3 compatible, keeping rows in
+       memory until `flush` writes them out as complete lines
+    """
+
+    def __init__(self, filename, encoding='utf-8', buffering=-1, **kw):
+        self.buffering = buffering
+        self.pending = 0
+        super(UnicodeBufferedAppender, self).__init__(filename, encoding, **kw)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def open(self):
+        """Open the file for appending, after ending or dropping its last row"""
+
+        self.truncate_partial_row()
+        if is_py3:
+            self.f = open(self.filename, 'at', encoding=self.encoding,
+                          buffering=self.buffering)
+            self.buffer = io.StringIO()
+        else:
+            self.f = open(self.filename, 'ab', self.buffering)
+            self.buffer = io.BytesIO()
+        self.writer = csv.writer(self.buffer, lineterminator=os.linesep, **self.kw)
+        return self
+
+    def close(self):
+        """Write the buffered rows and close the file"""
+
+        try:
+            self.flush()
+        finally:
+            self.f.close()
+
+    def writerow(self, row):
+        super(UnicodeBufferedAppender, self).writerow(row)
+        self.pending += 1
+
+    def writetextrow(self, row):
+        super(UnicodeBufferedAppender, self).writetextrow(row)
+        self.pending += 1
+
+    def flush(self):
+        """Write the buffered rows to the file and sync it to disk"""
+
+        if self.pending:
+            self.f.write(self.buffer.getvalue())
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.pending = 0
+
+    def truncate_partial_row(self):
+        """Drop a row left incomplete at the end of the file by a crash
+
+        A last line without a line break is kept, and ended, if it parses as
+        a row with as many values as the header. Otherwise it is dropped.
+        """
+
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r+b') as a_file:
+            a_file.seek(0, os.SEEK_END)
+            size = a_file.tell()
+            if size == 0:
+                return
+            a_file.seek(-1, os.SEEK_END)
+            if a_file.read(1) == b'\n':
+                return
+            position = size
+            while position > 0:
+                step = min(io.DEFAULT_BUFFER_SIZE, position)
+                position -= step
+                a_file.seek(position)
+                last_newline = a_file.read(step).rfind(b'\n')
+                if last_newline != -1:
+                    row_start = position + last_newline + 1
+                    a_file.seek(0)
+                    header = a_file.readline()
+                    a_file.seek(row_start)
+                    if self.is_complete_row(a_file.read(), header):
+                        a_file.seek(0, os.SEEK_END)
+                        a_file.write(os.linesep.encode('ascii'))
+                    else:
+                        a_file.truncate(row_start)
+                    return
+
+    def is_complete_row(self, line, header):
+        """Return whether `line` is a row with as many values as `header`
+
+        Args:
+            line: bytes of a line, without its line break
+            header: bytes of the header line
+        """
+
+        if line.count(b'"') % 2:
+            return False
+        try:
+            rows = [list(csv.reader([to_builtin_str(text.decode(self.encoding))]))
+                    for text in (line, header.rstrip(b'\r\n'))]
+        except (UnicodeDecodeError, csv.Error):
+            return False
+        return len(rows[0]) == 1 and len(rows[0][0]) == len(rows[1][0])
+
+
 class UnicodeDictWriter(UnicodeWriter):
     """
         This class provides functionality for writing CSV file rows from dicts
@@ -167,9 +299,11 @@ class UnicodeReader(object):
 class UnicodeDictReader(UnicodeReader):
     """
        This class provides functionality to read CSV file rows as dicts
-       in a given encoding, python 2 and 3 compatible
+       in a given encoding, python 2 and 3 compatible, optionally starting
+       from the row at byte `offset`
     """
-    def __init__(self, filename, encoding='utf-8', **kw):
+    def __init__(self, filename, encoding='utf-8', offset=0, **kw):
+        self.offset = offset
         super(UnicodeDictReader, self).__init__(filename, encoding, **kw)
 
     def __enter__(self):
@@ -179,6 +313,8 @@ class UnicodeDictReader(UnicodeReader):
             self.f = open(self.filename, 'rb')
         self.reader = csv.reader(self.f, **self.kw)
         self.header = next(self.reader)
+        if self.offset:
+            self.f.seek(self.offset)
         return self
 
     def next(self):
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+import decimal
+import datetime
+from jsontableschema import exceptions
+from . import compat
+
+_plain_number_pattern = re.compile(r'^[+-]?[0-9]+(?:\.[0-9]+)?$')
+_iso_date_pattern = re.compile(r'^([0-9]{4})-([0-9]{2})-([0-9]{2})$')
+
+
+class RowConverter(object):
+
+    """The rows of a schema, cast and serialized by one function per field
+       chosen when the converter is created.
+
+    Values are cast as `SchemaModel.convert_row` casts them, with the same
+    errors. Fields with constraints or formats the compiled functions don't
+    handle are cast by jsontableschema itself.
+
+    Args:
+        schema: a jsontableschema SchemaModel
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.headers = schema.headers
+        self.casts = []
+        self.serializers = []
+        for field_name in self.headers:
+            cast, serialize = compile_field(schema, field_name)
+            self.casts.append(cast)
+            self.serializers.append(serialize)
+
+    def convert_row(self, *items):
+        """Return the list of `items` cast to the types of their fields
+
+        Raises ConversionError if the row doesn't have a value for each field,
+        and MultipleInvalid with all the values that couldn't be cast.
+        """
+
+        if len(items) != len(self.casts):
+            raise exceptions.ConversionError(
+                'The number of items to convert does not match the number of '
+                'fields given in the schema\n'
+                'headers : {0} - {1}\nitems : {2} - {3}'.format(
+                    len(self.headers), self.headers, len(items), items))
+        try:
+            return [cast(item) for cast, item in zip(self.casts, items)]
+        except exceptions.InvalidCastError:
+            return self.collect_errors(items)
+
+    def serialize_row(self, *items):
+        """Return the list of `items` cast to the types of their fields and
+           written as text, ready for `UnicodeWriter.writetextrow`
+        """
+
+        return [serialize(value) for serialize, value
+                in zip(self.serializers, self.convert_row(*items))]
+
+    def collect_errors(self, items):
+        """Cast `items` one at a time to raise the errors of all of them"""
+
+        errors = []
+        for cast, item in zip(self.casts, items):
+            try:
+                cast(item)
+            except exceptions.InvalidCastError as e:
+                errors.append(e)
+        raise exceptions.MultipleInvalid(errors=errors)
+
+
+def compile_field(schema, field_name):
+    """Return the functions casting and serializing the values of a field
+
+    Args:
+        schema: a jsontableschema SchemaModel
+        field_name: name of the field, whose first occurrence is used like
+                    `SchemaModel.convert_row` does
+    """
+
+    field = schema.get_field(field_name)
+    field_type = schema.get_type(field_name)
+    cast = field_type.cast
+    compiler = _compilers.get(field['type'])
+    constraints = set(field.get('constraints', {})) - set(['required', 'unique'])
+    cast_format = field.get('format', 'default')
+    if cast_format.startswith('fmt:'):
+        cast_format = 'fmt'
+    if compiler is None or constraints or \
+       (cast_format != 'default' and hasattr(field_type, 'cast_' + cast_format)):
+        return cast, serialize_value
+    return compiler(field, field_type, cast)
+
+
+def compile_string(field, field_type, cast):
+    null_values = frozenset(field_type.null_values)
+
+    def cast_string(value):
+        if type(value) is compat.str and value.strip() not in null_values:
+            return value
+        return cast(value)
+
+    return cast_string, serialize_text
+
+
+def compile_integer(field, field_type, cast):
+    null_values = frozenset(field_type.null_values)
+
+    def cast_integer(value):
+        if type(value) is int:
+            return value
+        if type(value) is compat.str and value.strip() not in null_values:
+            try:
+                return int(value)
+            except ValueError:
+                pass
+        return cast(value)
+
+    return cast_integer, serialize_object
+
+
+def compile_number(field, field_type, cast):
+    plain_numbers = field.get('groupChar', ',') == ',' and \
+        field.get('decimalChar', '.') == '.'
+
+    def cast_number(value):
+        if type(value) is decimal.Decimal:
+            return value
+        if type(value) in (int, float):
+            return decimal.Decimal(value)
+        if plain_numbers and type(value) is compat.str and \
+           _plain_number_pattern.match(value):
+            return decimal.Decimal(value)
+        return cast(value)
+
+    return cast_number, serialize_object
+
+
+def compile_date(field, field_type, cast):
+
+    def cast_date(value):
+        if isinstance(value, datetime.date):
+            return value
+        match = _iso_date_pattern.match(value) if type(value) is compat.str else None
+        if match is not None:
+            try:
+                return datetime.date(*[int(group) for group in match.groups()])
+            except ValueError:
+                pass
+        return cast(value)
+
+    return cast_date, serialize_object
+
+
+def compile_datetime(field, field_type, cast):
+
+    def cast_datetime(value):
+        if isinstance(value, datetime.datetime):
+            return value
+        return cast(value)
+
+    return cast_datetime, serialize_object
+
+
+def serialize_text(value):
+    if value is None:
+        return ''
+    return value
+
+
+def serialize_object(value):
+    if value is None:
+        return ''
+    return compat.str(value)
+
+
+def serialize_value(value):
+    """Return a cast value as text, like `UnicodeWriter.writerow` writes it"""
+
+    if value is None:
+        return ''
+    if type(value) in (compat.str, compat.bytes, compat.builtin_str):
+        return value
+    return compat.str(value)
+
+
+_compilers = {
+    'string': compile_string,
+    'integer': compile_integer,
+    'number': compile_number,
+    'date': compile_date,
+    'datetime': compile_datetime,
+}
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+import datetime
+import collections
+import dateutil.parser
+import dateutil.tz
+
+# The dates and timestamps written by the tasks themselves
+_iso_pattern = re.compile(r'^(\d{4})-(\d{2})-(\d{2})'
+                          r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?'
+                          r'(Z|[+-]\d{2}(?::?\d{2})?)?)?$')
+_day_month_year_pattern = re.compile(r'^(\d{1,2})-(\d{1,2})-(\d{4})$')
+_tz_utc = dateutil.tz.tzutc()
+_invalid = object()
+
+
+class LRUCache(object):
+
+    """A mapping that keeps at most `size` items, dropping the least
+       recently used first.
+    """
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return the value of `key`, marking it as the most recently used"""
+
+        try:
+            value = self.items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.items[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Add `key`, dropping the least recently used item if full"""
+
+        if self.size <= 0:
+            return
+        self.items.pop(key, None)
+        if len(self.items) >= self.size:
+            self.items.popitem(last=False)
+        self.items[key] = value
+
+    def clear(self):
+        self.items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+
+_parsed = LRUCache()
+
+
+def parse_datetime(value, dayfirst=False):
+    """Return a datetime object from a string, as `dateutil.parser.parse`
+       would, or raise ValueError.
+
+    ISO 8601 values and `XX-XX-YYYY` dates are parsed directly, anything else
+    by dateutil. The outcome for the most recent values is remembered.
+
+    Args:
+        value: a string that should contain a date
+        dayfirst: whether ambiguous dates give the day before the month, which
+                  dateutil also applies to `YYYY-XX-XX` dates
+    """
+
+    key = (value, dayfirst)
+    parsed = _parsed.get(key)
+    if parsed is None:
+        try:
+            parsed = parse_iso(value, dayfirst) or parse_day_month_year(value, dayfirst)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            try:
+                parsed = dateutil.parser.parse(value, dayfirst=dayfirst)
+            except ValueError:
+                parsed = _invalid
+        _parsed.set(key, parsed)
+    if parsed is _invalid:
+        raise ValueError('Unable to parse a date from "{0}"'.format(value))
+    return parsed
+
+
+def parse_date(value, dayfirst=False):
+    """Return a date object from a string or None
+
+    Args:
+        value: a string that should contain a date
+        dayfirst: whether ambiguous dates give the day before the month
+    """
+
+    if not value:
+        return None
+    try:
+        return parse_datetime(value, dayfirst).date()
+    except ValueError:
+        return None
+
+
+def parse_iso(value, dayfirst=False):
+    """Return a datetime from an ISO 8601 string, or None if it isn't one
+
+    Like dateutil, `YYYY-XX-XX` is read as `YYYY-DD-MM` if `dayfirst` is set
+    and the last number can be a month.
+    """
+
+    match = _iso_pattern.match(value)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    if dayfirst and int(day) <= 12:
+        day, month = month, day
+    microsecond = int(fraction.ljust(6, '0')) if fraction else 0
+    tzinfo = None
+    if offset:
+        tzinfo = get_tzinfo(offset)
+    return datetime.datetime(int(year), int(month), int(day), int(hour or 0),
+                             int(minute or 0), int(second or 0), microsecond,
+                             tzinfo)
+
+
+def parse_day_month_year(value, dayfirst=False):
+    """Return a datetime from a `XX-XX-YYYY` string, or None if it isn't one
+
+    Like dateutil, the first number is taken as the month unless `dayfirst`
+    is set or it can't be a month.
+    """
+
+    match = _day_month_year_pattern.match(value)
+    if match is None:
+        return None
+    first, second, year = [int(group) for group in match.groups()]
+    if dayfirst and second <= 12 or first > 12:
+        day, month = first, second
+    else:
+        day, month = second, first
+    return datetime.datetime(year, month, day)
+
+
+def get_tzinfo(offset):
+    """Return the tzinfo dateutil uses for an ISO 8601 UTC offset"""
+
+    if offset == 'Z':
+        return _tz_utc
+    sign = -1 if offset[0] == '-' else 1
+    digits = offset[1:].replace(':', '')
+    seconds = sign * (int(digits[:2]) * 3600 + int(digits[2:] or 0) * 60)
+    if seconds == 0:
+        return _tz_utc
+    return dateutil.tz.tzoffset(None, seconds)
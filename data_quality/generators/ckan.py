@@ -9,6 +9,7 @@ from os import path
 import requests
 import jsontableschema
 from data_quality import compat, utilities
+from data_quality.converters import RowConverter
 from .base import BaseGenerator
 
 class CkanGenerator(BaseGenerator):
@@ -33,6 +34,7 @@ class CkanGenerator(BaseGenerator):
         source_resource = utilities.get_datapackage_resource(sources_filepath,
                                                              self.datapackage)
         source_schema = jsontableschema.model.SchemaModel(source_resource.descriptor['schema'])
+        source_converter = RowConverter(source_schema)
         for result in results:
             sources += self.extract_sources(result, file_types)
 
@@ -42,7 +44,7 @@ class CkanGenerator(BaseGenerator):
             for source in sources:
                 try:
                     values = [compat.str(source[key]) for key in source_schema.headers]
-                    sfile.writerow(list(source_schema.convert_row(*values)))
+                    sfile.writetextrow(source_converter.serialize_row(*values))
                 except jsontableschema.exceptions.MultipleInvalid as e:
                     for error in e.errors:
                         raise error
@@ -109,6 +111,7 @@ class CkanGenerator(BaseGenerator):
         pub_resource = utilities.get_datapackage_resource(publishers_filepath,
                                                           self.datapackage)
         pub_schema = jsontableschema.model.SchemaModel(pub_resource.descriptor['schema'])
+        pub_converter = RowConverter(pub_schema)
 
         with compat.UnicodeWriter(publishers_filepath,
                                   quoting=csv.QUOTE_MINIMAL) as pfile:
@@ -117,7 +120,7 @@ class CkanGenerator(BaseGenerator):
                 result = self.extract_publisher(result)
                 try:
                     values = [result[key] for key in pub_schema.headers]
-                    pfile.writerow(list(pub_schema.convert_row(*values)))
+                    pfile.writetextrow(pub_converter.serialize_row(*values))
                 except jsontableschema.exceptions.MultipleInvalid as e:
                     for error in e.errors:
                         raise error
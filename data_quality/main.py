@@ -6,8 +6,9 @@ from __future__ import unicode_literals
 
 import os
 import click
-from goodtables import pipeline
-from . import tasks, utilities, generators
+
+# The commands import the tasks they run themselves, so that the CLI starts
+# without importing the dependencies of every task.
 
 @click.group()
 def cli():
@@ -17,52 +18,135 @@ def cli():
 @click.argument('config_file_path')
 @click.option('--encoding', default=None)
 @click.option('--deploy', is_flag=True)
-def run(config_file_path, deploy, encoding):
+@click.option('--incremental', is_flag=True,
+              help='Only validate sources that changed since their latest result')
+@click.option('--workers', default=1, type=int,
+              help=('Number of processes validating sources, extracting their '
+                    'periods, fingerprinting them and checking the database '
+                    '(0 for one per CPU)'))
+@click.option('--full', is_flag=True,
+              help='Compute the performance of publishers from scratch')
+def run(config_file_path, deploy, encoding, incremental, workers, full):
     """Process data sources for a Spend Publishing Dashboard instance."""
 
+    from . import tasks, utilities
+    from .batch import TimedBatch, ParallelBatch
+
     config = utilities.load_json_config(config_file_path)
     utilities.resolve_dir(config['cache_dir'])
-    utilities.set_up_cache_dir(config['cache_dir'])
     source_filepath = os.path.join(config['data_dir'], config['source_file'])
 
     if config['assess_timeliness'] is True:
         extractor = tasks.extract_relevance_period.RelevancePeriodExtractor(config)
-        extractor.run()
+        extractor.run(workers)
 
     aggregator = tasks.Aggregator(config)
+    if incremental:
+        source_filepath = aggregator.carry_forward_unchanged(workers)
 
     if deploy:
 
         def batch_handler(instance):
             aggregator.write_run()
             assesser = tasks.PerformanceAssessor(config)
-            assesser.run()
+            assesser.run(full=full)
             deployer = tasks.Deployer(config)
-            deployer.run()
+            deployer.run(workers=workers)
 
     else:
 
         def batch_handler(instance):
             aggregator.write_run()
             assesser = tasks.PerformanceAssessor(config)
-            assesser.run()
+            assesser.run(full=full)
 
     post_tasks = {'post_task': batch_handler, 'pipeline_post_task': aggregator.run}
     config['goodtables']['arguments']['batch'].update(post_tasks)
     batch_options = config['goodtables']['arguments']['batch']
     batch_options['pipeline_options'] = config['goodtables']['arguments']['pipeline']
-    batch = pipeline.Batch(source_filepath, **batch_options)
-    batch.run()
+    if workers == 1:
+        batch = TimedBatch(source_filepath, **batch_options)
+    else:
+        batch = ParallelBatch(source_filepath, aggregator, workers or None,
+                              **batch_options)
+    try:
+        batch.run()
+    finally:
+        aggregator.close()
+        if incremental:
+            os.remove(source_filepath)
+
+
+@cli.command()
+@click.argument('config_file_path')
+@click.option('--deploy', is_flag=True)
+@click.option('--full', is_flag=True,
+              help='Compute the performance of publishers from scratch')
+def rescore(config_file_path, deploy, full):
+    """Score sources again from their stored errors, without validating them."""
+
+    from . import tasks, utilities
+
+    config = utilities.load_json_config(config_file_path)
+    aggregator = tasks.Aggregator(config)
+    try:
+        aggregator.rescore()
+        aggregator.write_run()
+    finally:
+        aggregator.close()
+    assesser = tasks.PerformanceAssessor(config)
+    assesser.run(full=full)
+    if deploy:
+        deployer = tasks.Deployer(config)
+        deployer.run()
 
 
 @cli.command()
 @click.argument('config_file_path')
-def deploy(config_file_path):
+@click.option('--compress', is_flag=True,
+              help='Compress the archives of new months with gzip')
+def compact(config_file_path, compress):
+    """Keep the latest result of each source and archive the others by month."""
+
+    from . import tasks, utilities
+
+    config = utilities.load_json_config(config_file_path)
+    if compress:
+        config['compress_result_archive'] = True
+    compactor = tasks.ResultCompactor(config)
+    compactor.run()
+
+
+@cli.command()
+@click.argument('config_file_path')
+@click.option('--workers', default=1, type=int,
+              help='Number of processes checking the database (0 for one per CPU)')
+def deploy(config_file_path, workers):
     """Deploy data sources for a Spend Publishing Dashboard instance."""
 
+    from . import tasks, utilities
+
     config = utilities.load_json_config(config_file_path)
     deployer = tasks.Deployer(config)
-    deployer.run()
+    deployer.run(workers=workers)
+
+
+@cli.group()
+def spec():
+    """Manage the local copy of the data quality spec."""
+
+
+@spec.command()
+@click.argument('config_file_path')
+def refresh(config_file_path):
+    """Download the data quality spec and update its local cache."""
+
+    from . import utilities
+
+    config = utilities.load_json_config(config_file_path)
+    utilities.get_data_quality_spec(config, refresh=True)
+    spec_path = utilities.get_data_quality_spec_path(config)
+    print('The data quality spec has been saved at {0}.'.format(spec_path))
 
 
 @cli.command()
@@ -82,6 +166,8 @@ def generate(generator_name, endpoint, config_file_path, generator_class_path, f
         endpoint: Url where the generator should get the data from
     """
 
+    from . import tasks, utilities, generators
+
     file_types = list(file_type)
     config = utilities.load_json_config(config_file_path)
     if not config_file_path:
@@ -109,6 +195,8 @@ def generate(generator_name, endpoint, config_file_path, generator_class_path, f
               help='Full path to the workspace folder')
 def init(folder_path):
 
+    from . import tasks
+
     workspace_folder = folder_path
     if not workspace_folder:
         workspace_folder = os.getcwd()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import json
+import hashlib
+from . import compat, utilities
+from .dates import parse_datetime
+
+
+class ScoreIndex(object):
+
+    """The score, timestamp and run of the latest result of each source, kept
+       in a file along with how much of the results it was built from.
+
+    Results appended since the index was saved are read from where it stopped,
+    and the whole history is read again only if the results were changed in
+    any other way, like by a compaction.
+
+    Args:
+        index_file: path of the file the index is saved to
+        result_file: path of the file results are appended to
+        latest_result_file: path of the file with the latest results of the
+                            compacted history, if any
+    """
+
+    version = 2
+
+    def __init__(self, index_file, result_file, latest_result_file):
+        self.index_file = index_file
+        self.result_file = result_file
+        self.latest_result_file = latest_result_file
+
+    def load(self):
+        """Return the saved index if it matches the results, or None
+
+        The index is a dict with the latest `sources` and the `results_size`
+        of `result_file` when it was saved.
+        """
+
+        try:
+            with io.open(self.index_file, mode='rt', encoding='utf-8') as index_file:
+                index = json.loads(index_file.read())
+        except (IOError, OSError, ValueError):
+            return None
+        if index.get('version') != self.version or \
+           index['latest_results_stamp'] != get_file_stamp(self.latest_result_file) or \
+           not os.path.exists(self.result_file) or \
+           os.path.getsize(self.result_file) < index['results_size'] or \
+           get_file_checksum(self.result_file, index['results_size']) != index['results_checksum']:
+            return None
+        return index
+
+    def update(self):
+        """Bring the index up to date with the results and save it atomically"""
+
+        index = self.load()
+        results_size = os.path.getsize(self.result_file)
+        if index is None:
+            sources = self.read_results({})
+        elif index['results_size'] == results_size:
+            return
+        else:
+            sources = self.read_results(index['sources'], index['results_size'])
+        index = {'version': self.version, 'sources': sources,
+                 'results_size': results_size,
+                 'results_checksum': get_file_checksum(self.result_file, results_size),
+                 'latest_results_stamp': get_file_stamp(self.latest_result_file)}
+        temp_path = '{0}.tmp'.format(self.index_file)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as index_file:
+            index_file.write(compat.str(json.dumps(index, sort_keys=True)))
+        os.rename(temp_path, self.index_file)
+
+    def read_results(self, sources, offset=0):
+        """Update `sources` with the results read from `offset` of
+           `result_file`, or from the start of `latest_result_file` if missing
+        """
+
+        for row in utilities.iter_results(self.result_file, self.latest_result_file,
+                                          offset):
+            latest = sources.get(row['source_id'])
+            if latest is None or parse_datetime(row['timestamp']) > \
+               parse_datetime(latest['timestamp']):
+                sources[row['source_id']] = {'score': int(row['score']),
+                                             'timestamp': row['timestamp'],
+                                             'run_id': row['run_id']}
+        return sources
+
+
+def get_file_checksum(file_path, offset, chunk_size=1048576):
+    """Return a checksum of the bytes of a file before `offset`
+
+    The whole prefix is hashed, so that the checksum shows that it wasn't
+    changed anywhere, even by an edit that kept its size.
+    """
+
+    checksum = hashlib.sha1()
+    with io.open(file_path, mode='rb') as a_file:
+        while offset > 0:
+            chunk = a_file.read(min(offset, chunk_size))
+            if not chunk:
+                break
+            checksum.update(chunk)
+            offset -= len(chunk)
+    return checksum.hexdigest()
+
+
+def get_file_stamp(file_path):
+    """Return the size and modification time of a file, or None if missing"""
+
+    if not os.path.exists(file_path):
+        return None
+    file_stat = os.stat(file_path)
+    return [file_stat.st_size, file_stat.st_mtime]
@@ -10,6 +10,7 @@ from .generate import GeneratorManager
 from .aggregate import Aggregator
 from .deploy import Deployer
 from .assess_performance import PerformanceAssessor
+from .compact import ResultCompactor
 
 __all__ = ['Task', 'DataPackageInitializer', 'GeneratorManager', 'Aggregator',
-           'PerformanceAssessor', 'Deployer']
+           'PerformanceAssessor', 'Deployer', 'ResultCompactor']
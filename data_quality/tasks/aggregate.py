@@ -7,23 +7,134 @@ from __future__ import unicode_literals
 import os
 import io
 import csv
+import time
 import uuid
+import json
+import hashlib
+import tempfile
+import multiprocessing
+import yaml
 import pytz
 import jsontableschema
-from math import log
+import math
 from datetime import datetime, timedelta
 from data_quality import utilities, compat, exceptions
+from data_quality.cache import FetchedDataCache
+from data_quality.dates import parse_date
+from data_quality.score_index import ScoreIndex
+from data_quality.timings import StageTimer, default_timer, get_throughput
 from .base_task import Task
 from .check_datapackage import DataPackageChecker
 from .extract_relevance_period import RelevancePeriodExtractor
 
 
-class Aggregator(Task):
+class Scorer(object):
+
+    """Score data sources from the errors in their pipeline reports.
+
+       It only holds the settings needed for scoring, so it can be sent to
+       the worker processes of a parallel batch.
+    """
+
+    def __init__(self, dq_spec, assess_timeliness=False, timeliness_period=1,
+                 error_rows_sample=0, max_score=100):
+        self.dq_spec = dq_spec
+        self.assess_timeliness = assess_timeliness
+        self.timeliness_period = timeliness_period
+        self.error_rows_sample = error_rows_sample
+        self.max_score = max_score
+
+    def score_report(self, report, source):
+        """Return a score for a pipeline report, along with its error stats.
+
+        Args:
+            report: report of the pipeline that validated the source
+            source: source entry, with `created_at` as a date
+        """
+
+        results = iter_report_results(report)
+        error_stats = self.get_error_stats(results)
+        return self.score_error_stats(error_stats, source), error_stats
+
+    def score_error_stats(self, error_stats, source):
+        """Return the score of a source with the given error stats"""
+
+        base_errors = {err: stats for err, stats in error_stats.items()
+                       if stats['processor'] == 'base'}
+        if base_errors:
+            score = 0
+        else:
+            score = self.score_by_error_occurences(error_stats)
+            if self.assess_timeliness:
+                publication_delay = self.get_publication_delay(source)
+                score -= publication_delay
+        score = round(score)
+        if score < 0:
+            score = 0
+        return score
+
+    def get_publication_delay(self, source):
+        """Determine how long the data source publication was delayed"""
+
+        dates = {}
+        relevance_period = source['period_id'].split('/')
+        relevance_period = relevance_period + [None]*(2 - len(relevance_period))
+        dates['period_start'], dates['period_end'] = relevance_period
+        # RelevancePeriodExtractor writes periods as DD-MM-YYYY/DD-MM-YYYY
+        dates = {k: parse_date(v, dayfirst=True) for k, v in dates.items()}
+        dates['period_end'] = dates['period_end'] or dates['period_start']
+        timely_until = dates['period_end'] + \
+                       timedelta(days=(self.timeliness_period * 30))
+        if dates['period_start'] <= source['created_at'] <= timely_until:
+            delay = 0
+        else:
+            delay = source['created_at'] - timely_until
+            delay = delay.days
+            if delay < 0:
+                delay = 0
+            delay = delay / 30.00
+        return delay
+
+    def get_error_stats(self, results):
+        """Return dict with stats on errors
+
+        Args:
+            results: iterable of report results, consumed one at a time
+        """
+
+        accumulator = ErrorAccumulator(self.dq_spec, self.error_rows_sample)
+        for result in results:
+            accumulator.add(result)
+        return accumulator.error_stats
+
+    def score_by_error_occurences(self, error_stats):
+        """Score data source based on based on number of occurrences of each error
+           Algorithm: `total score - (error_weight * no_occurrences) /
+                        (Σ 1/no_occurrences )`
+
+           Args:
+                error_stats: dict with stats on each error
+        """
+
+        score = self.max_score
+        for error, stats in error_stats.items():
+            no_occurrences = stats['occurrences']
+            harmonic_mean_occ = no_occurrences / harmonic_number(no_occurrences)
+            error_impact = stats['weight'] * harmonic_mean_occ
+            score -= error_impact
+        return score
+
+
+class Aggregator(Task, Scorer):
 
     """A Task runner to create results for data sources as they move
        through a processing pipeline.
     """
 
+    error_headers = ['result_id', 'processor', 'error_id', 'occurrences']
+    # Seconds to wait for the headers of a remote source when fingerprinting it
+    fingerprint_timeout = 5
+
     def __init__(self, config, **kwargs):
         super(Aggregator, self).__init__(config, **kwargs)
         datapackage_check = DataPackageChecker(self.config)
@@ -32,58 +143,382 @@ class Aggregator(Task):
                                                           self.datapackage)
         result_resource = utilities.get_datapackage_resource(self.result_file,
                                                              self.datapackage)
-        self.run_schema = jsontableschema.model.SchemaModel(run_resource.descriptor['schema'])
-        self.result_schema = jsontableschema.model.SchemaModel(result_resource.descriptor['schema'])
-        self.initialize_file(self.result_file, self.result_schema.headers)
-        self.initialize_file(self.run_file, self.run_schema.headers)
+        self.run_converter = self.workspace.get_row_converter(run_resource)
+        self.result_converter = self.workspace.get_row_converter(result_resource)
+        self.initialize_file(self.result_file, self.result_converter.headers)
+        self.initialize_file(self.run_file, self.run_converter.headers)
+        self.initialize_file(self.error_file, self.error_headers)
+        self.timing_converter = None
+        if datapackage_check.has_resource(self.timing_file):
+            timing_resource = utilities.get_datapackage_resource(self.timing_file,
+                                                                 self.datapackage)
+            self.timing_converter = self.workspace.get_row_converter(timing_resource)
+            self.initialize_file(self.timing_file, self.timing_converter.headers)
+        timing_file = self.timing_file if self.timing_converter else None
+        self.sink = ResultSink(self.result_file, self.run_file, self.error_file,
+                               timing_file=timing_file,
+                               **self.config.get('result_sink', {}))
         self.run_id = compat.str(uuid.uuid4().hex)
         self.timestamp = datetime.now(pytz.utc)
         self.all_scores = []
-        self.assess_timeliness = self.config['assess_timeliness']
-        self.timeliness_period = self.config['timeliness'].get('timeliness_period', 1)
-        self.max_score = 100
+        self.started_at = default_timer()
+        self.batch_durations = {}
+        self.batch_rows = 0
+        self.batch_bytes = 0
+        Scorer.__init__(self, utilities.get_data_quality_spec(self.config),
+                        self.config['assess_timeliness'],
+                        self.config['timeliness'].get('timeliness_period', 1),
+                        self.config.get('error_rows_sample', 0))
         required_resources = [self.result_file, self.source_file,
                               self.publisher_file, self.run_file]
         datapackage_check.check_database_completeness(required_resources)
         self.lookup = self.get_lookup()
+        utilities.resolve_dir(self.cache_dir)
+        self.fetched_cache = FetchedDataCache(self.cache_dir,
+                                              self.config.get('compress_fetched_data', False))
+        self.fingerprints = self.load_fingerprints()
+        self.new_fingerprints = {}
+        self.score_index = ScoreIndex(self.score_index_file, self.result_file,
+                                      self.latest_result_file)
 
     def run(self, pipeline):
         """Run on a Pipeline instance."""
 
-        with compat.UnicodeAppender(self.result_file, quoting=csv.QUOTE_MINIMAL) as result_file:
-            source = self.get_source(pipeline.data_source)
-            result_id = compat.str(uuid.uuid4().hex)
+        # Pipelines of a TimedBatch come with their fetch and validation timed
+        timer = getattr(pipeline, 'timer', None) or StageTimer()
+        timer.stop('validate')
+        source = self.get_scoring_source(pipeline.data_source)
+        with timer.time('score'):
+            score, error_stats = self.get_pipeline_score(pipeline, source)
+        report = self.get_pipeline_report_url(pipeline)
+        result_id = self.add_result(source, pipeline.data_source, score,
+                                    error_stats, report)
+
+        size = 0
+        if pipeline.data:
+            with timer.time('cache'):
+                self.fetch_data(pipeline.data.stream, pipeline.data.encoding, source)
+            size = self.fetched_cache.manifest[source['id']]['size']
+        self.add_timing(result_id, timer.durations, get_row_count(pipeline), size)
+
+    def add_outcome(self, outcome):
+        """Add the outcome of a source validated by a parallel batch worker.
+
+        Args:
+            outcome: dict with the `data_source`, `score`, `error_stats`,
+                     `timings` and `rows` of the source, and the hash and
+                     size of its fetched data as `blob`
+        """
+
+        source = self.get_scoring_source(outcome['data_source'])
+        self.all_scores.append(outcome['score'])
+        report = self.get_pipeline_report_url(None)
+        result_id = self.add_result(source, outcome['data_source'], outcome['score'],
+                                    outcome['error_stats'], report)
+
+        size = 0
+        if outcome['blob']:
+            digest, size = outcome['blob']
+            self.fetched_cache.add(source['id'], self.get_fetched_name(source),
+                                   digest, size)
+        self.add_timing(result_id, outcome['timings'], outcome['rows'], size)
+
+    def add_result(self, source, data_source, score, error_stats, report):
+        """Write the result of a source for this run and keep its fingerprint,
+           if one was taken. A fingerprint stored before is kept otherwise,
+           along with the result it was taken for.
+        """
+
+        result_id = compat.str(uuid.uuid4().hex)
+        schema = ''
+        summary = '' # TODO: how/what should a summary be?
+
+        result = [result_id, source['id'], source['publisher_id'],
+                  source['created_at'], data_source, schema, score,
+                  summary, self.run_id, self.timestamp, report]
+        self.write_result(result, error_stats)
+        fingerprint = self.new_fingerprints.pop(source['id'], None)
+        if fingerprint:
+            self.fingerprints[source['id']] = {'fingerprint': fingerprint,
+                                               'result_id': result_id}
+        return result_id
+
+    def add_timing(self, result_id, durations, rows, size):
+        """Write the time each stage of a result took and add it to the run totals
+
+        Args:
+            result_id: id of the timed result
+            durations: dict with the seconds spent on each stage
+            rows: number of rows validated
+            size: size of the fetched data in bytes
+        """
+
+        for stage, duration in durations.items():
+            self.batch_durations[stage] = self.batch_durations.get(stage, 0) + duration
+        self.batch_rows += rows
+        self.batch_bytes += size
+        self.write_timing(result_id, durations, rows, size, sum(durations.values()))
+
+    def write_timing(self, result_id, durations, rows, size, total_time):
+        """Write a row of the timing file, if the datapackage declares one"""
+
+        if self.timing_converter is None:
+            return
+        rows_per_second, mb_per_second = get_throughput(rows, size, total_time)
+        seconds = [durations.get(stage, 0) for stage in StageTimer.stages]
+        seconds.append(total_time)
+        entry = [result_id, self.run_id]
+        entry.extend('{0:.6f}'.format(value) for value in seconds)
+        entry.extend([size, rows, '{0:.3f}'.format(rows_per_second),
+                      '{0:.6f}'.format(mb_per_second)])
+        try:
+            self.sink.write_timing(self.timing_converter.serialize_row(*entry))
+        except jsontableschema.exceptions.MultipleInvalid as e:
+            for error in e.errors:
+                raise error
+
+    def write_result(self, result, error_stats):
+        """Write a result along with the occurrences of each of its errors
+
+        Args:
+            result: list of values for a row of the result file
+            error_stats: dict with stats on the errors of the result, None if
+                         they aren't known
+        """
+
+        result_id = result[0]
+        error_rows = []
+        if error_stats is not None:
+            error_rows = [[result_id, stats['processor'], error_id, stats['occurrences']]
+                          for error_id, stats in sorted(error_stats.items())]
+            # An empty error marks results that are known to have no errors
+            error_rows = error_rows or [[result_id, '', '', 0]]
+        try:
+            result_row = self.result_converter.serialize_row(*result)
+        except jsontableschema.exceptions.MultipleInvalid as e:
+            for error in e.errors:
+                raise error
+        self.sink.write_result(result_row, error_rows)
+
+    def rescore(self):
+        """Score the latest result of every source again from its stored error
+           occurrences and write the new scores as results of this run.
+
+        Results without stored errors, like those written before `error_file`
+        existed, are carried over to this run with their previous score.
+        """
+
+        sources = {source['id']: source for source in self.lookup.values()}
+        latest_results = {}
+        for position, row in enumerate(self.iter_results()):
+            if row['source_id'] in sources:
+                latest_results[row['source_id']] = (position, row)
+        results = [row for position, row in sorted(latest_results.values(),
+                                                   key=lambda item: item[0])]
+        result_positions = {result['id']: position
+                            for position, result in enumerate(results)}
+
+        positions = []
+        weights = []
+        occurrences = []
+        scored = [False] * len(results)
+        base_errors = [False] * len(results)
+        error_rows = [[] for result in results]
+        with compat.UnicodeDictReader(self.error_file) as error_file:
+            for row in error_file:
+                position = result_positions.get(row['result_id'])
+                if position is None:
+                    continue
+                scored[position] = True
+                error_rows[position].append(row)
+                if not row['error_id']:
+                    continue
+                if row['processor'] == 'base':
+                    base_errors[position] = True
+                    continue
+                positions.append(position)
+                weights.append(error_weight(self.dq_spec, row['processor'],
+                                            row['error_id']))
+                occurrences.append(int(row['occurrences']))
+
+        scores = score_error_occurrences(positions, weights, occurrences,
+                                         len(results), self.max_score)
+        for position, result in enumerate(results):
+            source = dict(sources[result['source_id']])
             source['created_at'] = utilities.date_from_string(source['created_at'])
-            if source['created_at'] is None:
-                raise ValueError(('No date could be extracted from `created_at`'
-                                 ' field in source: {0}.').format(source))
-            score = self.get_pipeline_score(pipeline, source)
-            data_source = pipeline.data_source
-            schema = ''
-            summary = '' # TODO: how/what should a summary be?
-            report = self.get_pipeline_report_url(pipeline)
-
-            result = [result_id, source['id'], source['publisher_id'],
-                      source['created_at'], data_source, schema, score,
-                      summary, self.run_id, self.timestamp, report]
+            if not scored[position]:
+                score = int(result['score'])
+                error_stats = None
+            else:
+                score = scores[position]
+                if base_errors[position]:
+                    score = 0
+                elif self.assess_timeliness:
+                    score -= self.get_publication_delay(source)
+                score = max(round(score), 0)
+                error_stats = {row['error_id']: {'processor': row['processor'],
+                                                 'occurrences': int(row['occurrences'])}
+                               for row in error_rows[position] if row['error_id']}
+            self.all_scores.append(score)
+
+            result_id = compat.str(uuid.uuid4().hex)
+            new_result = [result_id, result['source_id'],
+                          result['publisher_id'], source['created_at'],
+                          result['data'], result['schema'], score,
+                          result['summary'], self.run_id, self.timestamp,
+                          result['report']]
+            self.write_result(new_result, error_stats)
+            fingerprint = self.fingerprints.get(result['source_id'])
+            if fingerprint and fingerprint['result_id'] == result['id']:
+                fingerprint['result_id'] = result_id
+
+    def carry_forward_unchanged(self, workers=1):
+        """Carry the latest results of unchanged sources over to this run
+
+        Sources whose fingerprint is the same as when they were last validated
+        get a copy of their previous result, without being fetched again.
+        Return the path of a temporary file, in `data_dir`, with the rows of
+        `source_file` that still have to be validated.
+
+        Args:
+            workers: number of worker processes taking the fingerprints, 0
+                     for one per CPU
+        """
+
+        unchanged = {}
+        fingerprints = self.get_source_fingerprints(workers)
+        for source in self.lookup.values():
+            fingerprint = fingerprints[source['id']]
+            stored = self.fingerprints.get(source['id'], {})
+            if fingerprint:
+                self.new_fingerprints[source['id']] = fingerprint
+            if fingerprint and fingerprint == stored.get('fingerprint'):
+                unchanged[stored['result_id']] = source['id']
+
+        previous_results = {}
+        for row in self.iter_results():
+            if row['id'] in unchanged:
+                previous_results[row['id']] = row
+        # Results without stored errors are carried over without any either
+        error_stats = {result_id: None for result_id in previous_results}
+        with compat.UnicodeDictReader(self.error_file) as error_file:
+            for row in error_file:
+                if row['result_id'] not in error_stats:
+                    continue
+                stats = error_stats[row['result_id']]
+                if stats is None:
+                    stats = error_stats[row['result_id']] = {}
+                if row['error_id']:
+                    stats[row['error_id']] = {'processor': row['processor'],
+                                              'occurrences': int(row['occurrences'])}
+
+        for previous_id, previous in previous_results.items():
+            result_id = compat.str(uuid.uuid4().hex)
+            score = int(previous['score'])
+            result = [result_id, previous['source_id'], previous['publisher_id'],
+                      utilities.date_from_string(previous['created_at']),
+                      previous['data'], previous['schema'], score,
+                      previous['summary'], self.run_id, self.timestamp,
+                      previous['report']]
+            self.write_result(result, error_stats[previous_id])
+            self.all_scores.append(score)
+            fingerprint = self.new_fingerprints.pop(previous['source_id'])
+            self.fingerprints[previous['source_id']] = {'fingerprint': fingerprint,
+                                                        'result_id': result_id}
+
+        carried_sources = set(previous['source_id']
+                              for previous in previous_results.values())
+        changed_fd, changed_path = tempfile.mkstemp(suffix='.csv', dir=self.data_dir)
+        os.close(changed_fd)
+        with compat.UnicodeDictReader(self.source_file) as sources_file:
+            with compat.UnicodeWriter(changed_path) as changed_file:
+                changed_file.writerow(list(sources_file.header))
+                for row in sources_file:
+                    if row['id'] not in carried_sources:
+                        changed_file.writerow([row[key] for key in sources_file.header])
+        return changed_path
+
+    def get_source_fingerprints(self, workers=1):
+        """Return the fingerprint of each source by id, taken over a pool of
+           worker processes if there is more than one worker
+
+        Args:
+            workers: number of worker processes, 0 for one per CPU
+        """
+
+        sources = list(self.lookup.values())
+        jobs = [(source[self.data_key], self.fingerprint_timeout) for source in sources]
+        if workers == 1 or len(jobs) < 2:
+            data_fingerprints = [get_data_fingerprint(job) for job in jobs]
+        else:
+            workers = workers or multiprocessing.cpu_count()
+            pool = multiprocessing.Pool(min(workers, len(jobs)))
             try:
-                result_file.writerow(list(self.result_schema.convert_row(*result)))
-            except jsontableschema.exceptions.MultipleInvalid as e:
-                for error in e.errors:
-                    raise error
+                data_fingerprints = pool.map(get_data_fingerprint, jobs)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        return {source['id']: self.get_source_fingerprint(source, data_fingerprint)
+                for source, data_fingerprint in zip(sources, data_fingerprints)}
+
+    def get_source_fingerprint(self, source, data_fingerprint):
+        """Return a string that changes whenever the data of a source or the
+           fields of its row its score depends on change, or None if the data
+           has no fingerprint
 
-            if pipeline.data:
-                self.fetch_data(pipeline.data.stream, pipeline.data.encoding, source)
+        Args:
+            source: entry of `lookup`
+            data_fingerprint: fingerprint of the data of the source
+        """
+
+        if not data_fingerprint:
+            return None
+        fields = [source['publisher_id'], source['created_at'],
+                  source.get('period_id', '')]
+        fields_hash = hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+        return '{0} fields:{1}'.format(data_fingerprint, fields_hash)
+
+    def load_fingerprints(self):
+        """Return the fingerprints of sources as of their latest result"""
+
+        try:
+            with io.open(self.fingerprint_file, mode='rt', encoding='utf-8') as fingerprint_file:
+                return json.loads(fingerprint_file.read())
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_fingerprints(self):
+        """Save the fingerprints of sources along with their latest result"""
+
+        temp_path = '{0}.tmp'.format(self.fingerprint_file)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as fingerprint_file:
+            fingerprint_file.write(compat.str(json.dumps(self.fingerprints, indent=4,
+                                                         sort_keys=True)))
+        os.rename(temp_path, self.fingerprint_file)
 
     def get_lookup(self):
+        """Return an index of `source_file` rows keyed by their `data_key`
+
+        Rows sharing the same path are accepted only if they are identical,
+        otherwise DuplicateDataSourceError is raised while loading.
+        """
 
         _keys = ['id', 'publisher_id', self.data_key, 'created_at', 'title',
                  'period_id']
-        lookup = []
+        lookup = {}
 
         with compat.UnicodeDictReader(self.source_file) as sources_file:
             for row in sources_file:
-                lookup.append({k: v for k, v in row.items() if k in _keys})
+                source = {k: v for k, v in row.items() if k in _keys}
+                data_src = source[self.data_key]
+                existing = lookup.get(data_src)
+                if existing is None:
+                    lookup[data_src] = source
+                elif existing != source:
+                    raise exceptions.DuplicateDataSourceError(source=data_src)
 
         return lookup
 
@@ -100,46 +535,69 @@ class Aggregator(Task):
                 a_file.writerow(headers)
 
     def write_run(self):
-        """Write this run in the run file."""
+        """Write this run in the run file, along with its pending results
+           and the timing totals of its sources.
+        """
 
-        with compat.UnicodeAppender(self.run_file, quoting=csv.QUOTE_MINIMAL) as run_file:
-            entry = [self.run_id, self.timestamp, int(round(sum(self.all_scores) / len(self.lookup)))]
-            try:
-                run_file.writerow(list(self.run_schema.convert_row(*entry)))
-            except jsontableschema.exceptions.MultipleInvalid as e:
-                for error in e.errors:
-                    raise error
+        if self.batch_durations:
+            self.write_timing('', self.batch_durations, self.batch_rows,
+                              self.batch_bytes, default_timer() - self.started_at)
+        entry = [self.run_id, self.timestamp, int(round(sum(self.all_scores) / len(self.lookup)))]
+        try:
+            self.sink.write_run(self.run_converter.serialize_row(*entry))
+        except jsontableschema.exceptions.MultipleInvalid as e:
+            for error in e.errors:
+                raise error
+        self.save_fingerprints()
+        self.score_index.update()
 
         return True
 
+    def close(self):
+        """Write any pending results and close the result and run files,
+           then drop the fetched data of sources that no longer exist.
+        """
+
+        self.sink.close()
+        source_ids = set(source['id'] for source in self.lookup.values())
+        self.fetched_cache.save(source_ids)
+
     def fetch_data(self, data_stream, encoding, source):
         """Cache the data source in the /fetched directory"""
 
-        source_name = source.get('name', source[self.data_key].rsplit('/', 1)[-1])
-        source_name = source_name or source['id']
-        cached_file_name = os.path.join(self.cache_dir, source_name)
-        data_stream.seek(0)
+        self.fetched_cache.store(source['id'], self.get_fetched_name(source),
+                                 data_stream, encoding)
 
-        with io.open(cached_file_name, mode='w+', encoding=encoding) as fetched_file:
-            for line in data_stream:
-                fetched_file.write(line)
+    def get_fetched_name(self, source):
+        """Return the name the fetched data of a source is cached as"""
+
+        source_name = source.get('name', source[self.data_key].rsplit('/', 1)[-1])
+        return source_name or source['id']
 
     def get_source(self, data_src):
         """Find the entry correspoding to data_src from sources file"""
 
-        matches = [match for match in self.lookup if match[self.data_key] == data_src]
-
-        if len(matches) == 0:
+        try:
+            source = self.lookup[data_src]
+        except KeyError:
             raise exceptions.SourceNotFoundError(source=data_src)
-        elif len(matches) > 1:
-            for pos in range(len(matches)-1):
-                first_values = set(matches[pos].values())
-                second_values = set(matches[pos+1].values())
-                differences = first_values.symmetric_difference(second_values)
-                if len(differences) != 0:
-                    raise exceptions.DuplicateDataSourceError(source=data_src)
+        return dict(source)
+
+    def get_scoring_source(self, data_src):
+        """Return the source entry for data_src, with `created_at` as a date"""
+
+        source = self.get_source(data_src)
+        source['created_at'] = utilities.date_from_string(source['created_at'])
+        if source['created_at'] is None:
+            raise ValueError(('No date could be extracted from `created_at`'
+                             ' field in source: {0}.').format(source))
+        return source
+
+    def get_scorer(self):
+        """Return a Scorer with the scoring settings of this Aggregator"""
 
-        return matches[0]
+        return Scorer(self.dq_spec, self.assess_timeliness, self.timeliness_period,
+                      self.error_rows_sample, self.max_score)
 
     def get_pipeline_report_url(self, pipeline):
         """Return a URL to a report on this data."""
@@ -147,93 +605,253 @@ class Aggregator(Task):
         return self.config['goodtables']['goodtables_web']
 
     def get_pipeline_score(self, pipeline, source):
-        """Return a score for this pipeline run."""
+        """Return a score for this pipeline run, along with its error stats."""
 
-        score = self.max_score
-        report = pipeline.report.generate()
-        error_stats = self.get_error_stats(report)
-        base_errors = {err: stats for err, stats in error_stats.items()
-                       if stats['processor'] == 'base'}
-        if base_errors:
-            score = 0
-        else:
-            score = self.score_by_error_occurences(error_stats)
-            if self.assess_timeliness:
-                publication_delay = self.get_publication_delay(source)
-                score -= publication_delay
-        score = round(score)
-        if score < 0:
-            score = 0
+        score, error_stats = self.score_report(pipeline.report, source)
         self.all_scores.append(score)
-        return score
+        return score, error_stats
 
-    def get_publication_delay(self, source):
-        """Determine how long the data source publication was delayed"""
 
-        dates = {}
-        relevance_period = source['period_id'].split('/')
-        relevance_period = relevance_period + [None]*(2 - len(relevance_period))
-        dates['period_start'], dates['period_end'] = relevance_period
-        dates = {k: utilities.date_from_string(v) for k, v in dates.items()}
-        dates['period_end'] = dates['period_end'] or dates['period_start']
-        timely_until = dates['period_end'] + \
-                       timedelta(days=(self.timeliness_period * 30))
-        if dates['period_start'] <= source['created_at'] <= timely_until:
-            delay = 0
-        else:
-            delay = source['created_at'] - timely_until
-            delay = delay.days
-            if delay < 0:
-                delay = 0
-            delay = delay / 30.00
-        return delay
+class ErrorAccumulator(object):
 
-    def get_error_stats(self, report):
-        """Return dict with stats on errors"""
+    """Collect stats on the errors of a report, one result at a time.
 
-        results = report['results']
-        dq_spec = utilities.get_data_quality_spec()
-        error_stats = {}
-        for result in results:
-            if result['result_level'] == 'error':
-                error = error_stats.get(result['result_id'], None)
-                if not error:
-                    if result['processor'] == 'base':
-                        error_spec = {}
-                    else:
-                        error_number = result['result_id'].split('_')[-1]
-                        error_number = str(int(error_number) - 1)
-                        error_spec = dq_spec[result['processor']][error_number]
-                    new_stats = {'occurrences': 1, 'rows': [result['row_index']],
-                                 'weight': error_spec.get('weight', 1),
-                                 'processor': result['processor']}
-                    error_stats[result['result_id']] = new_stats
-                else:
-                    error['occurrences'] += 1
-                    error['rows'].append(result['row_index'])
-        return error_stats
+       Only the occurrences of each error are counted, along with the first
+       `rows_sample` row indexes where it occurs.
+    """
 
-    def score_by_error_occurences(self, error_stats):
-        """Score data source based on based on number of occurrences of each error
-           Algorithm: `total score - (error_weight * no_occurrences) /
-                        (Σ 1/no_occurrences )`
+    def __init__(self, dq_spec, rows_sample=0):
+        self.dq_spec = dq_spec
+        self.rows_sample = rows_sample
+        self.error_stats = {}
 
-           Args:
-                error_stats: dict with stats on each error
+    def add(self, result):
+        """Account for a report result."""
+
+        if result['result_level'] != 'error':
+            return
+        error = self.error_stats.get(result['result_id'], None)
+        if not error:
+            error = {'occurrences': 0, 'rows': [],
+                     'weight': error_weight(self.dq_spec, result['processor'],
+                                            result['result_id']),
+                     'processor': result['processor']}
+            self.error_stats[result['result_id']] = error
+        error['occurrences'] += 1
+        if len(error['rows']) < self.rows_sample:
+            error['rows'].append(result['row_index'])
+
+
+class ResultSink(object):
+
+    """Keep the result and run files open for a whole batch, writing rows
+       in buffered blocks of complete lines.
+
+       Results are flushed every `flush_rows` rows, every `flush_interval`
+       seconds and whenever a run is written, so a run never reaches the
+       run file before its results. Timings are only written if a
+       `timing_file` is given.
+
+       Result, timing and run rows are lists of text values, as serialized
+       by a RowConverter.
+    """
+
+    def __init__(self, result_file, run_file, error_file, buffer_size=65536,
+                 flush_rows=1000, flush_interval=30, timing_file=None):
+        self.result_file = result_file
+        self.run_file = run_file
+        self.error_file = error_file
+        self.timing_file = timing_file
+        self.buffer_size = buffer_size
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.result_writer = None
+        self.run_writer = None
+        self.error_writer = None
+        self.timing_writer = None
+        self.last_flush = time.time()
+
+    def open(self):
+        """Open the result and run files for appending, if not open yet."""
+
+        if self.result_writer is None:
+            options = {'buffering': self.buffer_size, 'quoting': csv.QUOTE_MINIMAL}
+            self.result_writer = compat.UnicodeBufferedAppender(self.result_file,
+                                                                **options)
+            self.run_writer = compat.UnicodeBufferedAppender(self.run_file,
+                                                             **options)
+            self.error_writer = compat.UnicodeBufferedAppender(self.error_file,
+                                                               **options)
+            self.result_writer.open()
+            self.run_writer.open()
+            self.error_writer.open()
+            if self.timing_file:
+                self.timing_writer = compat.UnicodeBufferedAppender(self.timing_file,
+                                                                    **options)
+                self.timing_writer.open()
+            self.last_flush = time.time()
+
+    def write_result(self, row, error_rows=()):
+        """Buffer a result row and the rows of its errors, flushing if the
+           flush policy says so.
         """
 
-        score = self.max_score
-        for error, stats in error_stats.items():
-            no_occurrences = stats['occurrences']
-            harmonic_mean_occ = no_occurrences / harmonic_number(no_occurrences)
-            error_impact = stats['weight'] * harmonic_mean_occ
-            score -= error_impact
-        return score
+        self.open()
+        self.error_writer.writerows(error_rows)
+        self.result_writer.writetextrow(row)
+        if self.result_writer.pending >= self.flush_rows or \
+           time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_timing(self, row):
+        """Buffer a timing row, to be flushed along with the results."""
+
+        self.open()
+        if self.timing_writer is not None:
+            self.timing_writer.writetextrow(row)
+
+    def write_run(self, row):
+        """Write a run row after all the results buffered so far."""
+
+        self.open()
+        self.run_writer.writetextrow(row)
+        self.flush()
+
+    def flush(self):
+        """Write buffered errors, results and timings, then buffered runs."""
+
+        if self.result_writer is not None:
+            self.error_writer.flush()
+            self.result_writer.flush()
+            if self.timing_writer is not None:
+                self.timing_writer.flush()
+            self.run_writer.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        """Flush and close the files, they are reopened on the next write."""
+
+        if self.result_writer is not None:
+            try:
+                self.error_writer.close()
+                self.result_writer.close()
+                if self.timing_writer is not None:
+                    self.timing_writer.close()
+            finally:
+                self.run_writer.close()
+            self.result_writer = None
+            self.run_writer = None
+            self.error_writer = None
+            self.timing_writer = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def get_data_fingerprint(job):
+    """Return the fingerprint of the data of a source, in a worker process
+
+    Args:
+        job: tuple with the path or url of the source and the timeout of the
+             request for its headers
+    """
+
+    data_src, timeout = job
+    return utilities.get_source_fingerprint(data_src, timeout)
+
+
+def get_row_count(pipeline):
+    """Return the number of rows a pipeline validated"""
+
+    if not pipeline.data or not pipeline.pipeline:
+        return 0
+    return pipeline.pipeline[0].row_count or 0
+
+
+def iter_report_results(report):
+    """Yield the results of a pipeline report one at a time and close it.
+
+       Unlike `report.generate()`, this never holds all the results in memory.
+    """
+
+    storage = report.storage
+    try:
+        if report.backend == 'yaml':
+            storage.seek(0)
+            entry_lines = []
+            for line in storage:
+                if line.startswith('- ') and entry_lines:
+                    yield yaml.load(''.join(entry_lines), Loader=yaml.Loader)[0]
+                    entry_lines = []
+                if not line.startswith('---'):
+                    entry_lines.append(line)
+            if entry_lines:
+                yield yaml.load(''.join(entry_lines), Loader=yaml.Loader)[0]
+        elif report.backend == 'client':
+            storage.seek(0)
+            for line in storage:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for result in storage.all():
+                yield result
+    finally:
+        report.close()
+
+
+def error_weight(dq_spec, processor, error_id):
+    """Return the weight given to an error by the data quality spec"""
+
+    if processor == 'base':
+        return 1
+    error_number = error_id.split('_')[-1]
+    error_number = str(int(error_number) - 1)
+    return dq_spec[processor][error_number].get('weight', 1)
+
+
+def score_error_occurrences(positions, weights, occurrences, results_count,
+                            max_score=100):
+    """Score many results at once, with the same algorithm as
+       `Scorer.score_by_error_occurences`.
+
+       Args:
+            positions: position of the result each error belongs to
+            weights: weight of each error
+            occurrences: number of occurrences of each error
+            results_count: number of results to score
+            max_score: score of a result without errors
+    """
+
+    numpy = compat.get_numpy()
+    if numpy is not None:
+        occurrences = numpy.asarray(occurrences, dtype=float)
+        impacts = numpy.asarray(weights, dtype=float) * occurrences / \
+                  harmonic_number(occurrences)
+        impacts = numpy.bincount(numpy.asarray(positions, dtype=int),
+                                 weights=impacts, minlength=results_count)
+        return (max_score - impacts).tolist()
+
+    scores = [max_score] * results_count
+    for position, weight, no_occurrences in zip(positions, weights, occurrences):
+        harmonic_mean_occ = no_occurrences / harmonic_number(no_occurrences)
+        scores[position] -= weight * harmonic_mean_occ
+    return scores
+
 
 def harmonic_number(n):
     """Return an approximate value of n-th harmonic number, based on the
         Euler-Mascheroni constant by the formula:  H(n)≈ln(n)+γ+1/2*n−1/12*n^2
+
+        `n` can also be a NumPy array, in which case an array is returned.
     """
 
     gamma = 0.57721566490153286
+    log = math.log
+    numpy = compat.get_numpy()
+    if numpy is not None and isinstance(n, numpy.ndarray):
+        log = numpy.log
     return gamma + log(n) + 0.5/n - 1./(12*n**2)
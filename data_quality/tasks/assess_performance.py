@@ -4,11 +4,15 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import io
+import json
 import pytz
 import dateutil
 import datetime
-import jsontableschema
 from data_quality import utilities, compat
+from data_quality.dates import parse_datetime
+from data_quality.score_index import ScoreIndex, get_file_checksum, get_file_stamp
 from .base_task import Task
 from .check_datapackage import DataPackageChecker
 
@@ -26,42 +30,323 @@ class PerformanceAssessor(Task):
         required_resources = [self.result_file, self.source_file,
                               self.publisher_file, self.run_file]
         datapackage_check.check_database_completeness(required_resources)
+        self.score_index = ScoreIndex(self.score_index_file, self.result_file,
+                                      self.latest_result_file)
 
-    def run(self):
-        """Write the performance for all publishers."""
+    def run(self, full=False):
+        """Write the performance for all publishers.
+
+        The state saved by the previous run is used to read only the results
+        added since then, and to compute again only the performances changed
+        by new scores or sources. Everything is computed again if `full` is
+        True or if the state doesn't match the database anymore.
+
+        Args:
+            full: compute the performance of all publishers from scratch
+        """
 
         publisher_ids = self.get_publishers()
         performance_resource = utilities.get_datapackage_resource(self.performance_file,
                                                                   self.datapackage)
-        performance_schema = jsontableschema.model.SchemaModel(performance_resource.descriptor['schema'])
-
-        with compat.UnicodeWriter(self.performance_file) as performance_file:
-            performance_file.writerow(performance_schema.headers)
-            available_periods = []
-
-            for publisher_id in publisher_ids:
-                sources = self.get_sources(publisher_id)
-                periods = self.get_unique_periods(sources)
-                available_periods += periods
-            all_periods = self.get_all_periods(available_periods)
-
-            publishers_performances = []
-            all_sources = []
-
-            for publisher_id in publisher_ids:
-                sources = self.get_sources(publisher_id)
-                performances = self.get_periods_data(publisher_id, all_periods,
-                                                     sources)
-                publishers_performances += performances
-                all_sources += sources
-                for row in utilities.dicts_to_schema_rows(performances,
-                                                          performance_schema):
-                    performance_file.writerow(row)
-
-            all_performances = self.get_periods_data('all', all_periods, all_sources)
-            for row in utilities.dicts_to_schema_rows(all_performances,
-                                                      performance_schema):
-                performance_file.writerow(row)
+        performance_converter = self.workspace.get_row_converter(performance_resource)
+
+        state = None if full else self.load_performance_state(publisher_ids)
+        results_offset = os.path.getsize(self.result_file)
+        if state is None:
+            latest_results = self.get_latest_results()
+        else:
+            latest_results = self.get_latest_results(state['latest_results'],
+                                                     state['results_offset'])
+        scores = {source_id: score for source_id, (timestamp, score)
+                  in latest_results.items()}
+        publishers_sources = self.get_publishers_sources(publisher_ids, scores)
+        available_periods = []
+
+        for publisher_id in publisher_ids:
+            periods = self.get_unique_periods(publishers_sources[publisher_id])
+            available_periods += periods
+        all_periods = self.get_all_periods(available_periods)
+        months = [compat.str(period) for period in all_periods]
+        sources_cells = self.get_sources_cells(publisher_ids, publishers_sources)
+
+        if state is not None and sources_cells is not None and \
+           months[:len(state['months'])] == state['months']:
+            cells = state['cells']
+            starts = self.update_cells(cells, state['sources_cells'],
+                                       sources_cells, months)
+            self.update_performance_file(performance_converter, publisher_ids, months,
+                                         len(state['months']), cells, starts)
+        else:
+            with compat.UnicodeWriter(self.performance_file) as performance_file:
+                performance_file.writerow(performance_converter.headers)
+                for performances in self.get_publishers_performances(publisher_ids,
+                                                                     all_periods,
+                                                                     publishers_sources):
+                    for row in utilities.dicts_to_schema_rows(performances,
+                                                              performance_converter,
+                                                              serialize=True):
+                        performance_file.writetextrow(row)
+            cells = self.get_cells(publisher_ids, sources_cells or {})
+
+        self.save_performance_state({
+            'publishers': publisher_ids, 'months': months,
+            'results_offset': results_offset, 'latest_results': latest_results,
+            'sources_cells': sources_cells, 'cells': cells})
+
+    def get_publishers_performances(self, publisher_ids, periods, publishers_sources):
+        """Return the performances by period of each publisher, followed by
+           those of all publishers together.
+
+        The performances are computed on NumPy arrays when NumPy is installed.
+
+        Args:
+            publisher_ids: list of publishers ids
+            periods: list of all available_periods
+            publishers_sources: dict with the list of sources of each publisher
+        """
+
+        if compat.get_numpy() is not None:
+            return self.get_publishers_performances_numpy(publisher_ids, periods,
+                                                          publishers_sources)
+
+        publishers_performances = []
+        all_sources = []
+
+        for publisher_id in publisher_ids:
+            sources = publishers_sources[publisher_id]
+            performances = self.get_periods_data(publisher_id, periods, sources)
+            publishers_performances.append(performances)
+            all_sources += sources
+
+        publishers_performances.append(self.get_periods_data('all', periods,
+                                                             all_sources))
+        return publishers_performances
+
+    def get_publishers_performances_numpy(self, publisher_ids, periods,
+                                          publishers_sources):
+        """Same as `get_publishers_performances`, with the sources as columns
+           of integers counted by publisher and period with `bincount`.
+        """
+
+        numpy = compat.get_numpy()
+        row_ids = list(publisher_ids) + ['all']
+        if not periods:
+            return [[] for publisher_id in row_ids]
+
+        first_month = periods[0].year * 12 + periods[0].month
+        periods_count = len(periods)
+        positions = []
+        months = []
+        scores = []
+        for position, publisher_id in enumerate(publisher_ids):
+            for source in publishers_sources[publisher_id]:
+                positions.append(position)
+                months.append(source['created_at'].year * 12 +
+                              source['created_at'].month - first_month)
+                scores.append(int(source['score']))
+        positions = numpy.array(positions, dtype=numpy.int64)
+        months = numpy.array(months, dtype=numpy.int64)
+        scores = numpy.array(scores, dtype=numpy.int64)
+
+        in_periods = (months >= 0) & (months < periods_count)
+        cells = positions[in_periods] * periods_count + months[in_periods]
+        scores = scores[in_periods]
+        shape = (len(publisher_ids), periods_count)
+        cells_count = shape[0] * shape[1]
+        files_counts = numpy.bincount(cells, minlength=cells_count).reshape(shape)
+        score_totals = numpy.bincount(cells, weights=scores,
+                                      minlength=cells_count).reshape(shape)
+        valid_counts = numpy.bincount(cells, weights=scores == 100,
+                                      minlength=cells_count).reshape(shape)
+        files_counts, score_totals, valid_counts = [
+            numpy.vstack([counts, counts.sum(axis=0)])
+            for counts in (files_counts, score_totals, valid_counts)]
+        files_counts_to_date = files_counts.cumsum(axis=1)
+        score_totals_to_date = score_totals.cumsum(axis=1)
+        valid_counts_to_date = valid_counts.cumsum(axis=1)
+
+        columns = {
+            'files_count': files_counts,
+            'score': average_scores(score_totals, files_counts),
+            'valid': valid_percentages(valid_counts, files_counts),
+            'files_count_to_date': files_counts_to_date,
+            'score_to_date': average_scores(score_totals_to_date,
+                                            files_counts_to_date),
+            'valid_to_date': valid_percentages(valid_counts_to_date,
+                                               files_counts_to_date)
+        }
+        columns = {name: column.tolist() for name, column in columns.items()}
+        months_of_creation = [compat.str(period) for period in periods]
+
+        publishers_performances = []
+        for row, publisher_id in enumerate(row_ids):
+            performances = []
+            for position, month_of_creation in enumerate(months_of_creation):
+                performance = {name: column[row][position]
+                               for name, column in columns.items()}
+                performance['publisher_id'] = publisher_id
+                performance['month_of_creation'] = month_of_creation
+                performances.append(performance)
+            publishers_performances.append(performances)
+        return publishers_performances
+
+    def get_sources_cells(self, publisher_ids, publishers_sources):
+        """Return dict with the position of the publisher, the month and the
+           score of each source, or None if publisher or source ids repeat.
+
+        Args:
+            publisher_ids: list of publishers ids
+            publishers_sources: dict with the list of sources of each publisher
+        """
+
+        if len(set(publisher_ids)) != len(publisher_ids):
+            return None
+        sources_cells = {}
+        for position, publisher_id in enumerate(publisher_ids):
+            for source in publishers_sources[publisher_id]:
+                if source['id'] in sources_cells:
+                    return None
+                month = compat.str(source['created_at'].replace(day=1))
+                sources_cells[source['id']] = [position, month, int(source['score'])]
+        return sources_cells
+
+    def get_cells(self, publisher_ids, sources_cells):
+        """Return the totals by month of each publisher, followed by those of
+           all publishers together, from the cells of the sources.
+
+        Args:
+            publisher_ids: list of publishers ids
+            sources_cells: dict with the cell of each source
+        """
+
+        cells = [{} for publisher_id in publisher_ids] + [{}]
+        self.update_cells(cells, {}, sources_cells, [])
+        return cells
+
+    def update_cells(self, cells, old_sources_cells, sources_cells, months):
+        """Move the sources whose cell changed to their new cell, and return
+           the position of the first month changed for each row of `cells`.
+
+        Args:
+            cells: totals by month of each publisher, then of all of them
+            old_sources_cells: dict with the cell of each source before
+            sources_cells: dict with the cell of each source now
+            months: list of the months performances are written for
+        """
+
+        month_positions = {month: position for position, month in enumerate(months)}
+        starts = [len(months)] * len(cells)
+
+        for source_id in set(old_sources_cells) | set(sources_cells):
+            old_cell = old_sources_cells.get(source_id)
+            cell = sources_cells.get(source_id)
+            if old_cell == cell:
+                continue
+            for changed_cell, sign in [(old_cell, -1), (cell, 1)]:
+                if changed_cell is None:
+                    continue
+                position, month, score = changed_cell
+                for row in [position, -1]:
+                    totals = cells[row].setdefault(month, [0, 0, 0])
+                    totals[0] += sign
+                    totals[1] += sign * score
+                    totals[2] += sign * (score == 100)
+                    if not totals[0]:
+                        del cells[row][month]
+                    if month in month_positions:
+                        starts[row] = min(starts[row], month_positions[month])
+        return starts
+
+    def update_performance_file(self, performance_converter, publisher_ids, months,
+                                old_months_count, cells, starts):
+        """Write performances again from the first changed month of each
+           publisher on, copying the rows before it from `performance_file`.
+
+        Args:
+            performance_converter: RowConverter of the performance file
+            publisher_ids: list of publishers ids
+            months: list of the months performances are written for
+            old_months_count: number of months in the current performance file
+            cells: totals by month of each publisher, then of all of them
+            starts: position of the first month changed for each row of `cells`
+        """
+
+        starts = [min(start, old_months_count) for start in starts]
+        if len(months) == old_months_count and \
+           all(start == old_months_count for start in starts):
+            return
+
+        temp_path = '{0}.tmp'.format(self.performance_file)
+        with compat.UnicodeReader(self.performance_file) as old_file:
+            with compat.UnicodeWriter(temp_path) as performance_file:
+                performance_file.writerow(next(old_file))
+                for row, publisher_id in enumerate(publisher_ids + ['all']):
+                    start = starts[row]
+                    for position in range(old_months_count):
+                        old_row = next(old_file)
+                        if position < start:
+                            performance_file.writetextrow(old_row)
+                    performances = self.get_performances(
+                        publisher_id, months[start:], cells[row],
+                        self.get_totals_to_date(cells[row], months[:start]))
+                    for performance_row in utilities.dicts_to_schema_rows(
+                            performances, performance_converter, serialize=True):
+                        performance_file.writetextrow(performance_row)
+        os.rename(temp_path, self.performance_file)
+
+    def get_totals_to_date(self, month_cells, months):
+        """Return the sum of the totals of `months`"""
+
+        totals_to_date = [0, 0, 0]
+        for month in months:
+            totals = month_cells.get(month)
+            if totals:
+                totals_to_date = [total + value for total, value
+                                  in zip(totals_to_date, totals)]
+        return totals_to_date
+
+    def load_performance_state(self, publisher_ids):
+        """Return the state saved by the previous run, or None if it can't be
+           used for updating the performance file.
+
+        Args:
+            publisher_ids: list of publishers ids
+        """
+
+        try:
+            with io.open(self.performance_state_file, mode='rt', encoding='utf-8') as state_file:
+                state = json.loads(state_file.read())
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('version') != 1 or state['publishers'] != publisher_ids or \
+           not os.path.exists(self.performance_file) or \
+           os.path.getsize(self.performance_file) != state['performance_size'] or \
+           state.get('latest_results_stamp') != get_file_stamp(self.latest_result_file) or \
+           os.path.getsize(self.result_file) < state['results_offset'] or \
+           get_file_checksum(self.result_file, state['results_offset']) != state['results_checksum']:
+            return None
+        return state
+
+    def save_performance_state(self, state):
+        """Save the state of the performance file, if it can be updated later
+
+        Args:
+            state: dict with the data needed for updating the performance file
+        """
+
+        if state['sources_cells'] is None:
+            if os.path.exists(self.performance_state_file):
+                os.remove(self.performance_state_file)
+            return
+        state = dict(state, version=1,
+                     results_checksum=get_file_checksum(self.result_file,
+                                                        state['results_offset']),
+                     performance_size=os.path.getsize(self.performance_file),
+                     latest_results_stamp=get_file_stamp(self.latest_result_file))
+        temp_path = '{0}.tmp'.format(self.performance_state_file)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as state_file:
+            state_file.write(compat.str(json.dumps(state, sort_keys=True)))
+        os.rename(temp_path, self.performance_state_file)
 
     def get_publishers(self):
         """Return list of publishers ids."""
@@ -73,20 +358,87 @@ class PerformanceAssessor(Task):
                 publisher_ids.append(row['id'])
         return publisher_ids
 
-    def get_sources(self, publisher_id):
-        """Return list of sources of a publisher with id, period and score. """
+    def get_publishers_sources(self, publisher_ids, scores=None):
+        """Return dict with the list of sources of each publisher, with id,
+           period and score.
+
+        `source_file` and `result_file` are read only once for all publishers.
+
+        Args:
+            publisher_ids: ids of the publishers whose sources are wanted
+            scores: dict with the latest score of each source, read from
+                    `result_file` if missing
+        """
 
-        sources = []
+        publishers_sources = {publisher_id: [] for publisher_id in publisher_ids}
 
         with compat.UnicodeDictReader(self.source_file) as sources_file:
             for row in sources_file:
-                source = {}
-                if row['publisher_id'] == publisher_id:
+                sources = publishers_sources.get(row['publisher_id'])
+                if sources is not None:
+                    source = {}
                     source['id'] = row['id']
                     source['created_at'] = utilities.date_from_string(row['created_at'])
-                    source['score'] = self.get_source_score(source['id'])
                     sources.append(source)
-        return sources
+
+        if scores is None:
+            source_ids = set(source['id'] for sources in publishers_sources.values()
+                             for source in sources)
+            scores = self.get_latest_scores(source_ids)
+        for sources in publishers_sources.values():
+            for source in sources:
+                source['score'] = scores.get(source['id'], 0)
+        return publishers_sources
+
+    def get_sources(self, publisher_id):
+        """Return list of sources of a publisher with id, period and score. """
+
+        return self.get_publishers_sources([publisher_id])[publisher_id]
+
+    def get_latest_scores(self, source_ids):
+        """Return dict with the score of the latest result of each source.
+
+        Args:
+            source_ids: ids of the sources whose score is wanted
+        """
+
+        latest_results = self.get_latest_results(source_ids=source_ids)
+        return {source_id: score for source_id, (timestamp, score)
+                in latest_results.items()}
+
+    def get_latest_results(self, latest_results=None, offset=0, source_ids=None):
+        """Return dict with the timestamp and score of the latest result of
+           each source.
+
+        Args:
+            latest_results: latest results found so far, updated in place,
+                            taken from the score index if missing
+            offset: position of the first row of `result_file` to read
+            source_ids: ids of the sources whose results are wanted, all if missing
+        """
+
+        if latest_results is None:
+            latest_results = {}
+            index = self.score_index.load()
+            if index is not None:
+                offset = index['results_size']
+                for source_id, latest in index['sources'].items():
+                    if source_ids is None or source_id in source_ids:
+                        latest_results[source_id] = [latest['timestamp'],
+                                                     latest['score']]
+        min_timestamp = pytz.timezone('UTC').localize(datetime.datetime.min)
+        for row in self.iter_results(offset):
+            if source_ids is not None and row['source_id'] not in source_ids:
+                continue
+            timestamp = parse_datetime(row['timestamp'])
+            latest_result = latest_results.get(row['source_id'])
+            latest_timestamp = min_timestamp
+            if latest_result is not None:
+                latest_timestamp = parse_datetime(latest_result[0])
+            if timestamp > latest_timestamp:
+                latest_results[row['source_id']] = [row['timestamp'],
+                                                     int(row['score'])]
+        return latest_results
 
     def get_source_score(self, source_id):
         """Return latest score of a source from results.
@@ -95,17 +447,7 @@ class PerformanceAssessor(Task):
             source_id: id of the source whose score is wanted
         """
 
-        score = 0
-        latest_timestamp = pytz.timezone('UTC').localize(datetime.datetime.min)
-
-        with compat.UnicodeDictReader(self.result_file) as result_file:
-            for row in result_file:
-                if row['source_id'] == source_id:
-                    timestamp = dateutil.parser.parse(row['timestamp'])
-                    if timestamp > latest_timestamp:
-                        latest_timestamp = timestamp
-                        score = int(row['score'])
-        return score
+        return self.get_latest_scores(set([source_id])).get(source_id, 0)
 
     def get_periods_data(self, publisher_id, periods, sources):
         """Return list of performances for a publisher, by period.
@@ -117,24 +459,66 @@ class PerformanceAssessor(Task):
 
         """
 
+        periods_totals = self.get_periods_totals(sources)
+        return self.get_performances(publisher_id, periods, periods_totals)
+
+    def get_performances(self, publisher_id, periods, periods_totals,
+                         totals_to_date=(0, 0, 0)):
+        """Return list of performances for a publisher, by period, from the
+           totals of each period.
+
+        Args:
+            publisher_id: publisher in dicussion
+            periods: list of periods to return the performance for
+            periods_totals: dict with the number of sources, their total score
+                            and the number of valid ones for each period
+            totals_to_date: the same totals for all the periods before `periods`
+
+        """
+
         performances = []
-        period_sources_to_date = []
+        files_count_to_date, score_total_to_date, valid_count_to_date = totals_to_date
 
         for period in periods:
-            period_sources = self.get_period_sources(period, sources)
-            period_sources_to_date += period_sources
+            files_count, score_total, valid_count = periods_totals.get(period,
+                                                                       (0, 0, 0))
+            files_count_to_date += files_count
+            score_total_to_date += score_total
+            valid_count_to_date += valid_count
             performance = {}
             performance['publisher_id'] = publisher_id
             performance['month_of_creation'] = compat.str(period)
-            performance['files_count'] = len(period_sources)
-            performance['score'] = self.get_period_score(period_sources)
-            performance['valid'] = self.get_period_valid(period_sources)
-            performance['score_to_date'] = self.get_period_score(period_sources_to_date)
-            performance['valid_to_date'] = self.get_period_valid(period_sources_to_date)
-            performance['files_count_to_date'] = len(period_sources_to_date)
+            performance['files_count'] = files_count
+            performance['score'] = self.get_average_score(score_total, files_count)
+            performance['valid'] = self.get_valid_percentage(valid_count, files_count)
+            performance['score_to_date'] = self.get_average_score(score_total_to_date,
+                                                                  files_count_to_date)
+            performance['valid_to_date'] = self.get_valid_percentage(valid_count_to_date,
+                                                                     files_count_to_date)
+            performance['files_count_to_date'] = files_count_to_date
             performances.append(performance)
         return performances
 
+    def get_periods_totals(self, sources):
+        """Return dict with the number of sources, their total score and the
+           number of valid ones for each period.
+
+        Args:
+            sources: list of sources
+
+        """
+
+        periods_totals = {}
+
+        for source in sources:
+            period = source['created_at'].replace(day=1)
+            files_count, score_total, valid_count = periods_totals.get(period,
+                                                                       (0, 0, 0))
+            score = int(source['score'])
+            periods_totals[period] = (files_count + 1, score_total + score,
+                                      valid_count + (score == 100))
+        return periods_totals
+
     def get_period_sources(self, period, sources):
         """Return list of sources for a period.
 
@@ -158,13 +542,23 @@ class PerformanceAssessor(Task):
             period_sources: sources correspoding to a certain period
         """
 
+        total = 0
+        for source in period_sources:
+            total += int(source['score'])
+        return self.get_average_score(total, len(period_sources))
+
+    def get_average_score(self, score_total, files_count):
+        """Return the rounded average score of `files_count` sources.
+
+        Args:
+            score_total: sum of the scores of the sources
+            files_count: number of sources
+        """
+
         score = 0
 
-        if len(period_sources) > 0:
-            total = 0
-            for source in period_sources:
-                total += int(source['score'])
-            score = int(round(total / len(period_sources)))
+        if files_count > 0:
+            score = int(round(score_total / files_count))
         return score
 
     def get_period_valid(self, period_sources):
@@ -174,14 +568,20 @@ class PerformanceAssessor(Task):
             period_sources: sources correspoding to a certain period
         """
 
+        valids = [source for source in period_sources if int(source['score']) == 100]
+        return self.get_valid_percentage(len(valids), len(period_sources))
+
+    def get_valid_percentage(self, valid_count, files_count):
+        """Return the rounded percentage of valid sources.
+
+        Args:
+            valid_count: number of valid sources
+            files_count: number of sources
+        """
+
         valid = 0
-        if len(period_sources) > 0:
-            valids = []
-            for source in period_sources:
-                if int(source['score']) == 100:
-                    valids.append(source)
-            if valids:
-                valid = int(round(len(valids) / len(period_sources) * 100))
+        if files_count > 0 and valid_count:
+            valid = int(round(valid_count / files_count * 100))
         return valid
 
     def get_unique_periods(self, sources):
@@ -217,3 +617,36 @@ class PerformanceAssessor(Task):
             all_periods.append(relative_date)
             relative_date += delta
         return all_periods
+
+
+def average_scores(score_totals, files_counts):
+    """Return the rounded average scores for arrays of totals and counts,
+       as `PerformanceAssessor.get_average_score` does for each of them.
+    """
+
+    numpy = compat.get_numpy()
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        averages = round_array(score_totals / files_counts)
+    return numpy.where(files_counts > 0, averages, 0).astype(numpy.int64)
+
+
+def valid_percentages(valid_counts, files_counts):
+    """Return the rounded valid percentages for arrays of counts, as
+       `PerformanceAssessor.get_valid_percentage` does for each of them.
+    """
+
+    numpy = compat.get_numpy()
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        percentages = round_array(valid_counts / files_counts * 100)
+    return numpy.where((files_counts > 0) & (valid_counts > 0),
+                       percentages, 0).astype(numpy.int64)
+
+
+def round_array(values):
+    """Round the values of an array the way the builtin `round` does"""
+
+    numpy = compat.get_numpy()
+    if compat.is_py3:
+        # Python 3 rounds halves to even, like NumPy
+        return numpy.rint(values)
+    return numpy.floor(values + 0.5)
@@ -5,7 +5,8 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
-import datapackage
+from data_quality import utilities
+from data_quality.workspace import get_workspace
 
 
 class Task(object):
@@ -18,10 +19,26 @@ class Task(object):
         self.branch = self.config['branch']
         self.data_dir = self.config['data_dir']
         self.result_file = os.path.join(self.data_dir, self.config['result_file'])
+        self.latest_result_file = os.path.join(self.data_dir,
+                                               self.config['latest_result_file'])
+        self.result_archive_dir = os.path.join(self.data_dir,
+                                               self.config['result_archive_dir'])
         self.run_file = os.path.join(self.data_dir, self.config['run_file'])
+        self.error_file = os.path.join(self.data_dir, self.config['error_file'])
+        self.timing_file = os.path.join(self.data_dir, self.config['timing_file'])
+        self.fingerprint_file = os.path.join(self.data_dir,
+                                             self.config['fingerprint_file'])
+        self.score_index_file = os.path.join(self.data_dir,
+                                             self.config['score_index_file'])
         self.source_file = os.path.join(self.data_dir, self.config['source_file'])
         self.performance_file = os.path.join(self.data_dir,
                                              self.config['performance_file'])
+        self.performance_state_file = os.path.join(self.data_dir,
+                                                   self.config['performance_state_file'])
+        self.period_state_file = os.path.join(self.data_dir,
+                                              self.config['period_state_file'])
+        self.content_state_file = os.path.join(self.data_dir,
+                                               self.config['content_state_file'])
         self.publisher_file = os.path.join(self.data_dir,
                                            self.config['publisher_file'])
         self.cache_dir = self.config['cache_dir']
@@ -30,10 +47,18 @@ class Task(object):
         if not os.path.isabs(datapkg_file_path):
             datapkg_file_path = os.path.join(os.path.dirname(self.data_dir),
                                              datapkg_file_path)
-        try:
-            self.datapackage = datapackage.DataPackage(datapkg_file_path)
-        except datapackage.exceptions.DataPackageException as e:
-            raise ValueError(('A datapackage couldn\'t be created because of the '
-                              'following error: "{0}". Make sure the file is not '
-                              'empty and use "dq init" command.').format(e))
-        self.all_scores = []
\ No newline at end of file
+        self.workspace = get_workspace(datapkg_file_path)
+        self.datapackage = self.workspace.datapackage
+        self.all_scores = []
+
+    def iter_results(self, offset=0):
+        """Iterate over the rows of `latest_result_file`, if results were
+           compacted, followed by the rows of `result_file`
+
+        Args:
+            offset: position of the first row of `result_file` to read, only
+                    `result_file` is read if given
+        """
+
+        return utilities.iter_results(self.result_file, self.latest_result_file,
+                                      offset)
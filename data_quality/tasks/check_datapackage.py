@@ -5,33 +5,54 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
-from jsontableschema.model import SchemaModel
-from goodtables import pipeline
-from data_quality import utilities
+import io
+import csv
+import gzip
+import json
+import hashlib
+import multiprocessing
+from data_quality import utilities, compat
+from data_quality.score_index import get_file_checksum
 from . import Task
 
+_worker_state = {}
+
 
 class DataPackageChecker(Task):
 
     """A task runner to check that the data package is correct"""
 
+    # Less than the rows goodtables checks by default, so ranges are checked whole
+    chunk_rows = 10000
+
     def __init__(self, config, inflexible_resources=[]):
         super(DataPackageChecker, self).__init__(config)
         self.inflexible_resources = ['run_file', 'result_file', 'performance_file']
         self.inflexible_resources.extend(inflexible_resources)
         self.inflexible_resources = set(inflexible_resources)
+        # Resources added after the first release, so older data packages may lack them
+        self.optional_resources = set(['timing_file', 'error_file', 'latest_result_file'])
 
     def run(self):
         """Check user datapackage against default datapackage"""
 
-        default_datapkg = utilities.get_default_datapackage()
+        default_datapkg = self.workspace.default_datapackage
         for default_resource in default_datapkg.resources:
             resource_path = os.path.join(self.config['data_dir'],
                                          self.config[default_resource.descriptor['name']])
+            if default_resource.descriptor['name'] in self.optional_resources and \
+               not self.has_resource(resource_path):
+                continue
             resource = utilities.get_datapackage_resource(resource_path,
                                                           self.datapackage)
             self.check_resource_schema(default_resource, resource)
 
+    def has_resource(self, resource_path):
+        """Return whether the datapackage has a resource at `resource_path`"""
+
+        return any(res.local_data_path == resource_path
+                   for res in self.datapackage.resources)
+
     def check_resource_schema(self, default_resource, resource):
         """Check that user resource schema contains all the mandatory fields"""
 
@@ -42,13 +63,9 @@ class DataPackageChecker(Task):
             fields = [field_filter(field) for field in schema.fields]
             fields = sorted(fields, key=lambda k: k['name'])
 
-        resource_schema = SchemaModel(resource.descriptor['schema'])
-        default_schema_dict = default_resource.descriptor['schema']
-        if default_resource.descriptor['name'] == 'source_file':
-            for field in default_schema_dict['fields']:
-                if field['name'] == 'data':
-                    field['name'] = self.data_key
-        default_schema = SchemaModel(default_schema_dict)
+        resource_schema = self.workspace.get_schema(resource)
+        default_schema = self.workspace.get_default_schema(default_resource,
+                                                           self.data_key)
 
         if default_resource.descriptor['name'] in self.inflexible_resources:
             if get_uncustomizable_fields(default_schema) != \
@@ -66,24 +83,190 @@ class DataPackageChecker(Task):
                        ).format(','.join(missing_headers), resource.local_data_path)
                 raise ValueError(msg, resource.local_data_path)
 
-    def check_database_content(self):
-        """Check that the database content is compliant with the datapackage"""
+    def check_database_content(self, include_archive=False, full=False, workers=1):
+        """Check that the database content is compliant with the datapackage
+
+        Only the rows appended to a resource since it was last found
+        compliant are checked, unless the rest of it or its schema changed
+        since then. How much of each resource was found compliant is kept
+        in `content_state_file`, along with hashes of the values of its
+        unique fields, which appended rows must not repeat.
+
+        The rows are checked in ranges of `chunk_rows` rows, in parallel if
+        there is more than one worker, and the values of unique fields are
+        compared across ranges once they are all checked. The issues of all
+        the resources are reported together.
+
+            Args:
+                include_archive: check the archived results as well as the
+                                 latest ones
+                full: check all the rows of every resource
+                workers: number of worker processes, 0 for one per CPU
+        """
 
         self.run()
+        archive_dir = os.path.join(self.result_archive_dir, '')
+        state = {} if full else self.load_content_state()
+        checks = []
+        jobs = []
         for resource in self.datapackage.resources:
             resource_path = resource.local_data_path
-            if os.path.exists(resource_path):
-                options = {'schema': {'schema': resource.descriptor['schema']}}
-                pipe = pipeline.Pipeline(resource_path, processors=['schema'],
-                                                 options=options)
-                result, report = pipe.run()
-                if result is False:
-                    issues = [res['result_message'] for res in report.generate()['results']]
-                    msg = ('The file {0} is not compliant with the schema '
-                           'you declared for it in "datapackage.json".'
-                           'Errors: {1}'
-                          ).format(resource_path, ';'.join(issues))
-                    raise ValueError(msg)
+            if not include_archive and resource_path.startswith(archive_dir):
+                continue
+            if not os.path.exists(resource_path):
+                continue
+            verified = state.get(resource_path)
+            check = self.plan_resource_check(resource, verified)
+            if check is None:
+                continue
+            ranges, verified = check
+            checks.append((resource_path, verified, len(ranges)))
+            jobs.extend((resource_path, start, end) for start, end in ranges)
+
+        if workers == 1 or len(jobs) < 2:
+            outcomes = [self.validate_content(*job) for job in jobs]
+        else:
+            outcomes = self.run_checks_in_parallel(jobs, workers)
+        reports = []
+        for resource_path, verified, jobs_count in checks:
+            resource_outcomes = outcomes[:jobs_count]
+            outcomes = outcomes[jobs_count:]
+            resource_issues = sum([issues for issues, values in resource_outcomes], [])
+            resource_issues.extend(find_repeated_values(
+                [values for issues, values in resource_outcomes],
+                verified['unique_hashes']))
+            if resource_issues:
+                reports.append(('The file {0} is not compliant with the schema '
+                                'you declared for it in "datapackage.json".'
+                                'Errors: {1}'
+                               ).format(resource_path, ';'.join(resource_issues)))
+            else:
+                state[resource_path] = verified
+        self.save_content_state(state)
+        if reports:
+            raise ValueError('\n'.join(reports))
+
+    def plan_resource_check(self, resource, verified=None):
+        """Return the ranges of rows of a resource that weren't found
+           compliant yet, as (start, end) positions, along with how much of it
+           will be compliant if they are, or None if there are none
+
+            Args:
+                resource: a resource of the datapackage
+                verified: dict returned when the resource was last checked
+        """
+
+        resource_path = resource.local_data_path
+        compressed = resource.descriptor.get('compression') == 'gzip'
+        schema_hash = get_schema_hash(resource.descriptor['schema'])
+        size = os.path.getsize(resource_path)
+        offset = 0
+        unique_hashes = {}
+        if verified is not None and verified['schema_hash'] == schema_hash and \
+           0 < verified['size'] <= size and \
+           get_file_checksum(resource_path, verified['size']) == verified['checksum']:
+            offset = verified['size']
+            unique_hashes = dict(verified['unique_hashes'])
+        if offset and offset == size:
+            return None
+
+        if compressed:
+            # Compressed files are rewritten as a whole, never appended to
+            ranges = [(0, None)]
+        else:
+            ranges = get_row_ranges(resource_path, offset, size, self.chunk_rows)
+            size = get_rows_end(resource_path, size)
+        return ranges, {'schema_hash': schema_hash, 'size': size,
+                        'checksum': get_file_checksum(resource_path, size),
+                        'unique_hashes': unique_hashes}
+
+    def run_checks_in_parallel(self, jobs, workers=None):
+        """Run the checks of `check_database_content` over a pool of worker
+           processes and return their outcomes in the same order
+
+        Args:
+            jobs: list of (resource path, start, end) tuples
+            workers: number of worker processes, defaults to the number of CPUs
+        """
+
+        workers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(min(workers, len(jobs)), initializer=init_worker,
+                                    initargs=(self.config,))
+        try:
+            outcomes = pool.map(run_check, jobs, chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return outcomes
+
+    def validate_content(self, resource_path, start=0, end=None):
+        """Return the issues found checking rows of a resource against its
+           schema with goodtables, along with the values of its unique fields
+           in these rows by field name
+
+            Args:
+                resource_path: path of a resource of the datapackage
+                start: position of the first row, 0 to check the whole file
+                end: position after the last row, None for the end of the file
+        """
+
+        from goodtables import pipeline
+
+        resource = utilities.get_datapackage_resource(resource_path, self.datapackage)
+        schema = resource.descriptor['schema']
+        options = {'schema': {'schema': schema}}
+        unique_fields = [field['name'] for field in schema['fields']
+                         if field.get('constraints', {}).get('unique') is True]
+        with self.get_content_data(resource, start, end) as data:
+            unique_values = get_unique_values(data, unique_fields)
+            data.seek(0)
+            pipe = pipeline.Pipeline(data, processors=['schema'], options=options)
+            result, report = pipe.run()
+        if result is False:
+            return [res['result_message'] for res in report.generate()['results']], \
+                   unique_values
+        return [], unique_values
+
+    def get_content_data(self, resource, offset=0, size=None):
+        """Return a text stream of a resource, or of the rows between `offset`
+           and `size` preceded by its headers
+        """
+
+        resource_path = resource.local_data_path
+        if resource.descriptor.get('compression') == 'gzip':
+            return io.TextIOWrapper(gzip.open(resource_path), encoding='utf-8')
+        if not offset and size is None:
+            return io.open(resource_path, mode='rt', encoding='utf-8')
+        with io.open(resource_path, mode='rb') as resource_file:
+            headers = resource_file.readline() if offset else b''
+            resource_file.seek(offset)
+            rows = resource_file.read(size - offset) if size is not None \
+                else resource_file.read()
+        return io.StringIO((headers + rows).decode('utf-8'))
+
+    def load_content_state(self):
+        """Return how much of each resource was last found compliant"""
+
+        try:
+            with io.open(self.content_state_file, mode='rt', encoding='utf-8') as state_file:
+                state = json.loads(state_file.read())
+        except (IOError, OSError, ValueError):
+            return {}
+        if state.get('version') != 2:
+            return {}
+        return state['resources']
+
+    def save_content_state(self, resources):
+        """Save how much of each resource was found compliant, atomically"""
+
+        state = {'version': 2, 'resources': resources}
+        temp_path = '{0}.tmp'.format(self.content_state_file)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as state_file:
+            state_file.write(compat.str(json.dumps(state, sort_keys=True)))
+        os.rename(temp_path, self.content_state_file)
 
     def check_database_completeness(self, required_resources=None):
         """Checks that 'required_resources', or all necessary ones exist in the database
@@ -100,3 +283,134 @@ class DataPackageChecker(Task):
                        'Please create it or use "dq generate".'
                       ).format(resource_file)
                 raise ValueError(msg)
+
+
+def init_worker(config):
+    """Keep the checker a worker process runs checks with"""
+
+    _worker_state['checker'] = DataPackageChecker(config)
+
+
+def run_check(job):
+    """Check a range of rows of a resource in a worker process and return
+       the issues found, along with the values of its unique fields
+
+    Args:
+        job: (resource path, start, end) tuple
+    """
+
+    return _worker_state['checker'].validate_content(*job)
+
+
+def get_schema_hash(schema):
+    """Return a hash of a resource schema"""
+
+    schema_json = json.dumps(schema, sort_keys=True)
+    return hashlib.sha1(schema_json.encode('utf-8')).hexdigest()
+
+
+def get_unique_values(data, field_names):
+    """Return the values of the fields named `field_names` in the rows of a
+       CSV text stream, by field name
+    """
+
+    if not field_names:
+        return {}
+    reader = csv.reader(compat.to_builtin_str(line) for line in data)
+    if compat.is_py2:
+        reader = ([value.decode('utf-8') for value in row] for row in reader)
+    headers = next(reader, [])
+    columns = [(name, headers.index(name)) for name in field_names if name in headers]
+    unique_values = {name: [] for name, column in columns}
+    for row in reader:
+        for name, column in columns:
+            if column < len(row):
+                unique_values[name].append(row[column])
+    return unique_values
+
+
+def find_repeated_values(ranges_values, unique_hashes):
+    """Return issues for the values of unique fields found in more than one
+       range of rows of a resource, or in the rows checked before, and add
+       the hashes of the values to `unique_hashes`
+
+    Values repeated within a range are already reported by goodtables.
+
+    Args:
+        ranges_values: values of the unique fields in each range, by field name
+        unique_hashes: hashes of the values of the rows checked before, by
+                       field name
+    """
+
+    issues = []
+    seen = {name: set(hashes) for name, hashes in unique_hashes.items()}
+    for range_values in ranges_values:
+        for name, values in range_values.items():
+            field_seen = seen.setdefault(name, set())
+            hashes = [get_value_hash(value) for value in values]
+            for value, value_hash in zip(values, hashes):
+                if value_hash in field_seen:
+                    issues.append(('Column "{0}" is a unique field, yet the value '
+                                   '"{1}" already exists.').format(name, value))
+            field_seen.update(hashes)
+    unique_hashes.update((name, sorted(hashes)) for name, hashes in seen.items())
+    return issues
+
+
+def get_value_hash(value):
+    """Return a short hash of a value, to keep in the content state"""
+
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]
+
+
+def get_rows_end(file_path, size):
+    """Return the position after the last complete row of the first `size`
+       bytes of a file
+    """
+
+    with io.open(file_path, mode='rb') as a_file:
+        position = size
+        while position > 0:
+            step = min(io.DEFAULT_BUFFER_SIZE, position)
+            position -= step
+            a_file.seek(position)
+            last_newline = a_file.read(step).rfind(b'\n')
+            if last_newline != -1:
+                return position + last_newline + 1
+    return 0
+
+
+def get_row_ranges(file_path, start, end, chunk_rows):
+    """Split the rows between positions `start` and `end` of a CSV file in
+       ranges of `chunk_rows` rows, returned as (start, end) tuples
+
+    A line break within quotes doesn't end a row, so rows with line breaks
+    in their values are never split.
+    """
+
+    ranges = []
+    with io.open(file_path, mode='rb') as a_file:
+        a_file.seek(start)
+        position = start
+        if not start:
+            position += len(a_file.readline(end))
+        range_start = start
+        rows = 0
+        quotes = 0
+        while position < end:
+            line = a_file.readline(end - position)
+            if not line:
+                break
+            position += len(line)
+            quotes += line.count(b'"')
+            if quotes % 2:
+                continue
+            quotes = 0
+            rows += 1
+            if rows == chunk_rows:
+                ranges.append((range_start, position))
+                range_start = position
+                rows = 0
+    if range_start < end or not ranges:
+        ranges.append((range_start, end))
+    return ranges
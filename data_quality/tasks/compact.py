@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import io
+import csv
+import copy
+import gzip
+import json
+import shutil
+import tempfile
+import collections
+from data_quality import utilities, compat
+from data_quality.dates import parse_datetime
+from data_quality.score_index import ScoreIndex
+from .base_task import Task
+from .check_datapackage import DataPackageChecker
+
+
+class ResultCompactor(Task):
+
+    """A Task runner that keeps only the latest result of each source in
+       `latest_result_file` and moves all the others from `result_file` to
+       an archive with one file per month.
+    """
+
+    def __init__(self, config, **kwargs):
+        super(ResultCompactor, self).__init__(config, **kwargs)
+        datapackage_check = DataPackageChecker(self.config)
+        datapackage_check.run()
+        datapackage_check.check_database_completeness([self.result_file])
+        self.result_resource = utilities.get_datapackage_resource(self.result_file,
+                                                                  self.datapackage)
+        result_schema = self.workspace.get_schema(self.result_resource)
+        self.headers = result_schema.headers
+        self.compress = self.config.get('compress_result_archive', False)
+
+    def run(self):
+        """Compact the results and add the files holding them to the datapackage
+
+        Rows are moved out of `result_file` only once they are in their archive
+        and in `latest_result_file`, so a compaction interrupted at any point
+        can be run again.
+        """
+
+        latest_results = collections.OrderedDict()
+        archives = {}
+        latest_ids = set()
+        try:
+            for row in self.iter_results():
+                if row['id'] in latest_ids:
+                    continue
+                timestamp = parse_datetime(row['timestamp'])
+                latest = latest_results.get(row['source_id'])
+                if latest is not None and timestamp < latest[0]:
+                    self.archive_row(archives, row, timestamp)
+                    continue
+                if latest is not None:
+                    latest_ids.discard(latest[1]['id'])
+                    self.archive_row(archives, latest[1], latest[0])
+                    del latest_results[row['source_id']]
+                latest_results[row['source_id']] = (timestamp, row)
+                latest_ids.add(row['id'])
+            for archive in archives.values():
+                archive.close()
+        except Exception:
+            for archive in archives.values():
+                archive.discard()
+            raise
+
+        for month, archive in sorted(archives.items()):
+            archive.save()
+        self.write_rows(self.latest_result_file,
+                        (row for timestamp, row in latest_results.values()))
+        self.write_rows(self.result_file, [])
+        ScoreIndex(self.score_index_file, self.result_file,
+                   self.latest_result_file).update()
+        self.update_datapackage(sorted(archives.items()))
+        print(('Kept {0} latest results, archived {1} results in {2} months.'
+              ).format(len(latest_results),
+                       sum(archive.added for archive in archives.values()),
+                       len(archives)))
+
+    def archive_row(self, archives, row, timestamp):
+        """Add a result row to the archive of the month it was written in"""
+
+        month = '{0:%Y-%m}'.format(timestamp)
+        archive = archives.get(month)
+        if archive is None:
+            archive = ResultArchive(self.get_archive_path(month), self.headers)
+            archives[month] = archive.open()
+        archive.add(row)
+
+    def get_archive_path(self, month):
+        """Return the path of the archive for `month`, compressed or not as
+           the archive already stored for that month
+        """
+
+        archive_path = os.path.join(self.result_archive_dir,
+                                    'results-{0}.csv'.format(month))
+        if os.path.exists(archive_path + '.gz') or \
+           (self.compress and not os.path.exists(archive_path)):
+            archive_path += '.gz'
+        return archive_path
+
+    def write_rows(self, file_path, rows):
+        """Replace the content of a results file with `rows`, atomically"""
+
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or None)
+        os.close(temp_fd)
+        try:
+            with compat.UnicodeWriter(temp_path, quoting=csv.QUOTE_MINIMAL) as result_file:
+                result_file.writerow(list(self.headers))
+                for row in rows:
+                    result_file.writetextrow([row[key] for key in self.headers])
+            os.chmod(temp_path, 0o644)
+            os.rename(temp_path, file_path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def update_datapackage(self, archives):
+        """Add `latest_result_file` and the archives to the datapackage
+
+        Args:
+            archives: list of (month, ResultArchive) tuples
+        """
+
+        resources = self.datapackage.descriptor['resources']
+        resource_paths = set(resource.local_data_path
+                             for resource in self.datapackage.resources)
+        new_resources = [('latest_result_file', self.latest_result_file, None)]
+        for month, archive in archives:
+            compression = 'gzip' if archive.compress else None
+            new_resources.append(('result_archive_{0}'.format(month),
+                                  archive.file_path, compression))
+
+        for name, file_path, compression in new_resources:
+            if file_path in resource_paths:
+                continue
+            resource = copy.deepcopy(self.result_resource.descriptor)
+            resource['name'] = name
+            resource['path'] = os.path.relpath(os.path.abspath(file_path),
+                                               os.path.abspath(self.datapackage.base_path))
+            if compression:
+                resource['compression'] = compression
+            resources.append(resource)
+
+        datapkg_path = os.path.join(self.datapackage.base_path, 'datapackage.json')
+        with io.open(datapkg_path, mode='w+', encoding='utf-8') as datapkg_file:
+            new_datapkg = json.dumps(self.datapackage.to_dict(), indent=4,
+                                     sort_keys=True)
+            datapkg_file.write(compat.str(new_datapkg))
+
+
+class ResultArchive(object):
+
+    """The archived results of a month, added to a copy of the archive which
+       replaces it once saved. Archives ending in ".gz" are gzip-compressed.
+    """
+
+    flush_rows = 1000
+
+    def __init__(self, file_path, headers):
+        self.file_path = file_path
+        self.headers = headers
+        self.compress = file_path.endswith('.gz')
+        self.added = 0
+        self.temp_path = None
+        self.writer = None
+
+    def open(self):
+        """Copy the archived results and start adding to the copy"""
+
+        utilities.resolve_dir(os.path.dirname(self.file_path))
+        temp_fd, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(self.file_path))
+        with io.open(temp_fd, mode='wb') as temp_file:
+            if os.path.exists(self.file_path):
+                with self.open_archive() as archive_file:
+                    shutil.copyfileobj(archive_file, temp_file)
+        self.archived_ids = set()
+        if os.path.getsize(self.temp_path):
+            with compat.UnicodeDictReader(self.temp_path) as archive_file:
+                self.archived_ids.update(row['id'] for row in archive_file)
+        else:
+            with compat.UnicodeWriter(self.temp_path, quoting=csv.QUOTE_MINIMAL) as archive_file:
+                archive_file.writerow(list(self.headers))
+        self.writer = compat.UnicodeBufferedAppender(self.temp_path,
+                                                     quoting=csv.QUOTE_MINIMAL)
+        self.writer.open()
+        return self
+
+    def open_archive(self):
+        if self.compress:
+            return gzip.open(self.file_path, 'rb')
+        return io.open(self.file_path, mode='rb')
+
+    def add(self, row):
+        """Archive a result row, unless it was archived before"""
+
+        if row['id'] in self.archived_ids:
+            return
+        self.archived_ids.add(row['id'])
+        self.writer.writetextrow([row[key] for key in self.headers])
+        self.added += 1
+        if self.writer.pending >= self.flush_rows:
+            self.writer.flush()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def discard(self):
+        """Close the copy and remove it, leaving the archive as it was"""
+
+        self.close()
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+    def save(self):
+        """Replace the archive with the copy the results were added to"""
+
+        try:
+            if self.compress:
+                compressed_path = '{0}.gz'.format(self.temp_path)
+                with io.open(self.temp_path, mode='rb') as temp_file:
+                    with gzip.open(compressed_path, 'wb') as compressed_file:
+                        shutil.copyfileobj(temp_file, compressed_file)
+                os.unlink(self.temp_path)
+                self.temp_path = compressed_path
+            os.chmod(self.temp_path, 0o644)
+            os.rename(self.temp_path, self.file_path)
+        except Exception:
+            os.unlink(self.temp_path)
+            raise
@@ -31,15 +31,20 @@ class Deployer(Task):
     tag_msg = 'New result and run data.'
     tag_version = ''
 
-    def run(self, simulate=False, *args):
-        """Commit and deploy changes."""
+    def run(self, simulate=False, workers=1, *args):
+        """Commit and deploy changes.
+
+        Args:
+            simulate: commit the changes without pushing them
+            workers: number of processes checking the database content
+        """
 
         datapackage_check = DataPackageChecker(self.config)
         datapackage_check.run()
         self._pull()
         self.update_last_modified()
         datapackage_check.check_database_completeness()
-        datapackage_check.check_database_content()
+        datapackage_check.check_database_content(workers=workers)
         self._add()
         self._commit()
         if simulate:
@@ -71,6 +76,26 @@ class Deployer(Task):
             subprocess.call(command)
             command = ['git', 'add', self.run_file]
             subprocess.call(command)
+            command = ['git', 'add', self.error_file]
+            subprocess.call(command)
+            if os.path.exists(self.fingerprint_file):
+                command = ['git', 'add', self.fingerprint_file]
+                subprocess.call(command)
+            if os.path.exists(self.score_index_file):
+                command = ['git', 'add', self.score_index_file]
+                subprocess.call(command)
+            if os.path.exists(self.period_state_file):
+                command = ['git', 'add', self.period_state_file]
+                subprocess.call(command)
+            if os.path.exists(self.timing_file):
+                command = ['git', 'add', self.timing_file]
+                subprocess.call(command)
+            if os.path.exists(self.latest_result_file):
+                command = ['git', 'add', self.latest_result_file]
+                subprocess.call(command)
+            if os.path.exists(self.result_archive_dir):
+                command = ['git', 'add', self.result_archive_dir]
+                subprocess.call(command)
 
     def _commit(self):
 
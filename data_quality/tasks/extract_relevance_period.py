@@ -4,20 +4,52 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import io
 import re
+import copy
+import json
+import shutil
+import hashlib
+import calendar
 import datetime
-from dateparser.date import DateDataParser
+import tempfile
+import itertools
+import multiprocessing
 from jsontableschema.model import SchemaModel
 from data_quality import utilities, compat, exceptions
+from data_quality.dates import LRUCache
+from data_quality.converters import RowConverter
 from .base_task import Task
 from .check_datapackage import DataPackageChecker
 
+# Month names and abbreviations in English, the language most dates are in
+_month_names = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+                'august', 'september', 'october', 'november', 'december']
+_month_numbers = dict([(name, number) for number, name in enumerate(_month_names, 1)] +
+                      [(name[:3], number) for number, name in enumerate(_month_names, 1)] +
+                      [('sept', 9)])
+_numeric_date_pattern = re.compile(r'^(\d{1,2})([ /._-])(\d{1,2})\2((?:19|20)\d{2})$')
+_named_date_pattern = re.compile(r'^(?:(\d{1,2}) )?(' +
+                                 '|'.join(sorted(_month_numbers, key=len, reverse=True)) +
+                                 r') ?((?:19|20)\d{2})$', re.IGNORECASE)
+# Amounts like the "25k" of "Spend over £25k" and quarters like "Q3", in which
+# dateparser finds no date
+_no_date_pattern = re.compile(r'(?:^| )(?:\d+k|q[1-4])(?: |$)', re.IGNORECASE)
+_period_id_pattern = re.compile(r'^(\d{2}-\d{2}-\d{4})/(\d{2}-\d{2}-\d{4})$')
+_worker_state = {}
+
 class RelevancePeriodExtractor(Task):
 
     """A Task runner that extracts the period a sources's content reffers to
         (is relevant for).
     """
 
+    # How many strings the dates found by dateparser are remembered for
+    parsed_dates_size = 10000
+    # How many sources are sent to a worker process at once
+    sources_per_job = 100
+
     def __init__(self, config):
         super(RelevancePeriodExtractor, self).__init__(config)
         timeliness_params = self.config['timeliness']
@@ -29,6 +61,8 @@ class RelevancePeriodExtractor(Task):
             raise ValueError('You need to provide values for "timeliness_strategy."')
         datapackage_check = DataPackageChecker(self.config)
         datapackage_check.check_database_completeness([self.source_file])
+        # dateparser takes long to import, so it's only imported when needed
+        from dateparser.date import DateDataParser
         settings = {'RETURN_AS_TIMEZONE_AWARE': False,
                     'PREFER_DAY_OF_MONTH': 'last',
                     'PREFER_DATES_FROM': 'past',
@@ -36,39 +70,69 @@ class RelevancePeriodExtractor(Task):
                     'DATE_ORDER': self.date_order}
         self.date_parser = DateDataParser(allow_redetect_language=True,
                                           settings=settings)
+        self.parsed_dates = LRUCache(self.parsed_dates_size)
+        self.recognised_dates = 0
 
-    def run(self):
-        """Try to indentify the relevance period of sources"""
-
-        sources = self.extract_period_from_sources()
-        empty_period_sources = [source for source in sources
-                                if source['period_id'] is None]
-        empty_period_percent = (len(empty_period_sources) * 100) / len(sources)
-        empty_period_percent = round(empty_period_percent)
-        if empty_period_percent > int(self.max_empty_relevance_period):
-            msg = ('The relevance period couldn\'t be identified for'
-                   ' {0}% of sources therefore timeliness cannot be'
-                   ' assessed. Please provide more fields for "timeliness_'
-                   'strategy", set "assess_timeliness" to false or increase'
-                   ' "max_empty_relevance_period".').format(empty_period_percent)
-            raise exceptions.UnableToAssessTimeliness(msg)
+    def run(self, workers=1):
+        """Try to indentify the relevance period of sources
 
-        for source in sources:
-            if source['period_id'] is None:
-                creation_date = utilities.date_from_string(source['created_at'])
-                dates = [creation_date, creation_date]
-            else:
-                period_start, period_end = source['period_id']
-                dates = [period_start.date(), period_end.date()]
-            dates = [date.strftime('%d-%m-%Y') if isinstance(date, datetime.date)
-                     else '' for date in dates]
-            source['period_id'] = '/'.join(dates)
-        self.update_sources_period(sources)
+        Sources that already have a `period_id` keep it, unless
+        `timeliness_strategy` or `date_order` changed since it was found.
+        The sources are written to a temporary file which replaces
+        `source_file` once all of them have a period.
+
+        Args:
+            workers: number of processes identifying periods, one per CPU if 0
+        """
 
-    def extract_period_from_sources(self):
-        """Try to extract relevance period for each source or return None"""
+        state = self.load_period_state()
+        keep_periods = state is not None
+        kept_empty_ids = set(state['empty_period_ids'] if keep_periods else [])
+        source_converter = self.get_source_converter()
+        empty_period_ids = []
+        sources_count = 0
+        temp_fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.source_file))
+        os.close(temp_fd)
+        try:
+            with compat.UnicodeWriter(temp_path) as source_file:
+                source_file.writerow(source_converter.headers)
+                for source in self.extract_period_from_sources(workers, keep_periods):
+                    sources_count += 1
+                    period = source['period_id']
+                    if period is None or (isinstance(period, compat.basestring) and
+                                          source['id'] in kept_empty_ids):
+                        empty_period_ids.append(source['id'])
+                    source['period_id'] = format_period_id(period, source['created_at'])
+                    for row in utilities.dicts_to_schema_rows([source], source_converter,
+                                                              serialize=True):
+                        source_file.writetextrow(row)
+
+            empty_period_percent = (len(empty_period_ids) * 100) / sources_count
+            empty_period_percent = round(empty_period_percent)
+            if empty_period_percent > int(self.max_empty_relevance_period):
+                msg = ('The relevance period couldn\'t be identified for'
+                       ' {0}% of sources therefore timeliness cannot be'
+                       ' assessed. Please provide more fields for "timeliness_'
+                       'strategy", set "assess_timeliness" to false or increase'
+                       ' "max_empty_relevance_period".').format(empty_period_percent)
+                raise exceptions.UnableToAssessTimeliness(msg)
+            shutil.copymode(self.source_file, temp_path)
+            os.rename(temp_path, self.source_file)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        self.save_period_state(empty_period_ids)
+
+    def extract_period_from_sources(self, workers=1, keep_periods=False):
+        """Iterate over the sources with their relevance period as
+           `period_id`, or None if it couldn't be extracted
+
+        Args:
+            workers: number of processes identifying periods, one per CPU if 0
+            keep_periods: whether sources that already have a `period_id`
+                          keep it as it is, instead of having it extracted
+        """
 
-        sources = []
         with compat.UnicodeDictReader(self.source_file) as source_file:
             timeliness_set = set(self.timeliness_strategy)
             found_fields = timeliness_set.intersection(set(source_file.header))
@@ -80,14 +144,87 @@ class RelevancePeriodExtractor(Task):
                 print(('Fields "{0}" from "timeliness_strategy" were not found '
                        'in your `source_file`').format(missing_fields))
 
-            for source in source_file:
-                timeliness_fields = {field: val for field, val in source.items()
-                                     if field in self.timeliness_strategy}
-                extracted_period = self.identify_period(timeliness_fields)
-                source['period_id'] = extracted_period
-                sources.append(source)
+            jobs = self.iter_jobs(source_file, keep_periods)
+            if workers == 1:
+                for job in jobs:
+                    for source in self.identify_periods(job):
+                        yield source
+            else:
+                for source in self.identify_periods_in_parallel(jobs, workers):
+                    yield source
+
+    def iter_jobs(self, sources, keep_periods=False):
+        """Group sources in lists of `sources_per_job` (source, fields) tuples,
+           where fields are the `timeliness_strategy` fields of the source, or
+           None if it keeps its `period_id`
+
+        Args:
+            sources: iterable of dicts corresponding to source_file rows
+            keep_periods: whether sources that already have a `period_id`
+                          keep it
+        """
+
+        job = []
+        for source in sources:
+            if keep_periods and is_period_id(source.get('period_id')):
+                fields = None
+            else:
+                fields = {field: val for field, val in source.items()
+                          if field in self.timeliness_strategy}
+            job.append((source, fields))
+            if len(job) == self.sources_per_job:
+                yield job
+                job = []
+        if job:
+            yield job
+
+    def identify_periods(self, job):
+        """Set the period of each source of a job that doesn't keep its own
+           and return the sources
+
+        Args:
+            job: list of (source, fields) tuples made by `iter_jobs`
+        """
+
+        sources = []
+        for source, fields in job:
+            if fields is not None:
+                source['period_id'] = self.identify_period(fields)
+            sources.append(source)
         return sources
 
+    def identify_periods_in_parallel(self, jobs, workers=None):
+        """Identify the periods of sources over a pool of worker processes,
+           each with its own date parser, and iterate over the sources in the
+           same order
+
+        Only a few jobs per worker are read ahead, so the sources aren't all
+        held in memory.
+
+        Args:
+            jobs: iterable of jobs made by `iter_jobs`
+            workers: number of worker processes, defaults to the number of CPUs
+        """
+
+        workers = workers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(workers, initializer=init_worker,
+                                    initargs=(self.config,))
+        try:
+            while True:
+                jobs_ahead = list(itertools.islice(jobs, workers * 4))
+                if not jobs_ahead:
+                    break
+                for sources, date_counts in pool.imap(identify_periods, jobs_ahead):
+                    self.add_date_counts(date_counts)
+                    for source in sources:
+                        yield source
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
     def identify_period(self, source={}):
         """Try to indentify the period of a source based on timeliess strategy
 
@@ -156,7 +293,7 @@ class RelevancePeriodExtractor(Task):
 
         for potential_date in potential_dates:
             try:
-                dates.append(self.date_parser.get_date_data(potential_date))
+                dates.append(self.get_date_data(potential_date))
             except TypeError:
                 if isinstance(potential_date, dict):
                     dates.append(potential_date)
@@ -228,7 +365,7 @@ class RelevancePeriodExtractor(Task):
                     date_parts.insert(index, '31')
             potential_date = ' '.join(date_parts[index:])
             try:
-                date = self.date_parser.get_date_data(potential_date)
+                date = self.get_date_data(potential_date)
             except (ValueError, TypeError):
                 date = None
             if date and date.get('date_obj') is not None:
@@ -237,23 +374,146 @@ class RelevancePeriodExtractor(Task):
             date = None
         return date
 
-    def update_sources_period(self, new_sources):
-        """Overwrite source_file with the identified period_id"""
+    def get_date_data(self, date_string):
+        """Return the date dateparser finds in a string, as a dict with its
+           `date_obj` and `period`, remembering it for the next time the
+           same string is seen
+
+        Strings of the most common shapes are read directly instead.
+
+        Args:
+            date_string: a string that could contain a date
+        """
+
+        if not isinstance(date_string, compat.basestring):
+            return self.date_parser.get_date_data(date_string)
+        date = match_common_date(date_string, self.date_order)
+        if date is not None:
+            self.recognised_dates += 1
+            return date
+        date = self.parsed_dates.get(date_string)
+        if date is None:
+            date = self.date_parser.get_date_data(date_string)
+            self.parsed_dates.set(date_string, date)
+        return dict(date)
+
+    def get_date_counts(self):
+        """Return how many dates were recognised, remembered and parsed"""
+
+        return [self.recognised_dates, self.parsed_dates.hits,
+                self.parsed_dates.misses]
+
+    def add_date_counts(self, date_counts):
+        """Add the dates counted by `get_date_counts` of another extractor"""
+
+        recognised, remembered, parsed = date_counts
+        self.recognised_dates += recognised
+        self.parsed_dates.hits += remembered
+        self.parsed_dates.misses += parsed
+
+    def get_source_converter(self):
+        """Return the RowConverter of source_file, with the `period_id` field"""
 
         source_resource = utilities.get_datapackage_resource(self.source_file,
                                                              self.datapackage)
-        source_idx = self.datapackage.resources.index(source_resource)
-        source_schema_dict = self.datapackage.resources[source_idx].descriptor['schema']
+        # The schema of the shared datapackage is left as it is
+        source_schema_dict = copy.deepcopy(source_resource.descriptor['schema'])
         updates = {'fields':[{'name': 'period_id', 'type': 'string',
                    'title': 'The period source data is relevant for.'}]}
         utilities.deep_update_dict(source_schema_dict, updates)
-        source_schema = SchemaModel(source_schema_dict)
+        return RowConverter(SchemaModel(source_schema_dict))
+
+    def get_timeliness_fingerprint(self):
+        """Return a hash of the options the periods are extracted with"""
+
+        options = {'timeliness_strategy': self.timeliness_strategy,
+                   'date_order': self.date_order}
+        options = json.dumps(options, sort_keys=True)
+        return hashlib.sha1(options.encode('utf-8')).hexdigest()
+
+    def load_period_state(self):
+        """Return the state saved by the previous run, or None if the periods
+           it found can't be kept
+        """
+
+        try:
+            with io.open(self.period_state_file, mode='rt', encoding='utf-8') as state_file:
+                state = json.loads(state_file.read())
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('version') != 1 or \
+           state['timeliness_fingerprint'] != self.get_timeliness_fingerprint():
+            return None
+        return state
 
-        with compat.UnicodeWriter(self.source_file) as source_file:
-            source_file.writerow(source_schema.headers)
-            for row in utilities.dicts_to_schema_rows(new_sources,
-                                                      source_schema):
-                source_file.writerow(row)
+    def save_period_state(self, empty_period_ids):
+        """Save the options the periods were found with
+
+        Args:
+            empty_period_ids: list of ids of the sources whose period couldn't
+                              be found, and was set from `created_at`
+        """
+
+        state = {'version': 1, 'empty_period_ids': empty_period_ids,
+                 'timeliness_fingerprint': self.get_timeliness_fingerprint()}
+        temp_path = '{0}.tmp'.format(self.period_state_file)
+        with io.open(temp_path, mode='w+', encoding='utf-8') as state_file:
+            state_file.write(compat.str(json.dumps(state, sort_keys=True)))
+        os.rename(temp_path, self.period_state_file)
+
+def init_worker(config):
+    """Keep the extractor a worker process identifies periods with"""
+
+    _worker_state['extractor'] = RelevancePeriodExtractor(config)
+
+def identify_periods(job):
+    """Identify the periods of the sources of a job in a worker process and
+       return the sources along with the dates counted while identifying them
+
+    Args:
+        job: list of (source, fields) tuples made by `iter_jobs`
+    """
+
+    extractor = _worker_state['extractor']
+    counts_before = extractor.get_date_counts()
+    sources = extractor.identify_periods(job)
+    date_counts = [count - count_before for count, count_before
+                   in zip(extractor.get_date_counts(), counts_before)]
+    return sources, date_counts
+
+def format_period_id(period, created_at):
+    """Return a period as the `period_id` written in source_file
+
+    Args:
+        period: tuple of datetimes, a `period_id` kept as it is or None to
+                use the creation date of the source
+        created_at: creation date of the source
+    """
+
+    if isinstance(period, compat.basestring):
+        return period
+    if period is None:
+        creation_date = utilities.date_from_string(created_at)
+        dates = [creation_date, creation_date]
+    else:
+        period_start, period_end = period
+        dates = [period_start.date(), period_end.date()]
+    dates = [date.strftime('%d-%m-%Y') if isinstance(date, datetime.date)
+             else '' for date in dates]
+    return '/'.join(dates)
+
+def is_period_id(value):
+    """Whether a value is a complete `period_id`, as written in source_file"""
+
+    match = _period_id_pattern.match(value or '')
+    if not match:
+        return False
+    try:
+        for date in match.groups():
+            datetime.datetime.strptime(date, '%d-%m-%Y')
+    except ValueError:
+        return False
+    return True
 
 def resolve_period(dates=None):
     """Given a list of dates, try to create a period tuple or return None"""
@@ -291,6 +551,47 @@ def period_from_date(date={}):
         range_end = datetime.datetime(date['date_obj'].year, 12, 31)
     return (range_start, range_end)
 
+def match_common_date(date_string, date_order='DMY'):
+    """Return the date dict dateparser would create from a string of a
+       common shape, like "01/04/2016", "30 April 2014" or "Sept2014", or
+       None if the string should be left to dateparser
+
+    Strings with an amount like "25k" or a quarter like "Q3" have no date.
+
+    Args:
+        date_string: a string that could contain a date
+        date_order: order of the day, month and year in `date_string`
+    """
+
+    if _no_date_pattern.search(date_string):
+        return {'date_obj': None, 'period': 'day'}
+    if date_order not in ('DMY', 'MDY'):
+        return None
+    match = _numeric_date_pattern.match(date_string)
+    if match:
+        first, separator, second, year = match.groups()
+        if date_order == 'DMY':
+            day, month = first, second
+        else:
+            day, month = second, first
+        month = int(month)
+        period = 'day'
+    else:
+        match = _named_date_pattern.match(date_string)
+        if not match:
+            return None
+        day, month, year = match.groups()
+        month = _month_numbers[month.lower()]
+        period = 'day' if day else 'month'
+    year = int(year)
+    if not 1 <= month <= 12:
+        return None
+    last_day = calendar.monthrange(year, month)[1]
+    day = int(day) if day else last_day
+    if not 1 <= day <= last_day:
+        return None
+    return {'date_obj': datetime.datetime(year, month, day), 'period': period}
+
 def filter_years(words_list):
     """Filter strings that could contain a year from a list of words"""
 
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import timeit
+import contextlib
+
+default_timer = timeit.default_timer
+
+
+class StageTimer(object):
+
+    """Measure how long each stage of processing a source takes, with the
+       highest resolution timer of the platform.
+    """
+
+    stages = ['fetch', 'validate', 'score', 'cache']
+
+    def __init__(self):
+        self.durations = {}
+        self.started = {}
+
+    def start(self, stage):
+        """Start timing `stage`"""
+
+        self.started[stage] = default_timer()
+
+    def stop(self, stage):
+        """Stop timing `stage`, if it was started, and add up its duration"""
+
+        started = self.started.pop(stage, None)
+        if started is not None:
+            duration = default_timer() - started
+            self.durations[stage] = self.durations.get(stage, 0) + duration
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """Time the code run in this context as `stage`"""
+
+        self.start(stage)
+        try:
+            yield self
+        finally:
+            self.stop(stage)
+
+
+def get_throughput(rows, size, seconds):
+    """Return the rows per second and MB per second processed in `seconds`"""
+
+    if not seconds:
+        return 0, 0
+    return rows / seconds, size / 1000000 / seconds
@@ -7,13 +7,12 @@ from __future__ import unicode_literals
 import io
 import os
 import json
+import time
 import shutil
-import dateutil
-import requests
+import hashlib
 import collections
-import datapackage
-import jsontableschema
 import pkg_resources
+from . import compat, dates
 
 def set_up_cache_dir(cache_dir_path):
     """Reset /cache_dir before a new batch."""
@@ -62,19 +61,177 @@ def load_json_config(config_filepath):
         config = deep_update_dict(default_config, user_config)
         config['data_dir'] = resolve_dir_name(config_filepath, config['data_dir'])
         config['cache_dir'] = resolve_dir_name(config_filepath, config['cache_dir'])
+        spec_config = config['data_quality_spec']
+        spec_config['data_quality_spec_file'] = resolve_dir_name(
+            config_filepath, spec_config['data_quality_spec_file'])
     return config
 
-def get_data_quality_spec():
-    """Downloads and loads the data quality spec json"""
+_data_quality_specs = {}
 
-    config = load_json_config(None)
-    dq_spec_url = config['data_quality_spec']['data_quality_spec_web']
-    json_dq_spec = requests.get(dq_spec_url)
-    return json_dq_spec.json()
+def get_data_quality_spec(config=None, refresh=False):
+    """Return the data quality spec json, fetching it at most once per process
+
+    The spec is kept in `data_quality_spec_file` along with its ETag and hash
+    and is only downloaded again when the cached copy is older than
+    `data_quality_spec_ttl` seconds. If it can't be downloaded, the cached or
+    the bundled copy of the spec is used instead. A `data_quality_spec_file`
+    that wasn't resolved by `load_json_config` is kept in `cache_dir`, and
+    only in memory when `cache_dir` isn't resolved either.
+
+    Args:
+        config: data quality config, the default config is used if missing
+        refresh: download the spec regardless of the cache, raising on failure
+    """
+
+    config = config or load_json_config(None)
+    spec_config = config['data_quality_spec']
+    spec_url = spec_config['data_quality_spec_web']
+    cache_path = get_data_quality_spec_path(config)
+    ttl = spec_config.get('data_quality_spec_ttl', 86400)
+
+    if not refresh and cache_path in _data_quality_specs:
+        return _data_quality_specs[cache_path]
+
+    import requests
+
+    cached = read_data_quality_spec_cache(cache_path)
+    if cached and cached.get('url') != spec_url:
+        cached = None
+    if refresh or not cached or time.time() - cached['fetched_at'] > ttl:
+        try:
+            cached = fetch_data_quality_spec(spec_url, cached)
+        except (requests.exceptions.RequestException, ValueError):
+            if refresh:
+                raise
+        else:
+            try:
+                write_data_quality_spec_cache(cache_path, cached)
+            except (IOError, OSError):
+                if refresh:
+                    raise
+
+    if cached:
+        dq_spec = cached['spec']
+    else:
+        default_spec = pkg_resources.resource_string('data_quality',
+                                                     'spec.default.json')
+        dq_spec = json.loads(default_spec.decode('utf-8'))
+    _data_quality_specs[cache_path] = dq_spec
+    return dq_spec
+
+def get_data_quality_spec_path(config):
+    """Return the absolute path of the cached data quality spec, or None if
+       the config doesn't say where to keep it
+    """
+
+    cache_path = config['data_quality_spec']['data_quality_spec_file']
+    if os.path.isabs(cache_path):
+        return cache_path
+    if os.path.isabs(config['cache_dir']):
+        return os.path.join(config['cache_dir'], cache_path)
+    return None
+
+def fetch_data_quality_spec(spec_url, cached=None):
+    """Download the data quality spec, revalidating `cached` by its ETag
+
+    Args:
+        spec_url: url of the data quality spec json
+        cached: previously cached spec entry, if any
+    """
+
+    import requests
+
+    headers = {}
+    if cached and cached.get('etag'):
+        headers['If-None-Match'] = cached['etag']
+    response = requests.get(spec_url, headers=headers, timeout=30)
+    if response.status_code == 304 and cached:
+        cached['fetched_at'] = time.time()
+        return cached
+    response.raise_for_status()
+    dq_spec = response.json()
+    return {'url': spec_url,
+            'etag': response.headers.get('ETag'),
+            'hash': data_quality_spec_hash(dq_spec),
+            'fetched_at': time.time(),
+            'spec': dq_spec}
+
+def data_quality_spec_hash(dq_spec):
+    """Return a hash identifying the content of a data quality spec"""
+
+    spec_json = json.dumps(dq_spec, sort_keys=True)
+    return hashlib.sha256(spec_json.encode('utf-8')).hexdigest()
+
+def read_data_quality_spec_cache(cache_path):
+    """Return the cached data quality spec entry or None"""
+
+    if cache_path is None:
+        return None
+    try:
+        with io.open(cache_path, mode='rt', encoding='utf-8') as cache_file:
+            cached = json.loads(cache_file.read())
+    except (IOError, OSError, ValueError):
+        return None
+    if cached.get('hash') != data_quality_spec_hash(cached.get('spec')):
+        return None
+    return cached
+
+def write_data_quality_spec_cache(cache_path, cached):
+    """Save a data quality spec entry to `cache_path`, if there is one"""
+
+    if cache_path is None:
+        return
+    resolve_dir(os.path.dirname(cache_path))
+    temp_path = '{0}.tmp'.format(cache_path)
+    try:
+        with io.open(temp_path, mode='w+', encoding='utf-8') as cache_file:
+            cache_file.write(compat.str(json.dumps(cached, indent=4, sort_keys=True)))
+        os.rename(temp_path, cache_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def get_source_fingerprint(data_src, timeout=30):
+    """Return a string that changes whenever the data at `data_src` changes
+
+    Remote sources are identified by their ETag or Last-Modified headers and
+    local files by the hash of their content. None is returned when no
+    fingerprint can be obtained without downloading the source.
+
+    Args:
+        data_src: path or url of a data source
+        timeout: seconds to wait for the headers of a remote source
+    """
+
+    if data_src.split('://', 1)[0].lower() in ('http', 'https'):
+        import requests
+        try:
+            response = requests.head(data_src, allow_redirects=True, timeout=timeout)
+        except requests.exceptions.RequestException:
+            return None
+        if not response.ok:
+            return None
+        if response.headers.get('ETag'):
+            return 'etag:{0}'.format(response.headers['ETag'])
+        if response.headers.get('Last-Modified'):
+            return 'last-modified:{0};{1}'.format(response.headers['Last-Modified'],
+                                                  response.headers.get('Content-Length', ''))
+        return None
+
+    if os.path.isfile(data_src):
+        file_hash = hashlib.sha256()
+        with io.open(data_src, mode='rb') as data_file:
+            for chunk in iter(lambda: data_file.read(io.DEFAULT_BUFFER_SIZE * 16), b''):
+                file_hash.update(chunk)
+        return 'sha256:{0}'.format(file_hash.hexdigest())
+    return None
 
 def get_default_datapackage():
     """Return the default datapackage"""
 
+    import datapackage
+
     default_datapkg = pkg_resources.resource_string('data_quality',
                                                     'datapackage.default.json')
     datapkg = datapackage.DataPackage(json.loads(default_datapkg.decode('utf-8')))
@@ -121,23 +278,47 @@ def date_from_string(date_string):
             date_string: a string that should contain a date
     """
 
-    if not date_string:
-        date = None
-    else:
-        try:
-            date = dateutil.parser.parse(date_string).date()
-        except ValueError:
-            date = None
-    return date
+    return dates.parse_date(date_string)
+
+def dicts_to_schema_rows(rows, converter, serialize=False):
+    """Convert a list of dicts in a generator for schema compliant rows
+
+        Args:
+            rows: iterable of dicts with a value for each field
+            converter: the RowConverter of the schema
+            serialize: yield the values written as text, for
+                       `UnicodeWriter.writetextrow`
+    """
 
-def dicts_to_schema_rows(rows, schema):
-    """Convert a list of dicts in a generator for schema compliant rows"""
+    import jsontableschema
 
+    convert_row = converter.serialize_row if serialize else converter.convert_row
     for row in rows:
         try:
-            values = [row[key] for key in schema.headers]
-            converted_row = list(schema.convert_row(*values))
-            yield converted_row
+            values = [row[key] for key in converter.headers]
+            yield convert_row(*values)
         except jsontableschema.exceptions.MultipleInvalid as e:
             for error in e.errors:
                 raise error
+
+def iter_results(result_file, latest_result_file, offset=0):
+    """Iterate over the rows of `latest_result_file`, if it exists, followed
+       by the rows of `result_file`
+
+        Args:
+            result_file: path of the file results are appended to
+            latest_result_file: path of the file with the latest results
+                                kept by compaction
+            offset: position of the first row of `result_file` to read, only
+                    `result_file` is read if given
+    """
+
+    result_files = [(latest_result_file, 0), (result_file, offset)]
+    if offset:
+        result_files = result_files[1:]
+    for result_path, result_offset in result_files:
+        if not os.path.exists(result_path):
+            continue
+        with compat.UnicodeDictReader(result_path, offset=result_offset) as results:
+            for row in results:
+                yield row
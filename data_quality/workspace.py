@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import copy
+import datapackage
+from jsontableschema.model import SchemaModel
+from . import utilities
+from .converters import RowConverter
+from .score_index import get_file_stamp
+
+_workspaces = {}
+_default_datapackage = {}
+
+
+class Workspace(object):
+
+    """The datapackage of a data quality repository and the schemas of its
+       resources, loaded once and shared by all the tasks of a process.
+
+    The datapackage is loaded again, and its schemas and row converters
+    compiled again, when the size or modification time of its file changed.
+
+    Args:
+        datapkg_file_path: path of the datapackage.json
+    """
+
+    def __init__(self, datapkg_file_path):
+        self.datapkg_file_path = datapkg_file_path
+        self.datapackage_stamp = None
+        self._datapackage = None
+        self.schemas = {}
+        self.row_converters = {}
+        self.default_schemas = {}
+
+    @property
+    def datapackage(self):
+        """The datapackage, as last saved in its file"""
+
+        stamp = get_file_stamp(self.datapkg_file_path)
+        if self._datapackage is None or stamp != self.datapackage_stamp:
+            try:
+                self._datapackage = datapackage.DataPackage(self.datapkg_file_path)
+            except datapackage.exceptions.DataPackageException as e:
+                raise ValueError(('A datapackage couldn\'t be created because of the '
+                                  'following error: "{0}". Make sure the file is not '
+                                  'empty and use "dq init" command.').format(e))
+            self.datapackage_stamp = stamp
+            self.schemas = {}
+            self.row_converters = {}
+        return self._datapackage
+
+    @property
+    def default_datapackage(self):
+        """The default datapackage, which mustn't be changed"""
+
+        if 'datapackage' not in _default_datapackage:
+            _default_datapackage['datapackage'] = utilities.get_default_datapackage()
+        return _default_datapackage['datapackage']
+
+    def get_schema(self, resource):
+        """Return the SchemaModel of a resource of the datapackage
+
+        Args:
+            resource: a resource of `datapackage`
+        """
+
+        cached = self.schemas.get(resource.local_data_path)
+        if cached is None or cached[0] is not resource:
+            cached = (resource, SchemaModel(resource.descriptor['schema']))
+            self.schemas[resource.local_data_path] = cached
+        return cached[1]
+
+    def get_row_converter(self, resource):
+        """Return the RowConverter of a resource of the datapackage
+
+        Args:
+            resource: a resource of `datapackage`
+        """
+
+        cached = self.row_converters.get(resource.local_data_path)
+        if cached is None or cached[0] is not resource:
+            cached = (resource, RowConverter(self.get_schema(resource)))
+            self.row_converters[resource.local_data_path] = cached
+        return cached[1]
+
+    def get_default_schema(self, default_resource, data_key='data'):
+        """Return the SchemaModel of a resource of the default datapackage
+
+        Args:
+            default_resource: a resource of `default_datapackage`
+            data_key: name of the field of source_file with the data url
+        """
+
+        name = default_resource.descriptor['name']
+        schema = self.default_schemas.get((name, data_key))
+        if schema is None:
+            schema_dict = copy.deepcopy(default_resource.descriptor['schema'])
+            if name == 'source_file':
+                for field in schema_dict['fields']:
+                    if field['name'] == 'data':
+                        field['name'] = data_key
+            schema = self.default_schemas[(name, data_key)] = SchemaModel(schema_dict)
+        return schema
+
+
+def get_workspace(datapkg_file_path):
+    """Return the workspace of a datapackage, shared by the whole process
+
+    Args:
+        datapkg_file_path: path of the datapackage.json
+    """
+
+    datapkg_file_path = os.path.abspath(datapkg_file_path)
+    workspace = _workspaces.get(datapkg_file_path)
+    if workspace is None:
+        workspace = _workspaces[datapkg_file_path] = Workspace(datapkg_file_path)
+    return workspace
@@ -42,7 +42,8 @@ setup(
     license='MIT',
     keywords=['frictionless data', 'data quality'],
     package_data={
-        'data_quality': ['datapackage.default.json', 'dq.default.json'],
+        'data_quality': ['datapackage.default.json', 'dq.default.json',
+                         'spec.default.json'],
     },
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import unittest
+
+# Timing assertions depend on the machine, so they only run when asked for
+benchmark = unittest.skipUnless(os.environ.get('DQ_BENCHMARKS'),
+                                'set DQ_BENCHMARKS=1 to run the benchmarks')
@@ -6,9 +6,17 @@ from __future__ import unicode_literals
 
 import unittest
 import os
+import io
+import shutil
+import tempfile
+import timeit
+import mock
 from .test_task import TestTask
-from data_quality import tasks, utilities, compat
+from .. import benchmark
+from data_quality import tasks, utilities, compat, exceptions
+from data_quality.batch import TimedBatch, ParallelBatch
 from goodtables import pipeline
+import tellme
 
 
 class TestAggregatorTask(TestTask):
@@ -23,6 +31,7 @@ class TestAggregatorTask(TestTask):
                                               post_task=aggregator_task.run)
         results_before_run = self.read_file_contents(aggregator_task.result_file)
         pipeline_instance.run()
+        aggregator_task.close()
         results_after_run = self.read_file_contents(aggregator_task.result_file)
 
         self.assertEqual(len(results_after_run), len(results_before_run) + 1)
@@ -45,6 +54,69 @@ class TestAggregatorTask(TestTask):
 
         self.assertGreater(len(runs_after_run), len(runs_before_run))
 
+    def test_parallel_batch_run(self):
+        """Test that a parallel batch writes the same results as a sequential
+           one, in the order of the sources file
+        """
+
+        self.use_local_sources()
+        config = self.config
+        batch_options = config['goodtables']['arguments']['batch']
+        batch_options['pipeline_options'] = config['goodtables']['arguments']['pipeline']
+        sequential_task = tasks.Aggregator(config)
+        batch_options['pipeline_post_task'] = sequential_task.run
+        pipeline.Batch(sequential_task.source_file, **batch_options).run()
+        sequential_task.close()
+        parallel_task = tasks.Aggregator(config)
+        batch = ParallelBatch(parallel_task.source_file, parallel_task, 2,
+                              **batch_options)
+        batch.run()
+        parallel_task.write_run()
+        parallel_task.close()
+        results = self.read_file_contents(parallel_task.result_file)
+        sequential_results = [result for result in results
+                              if result['run_id'] == sequential_task.run_id]
+        parallel_results = [result for result in results
+                            if result['run_id'] == parallel_task.run_id]
+        sources = self.read_file_contents(parallel_task.source_file)
+
+        self.assertEqual([result['source_id'] for result in parallel_results],
+                         [source['id'] for source in sources])
+        self.assertEqual([result['score'] for result in parallel_results],
+                         [result['score'] for result in sequential_results])
+        self.assertEqual(parallel_task.all_scores, sequential_task.all_scores)
+
+    def test_aggregator_timings(self):
+        """Test that Aggregator writes the timings of each result and the
+           totals of the run
+        """
+
+        self.use_local_sources()
+        config = self.config
+        aggregator_task = tasks.Aggregator(config)
+        batch_options = config['goodtables']['arguments']['batch']
+        batch_options['pipeline_options'] = config['goodtables']['arguments']['pipeline']
+        batch_options['pipeline_post_task'] = aggregator_task.run
+        TimedBatch(aggregator_task.source_file, **batch_options).run()
+        aggregator_task.write_run()
+        aggregator_task.close()
+        results = [result['id'] for result
+                   in self.read_file_contents(aggregator_task.result_file)
+                   if result['run_id'] == aggregator_task.run_id]
+        timings = [timing for timing
+                   in self.read_file_contents(aggregator_task.timing_file)
+                   if timing['run_id'] == aggregator_task.run_id]
+        totals = timings[-1]
+        stages = ['fetch_time', 'validate_time', 'score_time', 'cache_time']
+
+        self.assertEqual([timing['result_id'] for timing in timings[:-1]], results)
+        self.assertEqual(totals['result_id'], '')
+        for timing in timings[:-1]:
+            self.assertTrue(all(float(timing[stage]) > 0 for stage in stages))
+        self.assertEqual(int(totals['rows']),
+                         sum(int(timing['rows']) for timing in timings[:-1]))
+        self.assertGreater(float(totals['rows_per_second']), 0)
+
     def test_aggregator_fetch(self):
         """Test that Aggregator task fetches the source"""
 
@@ -57,7 +129,8 @@ class TestAggregatorTask(TestTask):
         pipeline_instance.run()
         file_names = []
         for file_name in os.listdir(aggregator_task.cache_dir):
-            file_names.append(file_name)
+            if not file_name.startswith('.'):
+                file_names.append(file_name)
         self.assertEquals(file_names,['valid.csv'])
 
     def test_aggregator_assess_timeliness(self):
@@ -74,11 +147,21 @@ class TestAggregatorTask(TestTask):
         pipeline_instance = pipeline.Pipeline(data=url, format='csv',
                                               post_task=aggregator_task.run)
         pipeline_instance.run()
+        aggregator_task.close()
         updated_sources = self.read_file_contents(aggregator_task.result_file)
         result = updated_sources[-1]
         score = int(result['score'])
         self.assertEqual(98, score)
 
+    def test_aggregator_publication_delay_day_first(self):
+        """Test that relevance periods are read as DD-MM-YYYY"""
+
+        scorer = tasks.aggregate.Scorer({}, assess_timeliness=True)
+        source = {'period_id': '01-02-2010/03-02-2010',
+                  'created_at': utilities.date_from_string('2010-03-20')}
+
+        self.assertEqual(scorer.get_publication_delay(source), 0.5)
+
     def tests_aggreate_scoring(self):
         """Test Aggregator scoring"""
 
@@ -91,10 +174,359 @@ class TestAggregatorTask(TestTask):
                                               post_task=aggregator_task.run,
                                               **pipeline_options)
         pipeline_instance.run()
+        aggregator_task.close()
         result = self.read_file_contents(aggregator_task.result_file)[-1]
 
         self.assertEqual(int(result['score']), 0)
 
+    def test_aggregator_rescore(self):
+        """Test that Aggregator rescores the latest results from stored errors"""
+
+        self.copy_data_dir()
+        aggregator_task = tasks.Aggregator(self.config)
+        aggregator_task.dq_spec = {'structure': {'4': {'weight': 9}}}
+        latest_results = {}
+        for result in self.read_file_contents(aggregator_task.result_file):
+            latest_results[result['source_id']] = result['id']
+        with compat.UnicodeAppender(aggregator_task.error_file) as error_file:
+            error_file.writerow([latest_results['source1'], '', '', 0])
+            error_file.writerow([latest_results['source3'], 'structure',
+                                 'structure_005', 3])
+        aggregator_task.rescore()
+        aggregator_task.write_run()
+        aggregator_task.close()
+        results = self.read_file_contents(aggregator_task.result_file)[-2:]
+        scores = {result['source_id']: int(result['score']) for result in results}
+        harmonic_mean_occ = 3 / tasks.aggregate.harmonic_number(3)
+
+        self.assertEqual(scores, {'source1': 100,
+                                  'source3': round(100 - 9 * harmonic_mean_occ)})
+        self.assertEqual(set(result['run_id'] for result in results),
+                         set([aggregator_task.run_id]))
+
+    def test_aggregator_rescore_without_stored_errors(self):
+        """Test that Aggregator carries over the results it can't rescore
+           with their previous score
+        """
+
+        self.copy_data_dir()
+        aggregator_task = tasks.Aggregator(self.config)
+        latest_results = {}
+        for result in self.read_file_contents(aggregator_task.result_file):
+            latest_results[result['source_id']] = result
+        with compat.UnicodeAppender(aggregator_task.error_file) as error_file:
+            error_file.writerow([latest_results['source1']['id'], '', '', 0])
+        aggregator_task.rescore()
+        aggregator_task.write_run()
+        aggregator_task.close()
+        results = {result['source_id']: result for result
+                   in self.read_file_contents(aggregator_task.result_file)[-2:]}
+        run = self.read_file_contents(aggregator_task.run_file)[-1]
+        error_result_ids = set(error['result_id'] for error
+                               in self.read_file_contents(aggregator_task.error_file))
+        previous_score = int(latest_results['source3']['score'])
+
+        self.assertEqual(int(results['source1']['score']), 100)
+        self.assertEqual(int(results['source3']['score']), previous_score)
+        self.assertEqual(int(run['total_score']), int(round((100 + previous_score) / 2)))
+        self.assertNotIn(results['source3']['id'], error_result_ids)
+
+    def test_aggregator_carry_forward_unchanged(self):
+        """Test that Aggregator copies the latest result of unchanged sources
+           and only leaves changed sources to validate
+        """
+
+        self.copy_data_dir()
+        aggregator_task = tasks.Aggregator(self.config)
+        fingerprints = {'source1': 'etag:"v1"', 'source3': 'etag:"v1"'}
+        with self.mock_fingerprints(aggregator_task, fingerprints):
+            latest_results = self.store_fingerprints(aggregator_task)
+            fingerprints['source3'] = 'etag:"v2"'
+            changed_path = aggregator_task.carry_forward_unchanged()
+            source3_fingerprint = aggregator_task.get_source_fingerprints()['source3']
+            parallel_fingerprints = aggregator_task.get_source_fingerprints(workers=2)
+        try:
+            changed_sources = self.read_file_contents(changed_path)
+        finally:
+            os.remove(changed_path)
+        aggregator_task.write_run()
+        aggregator_task.close()
+        result = self.read_file_contents(aggregator_task.result_file)[-1]
+
+        self.assertEqual(os.path.dirname(changed_path), aggregator_task.data_dir)
+        self.assertEqual([source['id'] for source in changed_sources], ['source3'])
+        self.assertEqual(result['source_id'], 'source1')
+        self.assertEqual(result['score'], latest_results['source1']['score'])
+        self.assertEqual(result['run_id'], aggregator_task.run_id)
+        self.assertEqual(aggregator_task.fingerprints['source1']['result_id'], result['id'])
+        self.assertEqual(aggregator_task.new_fingerprints, {'source3': source3_fingerprint})
+        self.assertEqual(parallel_fingerprints['source3'], source3_fingerprint)
+
+    def test_aggregator_fingerprints_kept_without_new_ones(self):
+        """Test that results added without a fingerprint leave the stored
+           fingerprints of their sources alone
+        """
+
+        self.copy_data_dir()
+        aggregator_task = tasks.Aggregator(self.config)
+        stored = {'fingerprint': 'etag:"v1"', 'result_id': 'result1'}
+        aggregator_task.fingerprints = {'source1': dict(stored)}
+        source = aggregator_task.get_scoring_source(
+            [data_src for data_src, source in aggregator_task.lookup.items()
+             if source['id'] == 'source1'][0])
+        aggregator_task.add_result(source, source[aggregator_task.data_key], 100, {}, '')
+        aggregator_task.close()
+
+        self.assertEqual(aggregator_task.fingerprints, {'source1': stored})
+
+    def test_aggregator_carry_forward_changed_source_row(self):
+        """Test that Aggregator validates again the sources whose publisher,
+           creation date or period changed, even if their data didn't
+        """
+
+        self.copy_data_dir()
+        aggregator_task = tasks.Aggregator(self.config)
+        fingerprints = {'source1': 'etag:"v1"', 'source3': 'etag:"v1"'}
+        with self.mock_fingerprints(aggregator_task, fingerprints):
+            self.store_fingerprints(aggregator_task)
+            for source in aggregator_task.lookup.values():
+                if source['id'] == 'source1':
+                    source['publisher_id'] = 'xx_dept15'
+                else:
+                    source['period_id'] = '01-01-2015/31-01-2015'
+            changed_path = aggregator_task.carry_forward_unchanged()
+        try:
+            changed_sources = self.read_file_contents(changed_path)
+        finally:
+            os.remove(changed_path)
+        aggregator_task.close()
+
+        self.assertEqual([source['id'] for source in changed_sources],
+                         ['source1', 'source3'])
+
+    def mock_fingerprints(self, aggregator_task, fingerprints):
+        """Return a patch giving the data of each source the fingerprint in
+           `fingerprints`, by source id
+        """
+
+        sources = {source[aggregator_task.data_key]: source['id']
+                   for source in aggregator_task.lookup.values()}
+        return mock.patch('data_quality.utilities.get_source_fingerprint',
+                          side_effect=lambda data_src, timeout: fingerprints[sources[data_src]])
+
+    def store_fingerprints(self, aggregator_task):
+        """Store the current fingerprint of each source along with its latest
+           result, and return the latest results by source id
+        """
+
+        latest_results = {}
+        for result in self.read_file_contents(aggregator_task.result_file):
+            latest_results[result['source_id']] = result
+        aggregator_task.fingerprints = {
+            source_id: {'fingerprint': fingerprint,
+                        'result_id': latest_results[source_id]['id']}
+            for source_id, fingerprint in aggregator_task.get_source_fingerprints().items()}
+        return latest_results
+
+    def test_score_error_occurrences(self):
+        """Test that scoring many results at once matches scoring each result"""
+
+        aggregator_task = tasks.Aggregator(self.config)
+        error_stats = [{'structure_003': {'occurrences': 7, 'weight': 9},
+                        'structure_005': {'occurrences': 1, 'weight': 3}},
+                       {},
+                       {'schema_003': {'occurrences': 1200, 'weight': 1}}]
+        positions, weights, occurrences = [], [], []
+        for position, stats in enumerate(error_stats):
+            for error in stats.values():
+                positions.append(position)
+                weights.append(error['weight'])
+                occurrences.append(error['occurrences'])
+        scores = tasks.aggregate.score_error_occurrences(positions, weights,
+                                                          occurrences, 3)
+
+        for score, stats in zip(scores, error_stats):
+            self.assertAlmostEqual(score, aggregator_task.score_by_error_occurences(stats))
+
+    def test_report_results_streamed(self):
+        """Test that report results are read back one at a time as written"""
+
+        entries = [self.make_report_entry('structure_005', row_index)
+                   for row_index in range(5)]
+        report = tellme.Report('Pipeline')
+        report.multi_write(entries)
+
+        self.assertEqual(list(tasks.aggregate.iter_report_results(report)),
+                         entries)
+
+    def test_error_stats_rows_sample(self):
+        """Test that error stats count every occurrence but keep a bounded
+           sample of rows
+        """
+
+        dq_spec = {'structure': {'4': {'weight': 9}}}
+        accumulator = tasks.aggregate.ErrorAccumulator(dq_spec, rows_sample=2)
+        for row_index in range(100):
+            accumulator.add(self.make_report_entry('structure_005', row_index))
+
+        self.assertEqual(accumulator.error_stats,
+                         {'structure_005': {'occurrences': 100, 'rows': [0, 1],
+                                            'weight': 9, 'processor': 'structure'}})
+
+    def make_report_entry(self, result_id, row_index):
+        """Return a report entry as written by goodtables processors"""
+
+        return {'processor': 'structure', 'result_category': 'row',
+                'result_level': 'error', 'result_message': 'Row is empty.',
+                'result_id': result_id, 'result_name': 'Empty Row',
+                'result_context': [], 'row_index': row_index,
+                'row_name': '', 'column_index': None, 'column_name': ''}
+
+    def test_result_sink_writes_results_with_run(self):
+        """Test that ResultSink buffers results until their run is written"""
+
+        temp_dir = tempfile.mkdtemp()
+        result_file = os.path.join(temp_dir, 'results.csv')
+        run_file = os.path.join(temp_dir, 'runs.csv')
+        error_file = os.path.join(temp_dir, 'errors.csv')
+        for file_name, header in [(result_file, 'id,score'), (run_file, 'id'),
+                                  (error_file, 'result_id,error_id')]:
+            with io.open(file_name, mode='w', encoding='utf-8') as a_file:
+                a_file.write(compat.str('{0}\n'.format(header)))
+        try:
+            with tasks.aggregate.ResultSink(result_file, run_file, error_file) as sink:
+                sink.write_result(['result1', '100'])
+                sink.write_result(['result2', '67'], [['result2', 'structure_005']])
+                self.assertEqual(self.read_file_contents(result_file), [])
+                sink.write_run(['run1'])
+                self.assertEqual(len(self.read_file_contents(result_file)), 2)
+                self.assertEqual(len(self.read_file_contents(error_file)), 1)
+                self.assertEqual(self.read_file_contents(run_file), [{'id': 'run1'}])
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_result_sink_drops_partial_row(self):
+        """Test that ResultSink removes a row left incomplete by a crash"""
+
+        temp_dir = tempfile.mkdtemp()
+        result_file = os.path.join(temp_dir, 'results.csv')
+        run_file = os.path.join(temp_dir, 'runs.csv')
+        error_file = os.path.join(temp_dir, 'errors.csv')
+        with io.open(result_file, mode='w', encoding='utf-8') as a_file:
+            a_file.write(compat.str('id,score\nresult1,100\nresult2'))
+        for file_name in [run_file, error_file]:
+            with io.open(file_name, mode='w', encoding='utf-8') as a_file:
+                a_file.write(compat.str('id\n'))
+        try:
+            with tasks.aggregate.ResultSink(result_file, run_file, error_file) as sink:
+                sink.write_result(['result3', '67'])
+            results = self.read_file_contents(result_file)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(results, [{'id': 'result1', 'score': '100'},
+                                   {'id': 'result3', 'score': '67'}])
+
+    def test_result_sink_keeps_complete_last_row(self):
+        """Test that ResultSink ends a complete last row without a line break
+           instead of dropping it
+        """
+
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        result_file = os.path.join(temp_dir, 'results.csv')
+        run_file = os.path.join(temp_dir, 'runs.csv')
+        error_file = os.path.join(temp_dir, 'errors.csv')
+        with io.open(result_file, mode='w', encoding='utf-8') as a_file:
+            a_file.write(compat.str('id,score\nresult1,100\n"result2",67'))
+        for file_name in [run_file, error_file]:
+            with io.open(file_name, mode='w', encoding='utf-8') as a_file:
+                a_file.write(compat.str('id\n'))
+        with tasks.aggregate.ResultSink(result_file, run_file, error_file) as sink:
+            sink.write_result(['result3', '33'])
+
+        self.assertEqual(self.read_file_contents(result_file),
+                         [{'id': 'result1', 'score': '100'},
+                          {'id': 'result2', 'score': '67'},
+                          {'id': 'result3', 'score': '33'}])
+
+    def test_aggregator_duplicate_sources_found_on_load(self):
+        """Test that conflicting sources with the same path are reported
+           when the source index is built
+        """
+
+        aggregator_task = tasks.Aggregator(self.config)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            aggregator_task.source_file = os.path.join(temp_dir, 'sources.csv')
+            self.write_sources(aggregator_task.source_file, 2, same_data=True)
+            self.assertRaises(exceptions.DuplicateDataSourceError,
+                              aggregator_task.get_lookup)
+        finally:
+            shutil.rmtree(temp_dir)
+
+    @benchmark
+    def test_aggregator_get_source_benchmark(self):
+        """Test that the per-source cost of indexing and looking up sources
+           stays flat as `source_file` grows
+        """
+
+        aggregator_task = tasks.Aggregator(self.config)
+        temp_dir = tempfile.mkdtemp()
+
+        def per_source_time(sources_count):
+            aggregator_task.source_file = os.path.join(temp_dir, 'sources.csv')
+            data_srcs = self.write_sources(aggregator_task.source_file,
+                                           sources_count)
+
+            def index_and_match():
+                aggregator_task.lookup = aggregator_task.get_lookup()
+                for data_src in data_srcs:
+                    aggregator_task.get_source(data_src)
+            return min(timeit.repeat(index_and_match, number=1, repeat=3)) / sources_count
+
+        try:
+            small = per_source_time(1000)
+            large = per_source_time(16000)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertLess(large, small * 4)
+
+    def use_local_sources(self):
+        """Point the config at a copy of the fixtures whose sources are local
+           files, one valid and one with empty rows
+        """
+
+        data_dir = self.copy_data_dir()
+        data = {'source1': 'id,name\n1,english\n2,中国人\n',
+                'source3': 'id,name\n1,english\n,\n,\n2,中国人\n'}
+        source_file = os.path.join(data_dir, self.config['source_file'])
+        with compat.UnicodeDictReader(source_file) as sources_file:
+            headers = sources_file.header
+            sources = list(sources_file)
+        with compat.UnicodeWriter(source_file) as sources_file:
+            sources_file.writerow(headers)
+            for source in sources:
+                source['data'] = os.path.join(data_dir, '{0}.csv'.format(source['id']))
+                with io.open(source['data'], mode='w', encoding='utf-8') as data_file:
+                    data_file.write(compat.str(data[source['id']]))
+                sources_file.writerow([source[key] for key in headers])
+
+    def write_sources(self, file_name, sources_count, same_data=False):
+        """Write a `source_file` with `sources_count` rows, return their paths"""
+
+        headers = ['id', 'publisher_id', 'title', 'data', 'format', 'created_at']
+        data_srcs = []
+        with compat.UnicodeWriter(file_name) as sources_file:
+            sources_file.writerow(headers)
+            for index in range(sources_count):
+                data_src = 'http://example.com/{0}.csv'.format(
+                    0 if same_data else index)
+                data_srcs.append(data_src)
+                sources_file.writerow(['source{0}'.format(index), 'xx_dept1',
+                                       'Source {0}'.format(index), data_src,
+                                       'csv', '2015-01-01'])
+        return data_srcs
+
     def read_file_contents(self, file_name):
         """Return file contents as list of dicts"""
 
@@ -6,6 +6,9 @@ from __future__ import unicode_literals
 
 import unittest
 import os
+import io
+import datetime
+import mock
 from .test_task import TestTask
 from data_quality import tasks, utilities, compat
 
@@ -33,6 +36,109 @@ class TestPerformanceAssessorTask(TestTask):
         with compat.UnicodeDictReader(assess_performance_task.performance_file) as pf:
             self.assertGreater(self.find_in_sequence(pf, test_dict), -1)
 
+    def test_sources_scored_by_latest_result(self):
+        """Test that sources get the score of their latest result, whatever
+           the order of the results
+        """
+
+        self.copy_data_dir()
+        assess_performance_task = tasks.PerformanceAssessor(self.config)
+        with compat.UnicodeAppender(assess_performance_task.result_file) as result_file:
+            result_file.writerow(['latest', 'source1', 'xx_dept1', '2015-01-01', '',
+                                  '', '42', '', 'run2', '2030-01-02 00:00:00+00:00', ''])
+            result_file.writerow(['earlier', 'source1', 'xx_dept1', '2015-01-01', '',
+                                  '', '7', '', 'run1', '2030-01-01 00:00:00+00:00', ''])
+        publishers_sources = assess_performance_task.get_publishers_sources(
+            ['xx_dept1', 'xx_dept15', 'missing'])
+
+        self.assertEqual([source['score'] for source in publishers_sources['xx_dept1']],
+                         [42])
+        self.assertEqual([source['id'] for source in publishers_sources['xx_dept15']],
+                         ['source3'])
+        self.assertEqual(publishers_sources['missing'], [])
+        self.assertEqual(assess_performance_task.get_sources('xx_dept1'),
+                         publishers_sources['xx_dept1'])
+
+    def test_periods_data_to_date(self):
+        """Test that the performance to date of each period matches averaging
+           all the sources up to that period
+        """
+
+        assess_performance_task = tasks.PerformanceAssessor(self.config)
+        scores = [100, 67, 0, 100, 33, 100, 50]
+        sources = [{'id': 'source{0}'.format(position), 'score': score,
+                    'created_at': datetime.date(2015, 1 + position % 4, 10)}
+                   for position, score in enumerate(scores)]
+        periods = [datetime.date(2014, 12, 1)] + \
+                  [datetime.date(2015, month, 1) for month in range(1, 7)]
+        performances = assess_performance_task.get_periods_data('pub', periods,
+                                                                sources)
+
+        for period, performance in zip(periods, performances):
+            to_date = [source for source in sources
+                       if source['created_at'].replace(day=1) <= period]
+            in_period = assess_performance_task.get_period_sources(period, sources)
+            self.assertEqual(performance['files_count'], len(in_period))
+            self.assertEqual(performance['score'],
+                             assess_performance_task.get_period_score(in_period))
+            self.assertEqual(performance['valid'],
+                             assess_performance_task.get_period_valid(in_period))
+            self.assertEqual(performance['files_count_to_date'], len(to_date))
+            self.assertEqual(performance['score_to_date'],
+                             assess_performance_task.get_period_score(to_date))
+            self.assertEqual(performance['valid_to_date'],
+                             assess_performance_task.get_period_valid(to_date))
+
+    @unittest.skipIf(compat.get_numpy() is None, 'NumPy is not installed')
+    def test_numpy_performances_match_python(self):
+        """Test that the NumPy engine computes the same performances as the
+           pure Python one
+        """
+
+        assess_performance_task = tasks.PerformanceAssessor(self.config)
+        scores = [100, 67, 0, 100, 33, 100, 50, 75, 25, 100]
+        publishers_sources = {'pub1': [], 'pub2': [], 'pub3': []}
+        for position, score in enumerate(scores):
+            publisher_id = 'pub{0}'.format(1 + position % 2)
+            publishers_sources[publisher_id].append({
+                'id': 'source{0}'.format(position), 'score': score,
+                'created_at': datetime.date(2015, 1 + position % 5, 10)})
+        publisher_ids = ['pub1', 'pub2', 'pub3']
+        periods = [datetime.date(2015, month, 1) for month in range(1, 5)]
+
+        performances = assess_performance_task.get_publishers_performances(
+            publisher_ids, periods, publishers_sources)
+        with mock.patch.object(compat, 'get_numpy', return_value=None):
+            python_performances = assess_performance_task.get_publishers_performances(
+                publisher_ids, periods, publishers_sources)
+
+        self.assertEqual(performances, python_performances)
+
+    def test_performance_updated_incrementally(self):
+        """Test that updating the performance file from the saved state gives
+           the same file as computing it from scratch
+        """
+
+        self.copy_data_dir()
+        assess_performance_task = tasks.PerformanceAssessor(self.config)
+        assess_performance_task.run(full=True)
+        with compat.UnicodeAppender(assess_performance_task.result_file) as result_file:
+            result_file.writerow(['latest', 'source3', 'xx_dept15', '2015-01-01', '',
+                                  '', '100', '', 'run2', '2030-01-02 00:00:00+00:00', ''])
+        with mock.patch.object(assess_performance_task, 'get_publishers_performances') as full_run:
+            assess_performance_task.run()
+        with io.open(assess_performance_task.performance_file, mode='rt',
+                     encoding='utf-8') as performance_file:
+            incremental_performance = performance_file.read()
+        assess_performance_task.run(full=True)
+        with io.open(assess_performance_task.performance_file, mode='rt',
+                     encoding='utf-8') as performance_file:
+            full_performance = performance_file.read()
+
+        self.assertFalse(full_run.called)
+        self.assertEqual(incremental_performance, full_performance)
+        self.assertIn('xx_dept15,2015-01-01,1,100,100', full_performance)
+
     def find_in_sequence(self, sequence, target):
         """Find `target` in `sequence`"""
 
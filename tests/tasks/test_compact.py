@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import io
+import gzip
+import json
+import shutil
+import tempfile
+from .test_task import TestTask
+from data_quality import tasks, compat
+
+
+class TestResultCompactorTask(TestTask):
+    """Test the ResultCompactor task"""
+
+    def setUp(self):
+        super(TestResultCompactorTask, self).setUp()
+        self.temp_dir = tempfile.mkdtemp()
+        data_dir = os.path.join(self.temp_dir, 'data')
+        shutil.copytree(self.config['data_dir'], data_dir)
+        self.config['data_dir'] = data_dir
+        self.config['datapackage_file'] = os.path.join(data_dir, 'datapackage.json')
+        result_file = os.path.join(data_dir, self.config['result_file'])
+        with compat.UnicodeDictReader(result_file) as results:
+            headers = results.header
+        self.result_ids = []
+        with compat.UnicodeWriter(result_file) as results:
+            results.writerow(headers)
+            for position, timestamp in enumerate(['2016-08-08 17:42:12+00:00',
+                                                  '2016-08-09 17:42:12+00:00',
+                                                  '2017-04-18 09:27:19+00:00']):
+                for source_id in ['source1', 'source3']:
+                    result_id = '{0}-{1}'.format(source_id, position)
+                    results.writerow([result_id, source_id, 'xx_dept1', '2015-01-01',
+                                      '', '', 50 + position, '', 'run', timestamp, ''])
+                    self.result_ids.append(result_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_results_compacted(self):
+        """Test that only the latest result of each source is kept and the
+           others are archived by month
+        """
+
+        self.config['compress_result_archive'] = True
+        scores = tasks.PerformanceAssessor(self.config).get_latest_scores(['source1', 'source3'])
+        compactor = tasks.ResultCompactor(self.config)
+        compactor.run()
+
+        with compat.UnicodeDictReader(compactor.latest_result_file) as latest_file:
+            latest_results = {row['source_id']: row['id'] for row in latest_file}
+        with compat.UnicodeDictReader(compactor.result_file) as result_file:
+            self.assertEqual(list(result_file), [])
+        archive_path = os.path.join(compactor.result_archive_dir, 'results-2016-08.csv.gz')
+        with io.TextIOWrapper(gzip.open(archive_path), encoding='utf-8') as archive_file:
+            archived_ids = [line.split(',')[0] for line in archive_file.readlines()[1:]]
+        with io.open(self.config['datapackage_file'], mode='rt', encoding='utf-8') as datapkg_file:
+            resource_names = [resource['name'] for resource in json.load(datapkg_file)['resources']]
+        compacted_scores = tasks.PerformanceAssessor(self.config).get_latest_scores(['source1', 'source3'])
+
+        self.assertEqual(latest_results, {'source1': 'source1-2', 'source3': 'source3-2'})
+        self.assertEqual(archived_ids, self.result_ids[:-2])
+        self.assertIn('latest_result_file', resource_names)
+        self.assertIn('result_archive_2016-08', resource_names)
+        self.assertNotIn('result_archive_2017-04', resource_names)
+        self.assertEqual(compacted_scores, scores)
+
+    def test_compact_again(self):
+        """Test that compacting after new results archives only the replaced
+           latest results
+        """
+
+        compactor = tasks.ResultCompactor(self.config)
+        compactor.run()
+        with compat.UnicodeAppender(compactor.result_file) as result_file:
+            result_file.writerow(['new', 'source1', 'xx_dept1', '2015-01-01', '', '',
+                                  '90', '', 'run2', '2017-05-01 00:00:00+00:00', ''])
+        compactor = tasks.ResultCompactor(self.config)
+        compactor.run()
+
+        with compat.UnicodeDictReader(compactor.latest_result_file) as latest_file:
+            latest_ids = [row['id'] for row in latest_file]
+        archive_path = os.path.join(compactor.result_archive_dir, 'results-2017-04.csv')
+        with compat.UnicodeDictReader(archive_path) as archive_file:
+            archived_ids = [row['id'] for row in archive_file]
+
+        self.assertEqual(latest_ids, ['source3-2', 'new'])
+        self.assertEqual(archived_ids, ['source1-2'])
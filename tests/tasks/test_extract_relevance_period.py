@@ -4,11 +4,18 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import os
+import shutil
+import tempfile
 import unittest
+import timeit
 import datetime
-from data_quality import exceptions
-from data_quality.tasks.extract_relevance_period import RelevancePeriodExtractor
+import mock
+from data_quality import compat, exceptions
+from data_quality.tasks.extract_relevance_period import (RelevancePeriodExtractor,
+                                                         match_common_date)
 from .test_task import TestTask
+from .. import benchmark
 
 class TestRelevancePeriodExtractor(TestTask):
     """Test the RelevancePeriodExtractor task"""
@@ -85,6 +92,165 @@ class TestRelevancePeriodExtractor(TestTask):
 
         self.assertSequenceEqual(results, expected)
 
+    def test_remembered_dates_unchanged(self):
+        """Test that remembering parsed dates doesn't change the dates extracted"""
+
+        lines = ['Transparency Data 1 to 30 April 2014',
+                 'DH-May-2010-amnd4',
+                 'August - September 2015',
+                 '17/07/2014 - 17/08/2014',
+                 'Spend over £25,000 in Natural England/July 2011 return',
+                 'April 2010 to December 2013/December 2012 MOD GPC spend']
+        self.config['timeliness']['timeliness_strategy'] = ['title', 'data']
+        extractor = RelevancePeriodExtractor(self.config)
+        unremembered = RelevancePeriodExtractor(self.config)
+        unremembered.parsed_dates.size = 0
+        for line in lines * 2:
+            dates = [(date['date_obj'], date['period'])
+                     for date in extractor.extract_dates(line)]
+            expected = [(date['date_obj'], date['period'])
+                        for date in unremembered.extract_dates(line)]
+            self.assertEqual(sorted(dates), sorted(expected))
+
+        self.assertGreater(extractor.parsed_dates.hits, 0)
+        self.assertEqual(len(unremembered.parsed_dates), 0)
+
+    def test_common_dates_as_by_dateparser(self):
+        """Test that dates of common shapes are read as dateparser reads them"""
+
+        corpus = self.get_common_dates_corpus()
+        corpus.extend(['31 02 2012', '12 31 2012', '29 Feb 2012', '29 feb 2013',
+                       '31 April 2014', 'Sept. 2014', 'Febuary 2014', '1.4.2014',
+                       '20-12/2015', '12_03_15', '1 4 1000', 'Transparency Jan 2012',
+                       'Q3 2015', '2015 16 Q3', 'q4 Dec 2016', '25k', '500K 2016'])
+        self.config['timeliness']['timeliness_strategy'] = ['title', 'data']
+        for date_order in ['DMY', 'MDY']:
+            self.config['timeliness']['date_order'] = date_order
+            extractor = RelevancePeriodExtractor(self.config)
+            for date_string in corpus:
+                date = match_common_date(date_string, date_order)
+                if date is None:
+                    continue
+                expected = extractor.date_parser.get_date_data(date_string)
+                self.assertEqual((date['date_obj'], date['period']),
+                                 (expected['date_obj'], expected['period']),
+                                 date_string)
+
+        self.assertIsNone(match_common_date('2014'))
+        self.assertIsNone(match_common_date('April 2014', 'YMD'))
+
+    @benchmark
+    def test_common_dates_benchmark(self):
+        """Test that dates of common shapes are read faster than by dateparser"""
+
+        corpus = self.get_common_dates_corpus()
+        self.config['timeliness']['timeliness_strategy'] = ['title', 'data']
+        extractor = RelevancePeriodExtractor(self.config)
+
+        def match_all():
+            for date_string in corpus:
+                match_common_date(date_string)
+
+        def parse_all():
+            for date_string in corpus:
+                extractor.date_parser.get_date_data(date_string)
+
+        fast = min(timeit.repeat(match_all, number=1, repeat=3))
+        slow = min(timeit.repeat(parse_all, number=1, repeat=3))
+        self.assertLess(fast * 20, slow)
+
+    def get_common_dates_corpus(self):
+        """Return strings of the shapes in which dates are commonly written"""
+
+        corpus = []
+        months = ['January', 'february', 'MAR', 'Apr', 'May', 'june', 'Jul',
+                  'aug', 'Sept', 'October', 'nov', 'Dec']
+        for index, month in enumerate(months, 1):
+            year = 2009 + index
+            day = index * 5 % 31 + 1
+            corpus.extend(['{0}/{1:02d}/{2}'.format(day, index, year),
+                           '{0:02d} {1} {2}'.format(day, index, year),
+                           '{0}-{1}-{2}'.format(index, day, year),
+                           '{0} {1} {2}'.format(day, month, year),
+                           '{0} {1}'.format(month, year),
+                           '{0}{1}'.format(month, year),
+                           '{0}k {1} {2}'.format(index * 5, month, year),
+                           'Q{0} {1}'.format(index % 4 + 1, year)])
+        return corpus
+
+    def test_periods_extracted_in_parallel(self):
+        """Test that periods extracted by worker processes are the same and in
+           the same order as when extracted by a single process
+        """
+
+        titles = ['Transparency Data 1 to 30 April 2014', 'Spend over £25k March 2016',
+                  'DH-May-2010-amnd4', 'Source 1', 'August - September 2015',
+                  '01/04/2016 - 30/04/2016', '2015-16 Q3', 'July 2011 return']
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        source_file = os.path.join(temp_dir, 'sources.csv')
+        with compat.UnicodeWriter(source_file) as sources:
+            sources.writerow(['id', 'title', 'data'])
+            for index, title in enumerate(titles):
+                sources.writerow(['source{0}'.format(index), title, ''])
+        self.config['timeliness']['timeliness_strategy'] = ['title', 'data']
+        extractor = RelevancePeriodExtractor(self.config)
+        extractor.source_file = source_file
+        expected = list(extractor.extract_period_from_sources())
+        extractor = RelevancePeriodExtractor(self.config)
+        extractor.source_file = source_file
+        extractor.sources_per_job = 3
+        sources = list(extractor.extract_period_from_sources(workers=2))
+
+        self.assertEqual(sources, expected)
+        self.assertGreater(sum(extractor.get_date_counts()), 0)
+
+    def test_run_extracts_periods_of_new_sources(self):
+        """Test that a run keeps the periods found before and only extracts
+           those of new sources, unless the timeliness options changed
+        """
+
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        data_dir = os.path.join(temp_dir, 'data')
+        shutil.copytree(self.config['data_dir'], data_dir)
+        self.config['data_dir'] = data_dir
+        self.config['datapackage_file'] = os.path.join(data_dir, 'datapackage.json')
+        self.config['timeliness']['timeliness_strategy'] = ['title', 'data']
+        self.config['timeliness']['max_empty_relevance_period'] = 50
+        source_file = os.path.join(data_dir, self.config['source_file'])
+        headers = ['id', 'publisher_id', 'title', 'data', 'format', 'created_at']
+        with compat.UnicodeWriter(source_file) as sources:
+            sources.writerow(headers)
+            sources.writerow(['source1', 'xx_dept1', 'July 2011 return', '', 'csv', '2015-01-01'])
+            sources.writerow(['source2', 'xx_dept1', 'Source 2', '', 'csv', '2015-01-02'])
+        RelevancePeriodExtractor(self.config).run()
+        with compat.UnicodeAppender(source_file) as sources:
+            sources.writerow(['source3', 'xx_dept1', 'Source 3', '', 'csv', '2015-01-03', ''])
+            sources.writerow(['source4', 'xx_dept1', 'Source 4', '', 'csv', '2015-01-04', ''])
+
+        extractor = RelevancePeriodExtractor(self.config)
+        with mock.patch.object(extractor, 'identify_period',
+                               wraps=extractor.identify_period) as identify_period:
+            self.assertRaises(exceptions.UnableToAssessTimeliness, extractor.run)
+            self.assertEqual(identify_period.call_count, 2)
+        self.config['timeliness']['max_empty_relevance_period'] = 75
+        extractor = RelevancePeriodExtractor(self.config)
+        extractor.run()
+        with compat.UnicodeDictReader(source_file) as sources:
+            periods = [(source['id'], source['period_id']) for source in sources]
+        self.config['timeliness']['date_order'] = 'MDY'
+        extractor = RelevancePeriodExtractor(self.config)
+        with mock.patch.object(extractor, 'identify_period',
+                               wraps=extractor.identify_period) as identify_period:
+            extractor.run()
+            self.assertEqual(identify_period.call_count, 4)
+
+        self.assertEqual(periods, [('source1', '01-07-2011/31-07-2011'),
+                                   ('source2', '02-01-2015/02-01-2015'),
+                                   ('source3', '03-01-2015/03-01-2015'),
+                                   ('source4', '04-01-2015/04-01-2015')])
+
     def test_run_raises_if_field_not_provided(self):
         """Test that RelevancePeriodExtractor raises if the field in timeliness_strategy
             doesn't exist in source_file
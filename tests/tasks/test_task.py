@@ -6,6 +6,8 @@ from __future__ import unicode_literals
 
 import unittest
 import os
+import shutil
+import tempfile
 from data_quality import utilities
 
 class TestTask(unittest.TestCase):
@@ -17,3 +19,22 @@ class TestTask(unittest.TestCase):
         config_filepath = os.path.join('tests', 'fixtures', 'dq.json')
         config = utilities.load_json_config(config_filepath)
         self.config = config
+        # Files the tasks keep between runs go to a temp dir, not the fixtures
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        config['cache_dir'] = os.path.join(self.state_dir, 'fetched')
+        for state_file in ['fingerprint_file', 'performance_state_file',
+                           'score_index_file', 'period_state_file',
+                           'content_state_file']:
+            config[state_file] = os.path.join(self.state_dir, config[state_file])
+
+    def copy_data_dir(self):
+        """Copy the fixtures to a temp dir and point the config at the copy"""
+
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        data_dir = os.path.join(temp_dir, 'data')
+        shutil.copytree(self.config['data_dir'], data_dir)
+        self.config['data_dir'] = data_dir
+        self.config['datapackage_file'] = os.path.join(data_dir, 'datapackage.json')
+        return data_dir
@@ -6,7 +6,9 @@ from __future__ import unicode_literals
 
 import unittest
 import os
+import io
 import datapackage
+import mock
 from data_quality import tasks, utilities, compat
 from .test_task import TestTask
 
@@ -37,4 +39,159 @@ class TestDataPackageChecker(TestTask):
         """
 
         checker = tasks.check_datapackage.DataPackageChecker(self.config)
-        self.assertRaisesRegexp(ValueError, 'schema', checker.check_database_content)
\ No newline at end of file
+        self.assertRaisesRegexp(ValueError, 'schema', checker.check_database_content)
+
+    def test_database_content_checked_from_last_check(self):
+        """Test that only the rows appended since the last check are checked,
+           and rewritten files from the start
+        """
+
+        data_dir = self.make_compliant_database()
+        run_file = os.path.join(data_dir, 'runs.csv')
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+        checker.check_database_content()
+        checked_size = os.path.getsize(run_file)
+
+        with compat.UnicodeAppender(run_file) as runs:
+            runs.writerow(['run3', '2016-08-09', '70'])
+        with mock.patch.object(checker, 'get_content_data',
+                               wraps=checker.get_content_data) as get_content_data:
+            checker.check_database_content()
+        self.assertEqual([(call[0][0].local_data_path, call[0][1])
+                          for call in get_content_data.call_args_list],
+                         [(run_file, checked_size)])
+
+        with compat.UnicodeAppender(run_file) as runs:
+            runs.writerow(['run4', '2016-08-10', 'none'])
+        self.assertRaisesRegexp(ValueError, 'runs.csv', checker.check_database_content)
+
+        with compat.UnicodeWriter(run_file) as runs:
+            runs.writerow(['id', 'timestamp', 'total_score'])
+            runs.writerow(['run5', '2016-08-11', '80'])
+        with mock.patch.object(checker, 'get_content_data',
+                               wraps=checker.get_content_data) as get_content_data:
+            checker.check_database_content()
+        self.assertEqual([(call[0][0].local_data_path, call[0][1])
+                          for call in get_content_data.call_args_list],
+                         [(run_file, 0)])
+
+    def test_appended_rows_checked_against_unique_values(self):
+        """Test that appended rows repeating a value of a unique field of the
+           rows checked before are reported
+        """
+
+        data_dir = self.make_compliant_database()
+        run_file = os.path.join(data_dir, 'runs.csv')
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+        checker.check_database_content()
+        checked_size = os.path.getsize(run_file)
+
+        with compat.UnicodeAppender(run_file) as runs:
+            runs.writerow(['run1', '2016-08-09', '70'])
+        with mock.patch.object(checker, 'get_content_data',
+                               wraps=checker.get_content_data) as get_content_data:
+            with self.assertRaises(ValueError) as check:
+                checker.check_database_content()
+        self.assertEqual([call[0][1] for call in get_content_data.call_args_list],
+                         [checked_size])
+        self.assertIn('"run1" already exists', str(check.exception))
+        self.assertRaisesRegexp(ValueError, 'run1', checker.check_database_content)
+
+    def test_database_content_checked_when_edited_in_place(self):
+        """Test that a file edited without changing its size is checked again
+           from the start
+        """
+
+        data_dir = self.make_compliant_database()
+        run_file = os.path.join(data_dir, 'runs.csv')
+        with compat.UnicodeAppender(run_file) as runs:
+            for index in range(2, 500):
+                runs.writerow(['run{0}'.format(index), '2016-08-08', '1000'])
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+        checker.check_database_content()
+        with io.open(run_file, mode='rb') as runs:
+            contents = runs.read()
+        with io.open(run_file, mode='wb') as runs:
+            runs.write(contents.replace(b'run250,2016-08-08,1000', b'run250,2016-08-08,none'))
+
+        self.assertGreater(len(contents), 8192)
+        self.assertRaisesRegexp(ValueError, 'runs.csv', checker.check_database_content)
+
+    def test_database_content_checked_in_parallel(self):
+        """Test that resources are checked in ranges of rows by several
+           processes, and that the issues of all of them are reported together
+        """
+
+        data_dir = self.make_compliant_database()
+        run_file = os.path.join(data_dir, 'runs.csv')
+        with compat.UnicodeAppender(run_file) as runs:
+            for index in range(2, 48):
+                runs.writerow(['run{0}'.format(index), '2016-08-08', str(index)])
+            runs.writerow(['run50', '2016-08-09', 'none'])
+            runs.writerow(['run51', '2016-08-09', '"multiline\nvalue"'])
+            runs.writerow(['run52', '2016-08-09', '70'])
+        with compat.UnicodeAppender(os.path.join(data_dir, 'publishers.csv')) as publishers:
+            publishers.writerow(['xx_dept2', ''])
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+        checker.chunk_rows = 10
+
+        with self.assertRaises(ValueError) as parallel_check:
+            checker.check_database_content(workers=2)
+        with self.assertRaises(ValueError) as check:
+            checker.check_database_content(full=True)
+        report = str(parallel_check.exception)
+        ranges = tasks.check_datapackage.get_row_ranges(run_file, 0, os.path.getsize(run_file),
+                                                        checker.chunk_rows)
+
+        self.assertIn('runs.csv', report)
+        self.assertIn('publishers.csv', report)
+        self.assertEqual(report, str(check.exception))
+        self.assertEqual(len(ranges), 5)
+        self.assertEqual(ranges[-1][1], os.path.getsize(run_file))
+
+    def test_unique_values_checked_across_ranges(self):
+        """Test that a value of a unique field repeated in another range of
+           rows is reported, in parallel as well
+        """
+
+        data_dir = self.make_compliant_database()
+        with compat.UnicodeAppender(os.path.join(data_dir, 'publishers.csv')) as publishers:
+            for index in range(2, 12):
+                publishers.writerow(['xx_dept{0}'.format(index), 'Department'])
+            publishers.writerow(['xx_dept3', 'Department 3 again'])
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+        checker.chunk_rows = 10
+
+        for workers in [1, 2]:
+            with self.assertRaises(ValueError) as check:
+                checker.check_database_content(workers=workers)
+            self.assertIn('publishers.csv', str(check.exception))
+            self.assertIn('"xx_dept3" already exists', str(check.exception))
+
+    def test_error_file_content_checked(self):
+        """Test that the error occurrences are checked against their schema"""
+
+        data_dir = self.make_compliant_database()
+        with compat.UnicodeAppender(os.path.join(data_dir, 'errors.csv')) as errors:
+            errors.writerow(['result1', 'structure', 'structure_005', '3'])
+            errors.writerow(['result2', 'schema', 'schema_003', 'many'])
+        checker = tasks.check_datapackage.DataPackageChecker(self.config)
+
+        self.assertRaisesRegexp(ValueError, 'errors.csv', checker.check_database_content)
+
+    def make_compliant_database(self):
+        """Copy the fixtures to a temp dir with files compliant with their schema"""
+
+        data_dir = self.copy_data_dir()
+        with compat.UnicodeWriter(os.path.join(data_dir, 'publishers.csv')) as publishers:
+            publishers.writerow(['id', 'title'])
+            publishers.writerow(['xx_dept1', 'Department 1'])
+        result_file = os.path.join(data_dir, 'results.csv')
+        with compat.UnicodeDictReader(result_file) as results:
+            result_headers = results.header
+        with compat.UnicodeWriter(result_file) as results:
+            results.writerow(result_headers)
+        with compat.UnicodeWriter(os.path.join(data_dir, 'runs.csv')) as runs:
+            runs.writerow(['id', 'timestamp', 'total_score'])
+            runs.writerow(['run1', '2016-08-08', '84'])
+        return data_dir
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import gzip
+import hashlib
+import shutil
+import tempfile
+import unittest
+from data_quality import cache
+
+
+class TestFetchedDataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def test_identical_payloads_stored_once(self):
+        fetched_cache = cache.FetchedDataCache(self.cache_dir)
+        first = fetched_cache.store('source1', 'first.csv', self.make_stream('a,b\n1,2\n'))
+        second = fetched_cache.store('source2', 'second.csv', self.make_stream('a,b\n1,2\n'))
+        fetched_cache.save()
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.blob_paths()), 1)
+        self.assertTrue(os.path.samefile(os.path.join(self.cache_dir, 'first.csv'),
+                                         os.path.join(self.cache_dir, 'second.csv')))
+        saved_manifest = cache.FetchedDataCache(self.cache_dir).manifest
+        self.assertEqual(sorted(saved_manifest.keys()), ['source1', 'source2'])
+
+    def test_removed_sources_pruned(self):
+        fetched_cache = cache.FetchedDataCache(self.cache_dir)
+        fetched_cache.store('source1', 'first.csv', self.make_stream('a,b\n1,2\n'))
+        fetched_cache.store('source2', 'second.csv', self.make_stream('a,b\n3,4\n'))
+        fetched_cache.save(source_ids=set(['source2']))
+
+        self.assertEqual(len(self.blob_paths()), 1)
+        self.assertEqual([name for name in os.listdir(self.cache_dir)
+                          if not name.startswith('.')], ['second.csv'])
+
+    def test_compressed_payload(self):
+        fetched_cache = cache.FetchedDataCache(self.cache_dir, compress=True)
+        fetched_cache.store('source1', 'first.csv', self.make_stream('a,b\n1,2\n'))
+
+        with gzip.open(os.path.join(self.cache_dir, 'first.csv.gz'), 'rb') as gzip_file:
+            self.assertEqual(gzip_file.read(), b'a,b\n1,2\n')
+
+    def test_payload_in_source_encoding(self):
+        fetched_cache = cache.FetchedDataCache(self.cache_dir)
+        digest = fetched_cache.store('source1', 'first.csv',
+                                     self.make_stream('a,b\nd\xe9j\xe0,2\n'),
+                                     encoding='latin-1')
+
+        with io.open(os.path.join(self.cache_dir, 'first.csv'), mode='rb') as cached_file:
+            payload = cached_file.read()
+        self.assertEqual(payload, 'a,b\nd\xe9j\xe0,2\n'.encode('latin-1'))
+        self.assertEqual(digest, hashlib.sha256(payload).hexdigest())
+
+    def make_stream(self, text):
+        """Return a text stream like the ones of goodtables pipelines"""
+
+        stream = io.TextIOWrapper(io.BufferedRandom(io.BytesIO()), encoding='utf-8')
+        stream.write(text)
+        stream.seek(0)
+        return stream
+
+    def blob_paths(self):
+        """Return the paths of the stored blobs"""
+
+        blob_dir = os.path.join(self.cache_dir, cache.FetchedDataCache.blob_dir_name)
+        return [os.path.join(root, name) for root, dirs, files in os.walk(blob_dir)
+                for name in files]
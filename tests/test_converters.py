@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import timeit
+import datetime
+import decimal
+import unittest
+import jsontableschema
+from jsontableschema.model import SchemaModel
+from data_quality import utilities
+from data_quality.converters import RowConverter
+from . import benchmark
+
+
+class TestRowConverter(unittest.TestCase):
+
+    def setUp(self):
+        datapackage = utilities.get_default_datapackage()
+        self.schemas = {resource.descriptor['name']: resource.descriptor['schema']
+                        for resource in datapackage.resources}
+        self.schemas['custom'] = {'fields': [
+            {'name': 'code', 'type': 'string', 'constraints': {'pattern': '[A-Z]+'}},
+            {'name': 'email', 'type': 'string', 'format': 'email'},
+            {'name': 'amount', 'type': 'number', 'groupChar': '.', 'decimalChar': ','},
+            {'name': 'valid', 'type': 'boolean'},
+            {'name': 'count', 'type': 'integer', 'constraints': {'minimum': 0}},
+            {'name': 'day', 'type': 'date', 'format': 'fmt:%d/%m/%Y'}]}
+
+    def test_rows_converted_as_by_schema_model(self):
+        today = datetime.date(2016, 8, 8)
+        now = datetime.datetime(2016, 8, 8, 17, 42, 12)
+        rows = {
+            'performance_file': [
+                ['xx_dept1', today, 3, 67, 2, 10, 80, 7],
+                ['xx_dept1', '2016-08-08', '3', ' 67 ', '', 'null', '1.5', 'x'],
+                ['', today, None, 0, 0, 0, 0, 0],
+                ['xx_dept1', 'August', 1, 1, 1, 1, 1, 1],
+                ['xx_dept1', '2016-02-30', 1, 1, 1, 1, 1, 1],
+                ['xx_dept1', '2016-2-3', 1, 1, 1, 1, 1, 1]],
+            'timing_file': [
+                ['result', 'run', '0.003075', '0.5', '1', '-2.25', 1.5,
+                 30, 2, '335.052', decimal.Decimal('0.005')],
+                [None, 'run', '1,000.5', '5%', 'abc', '', '-', 30, 2, '+1', '.5'],
+                ['result', 'run', '1', '1', '1', '1', '1', True, 2, '1', '1']],
+            'run_file': [
+                ['run', now, 84], ['run', '2016-08-08', '84'],
+                ['run', '2016-08-08 17:42:12+00:00', 84.5], ['run', None, 84]],
+            'source_file': [
+                ['source1', 'xx_dept1', 'Title', 'http://x.com/a.csv', 'csv', '2015-01-01'],
+                ['source1', 'xx_dept1', ' ', '', 'null', 'none'],
+                ['source1', 'xx_dept1', 'Title', 'http://x.com/a.csv', 1, b'csv'],
+                ['source1', 'xx_dept1', 'Title']],
+            'custom': [
+                ['ABC', 'a@b.com', '1.000,5', 'yes', '3', '01/02/2015'],
+                ['abc', 'ab.com', '1,5', 'maybe', '-3', '2015-02-01'],
+                ['', '', '', '', '', '']]}
+
+        for name, schema_rows in rows.items():
+            schema = SchemaModel(self.schemas[name])
+            converter = RowConverter(SchemaModel(self.schemas[name]))
+            for row in schema_rows:
+                self.assertEqual(self.get_outcome(converter.convert_row, row),
+                                 self.get_outcome(lambda *items: list(schema.convert_row(*items)),
+                                                  row))
+
+    def test_rows_serialized_as_written(self):
+        converter = RowConverter(SchemaModel(self.schemas['performance_file']))
+        row = converter.serialize_row('xx_dept1', datetime.date(2016, 8, 8), 3, '67',
+                                      2, 10, 80, 7)
+        self.assertEqual(row, ['xx_dept1', '2016-08-08', '3', '67', '2', '10', '80', '7'])
+
+    @benchmark
+    def test_converter_benchmark(self):
+        """Test that compiled converters cast rows faster than SchemaModel"""
+
+        schema = SchemaModel(self.schemas['timing_file'])
+        converter = RowConverter(schema)
+        row = ['result', 'run', '0.003075', '0.002153', '0.000245', '0.000496',
+               '0.005969', 30, 2, '335.052', '0.005026']
+
+        def convert_compiled():
+            for _ in range(200):
+                converter.serialize_row(*row)
+
+        def convert_with_schema():
+            for _ in range(200):
+                list(schema.convert_row(*row))
+
+        fast = min(timeit.repeat(convert_compiled, number=1, repeat=3))
+        slow = min(timeit.repeat(convert_with_schema, number=1, repeat=3))
+        self.assertLess(fast * 3, slow)
+
+    def get_outcome(self, convert_row, row):
+        """Return the converted row, or the errors raised converting it"""
+
+        try:
+            return convert_row(*row)
+        except jsontableschema.exceptions.MultipleInvalid as e:
+            return [(type(error), str(error)) for error in e.errors]
+        except jsontableschema.exceptions.JsonTableSchemaException as e:
+            return (type(e), str(e))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+import timeit
+import datetime
+import dateutil.parser
+from data_quality import dates
+from . import benchmark
+
+
+class TestDates(unittest.TestCase):
+
+    def setUp(self):
+        dates._parsed.clear()
+
+    def test_parsed_as_by_dateutil(self):
+        values = ['2015-01-01', '2016-08-08 17:42:12.141037+00:00',
+                  '2016-08-08T17:42:12Z', '2016-08-08 17:42:12.5-05:30',
+                  '2016-08-08 17:42', '2016-08-08T17:42:12+0200',
+                  '17-10-2014', '01-04-2010', '1-4-2010', '31-05-2010',
+                  'May 2015', '2015/01/02', '20150102', '2016-01-02', '2016-1-2',
+                  '2016-02-01T10:00:00+00:00', '2016-01-13', '2016-13-01',
+                  '2016-12-05 17:42:12.5']
+        for value in values:
+            for dayfirst in [False, True]:
+                try:
+                    expected = dateutil.parser.parse(value, dayfirst=dayfirst)
+                except ValueError:
+                    self.assertRaises(ValueError, dates.parse_datetime, value, dayfirst)
+                    continue
+                parsed = dates.parse_datetime(value, dayfirst)
+                self.assertEqual(parsed, expected)
+                self.assertEqual(parsed.utcoffset(), expected.utcoffset())
+
+    def test_invalid_values(self):
+        for value in ['', 'not a date', '31-02-2015', '13-13-2015']:
+            self.assertIsNone(dates.parse_date(value))
+        with self.assertRaises(ValueError):
+            dates.parse_datetime('2015-02-31')
+
+    def test_parsed_values_remembered(self):
+        dates._parsed.size = 2
+        for value in ['2015-01-01', '2015-01-02', '2015-01-01', '2015-01-03']:
+            dates.parse_date(value)
+        self.assertEqual(dates._parsed.hits, 1)
+        self.assertEqual(len(dates._parsed), 2)
+        self.assertEqual(dates.parse_date('2015-01-01'), datetime.date(2015, 1, 1))
+        self.assertEqual(dates._parsed.hits, 2)
+
+    @benchmark
+    def test_parse_benchmark(self):
+        """Test that parsing the timestamps and dates of a results file is
+           faster than with dateutil
+        """
+
+        start = datetime.datetime(2015, 1, 1, 12, 30, 15, 141037)
+        values = []
+        for run in range(100):
+            timestamp = '{0}+00:00'.format(start + datetime.timedelta(days=run))
+            created_at = '{0:%Y-%m-%d}'.format(start + datetime.timedelta(days=run * 3))
+            values.extend([timestamp, created_at] * 100)
+
+        def parse_all():
+            dates._parsed.clear()
+            for value in values:
+                dates.parse_datetime(value)
+
+        def dateutil_parse_all():
+            for value in values:
+                dateutil.parser.parse(value)
+
+        fast = min(timeit.repeat(parse_all, number=1, repeat=3))
+        slow = min(timeit.repeat(dateutil_parse_all, number=1, repeat=3))
+        self.assertLess(fast * 5, slow)
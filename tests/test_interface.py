@@ -5,13 +5,63 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import os
+import sys
+import timeit
 import unittest
 import subprocess
 import data_quality
+from . import benchmark
 
 class TestDataQualityCLI(unittest.TestCase):
 
+    # Longest the CLI may take to start, in seconds
+    startup_budget = 0.5
+    # Dependencies only imported by the commands that need them
+    deferred_modules = ['goodtables', 'dateparser', 'jsontableschema',
+                        'datapackage', 'requests', 'pytz', 'numpy']
+
     def test_cli_run(self):
         config_path = os.path.join('tests', 'fixtures', 'dq.json')
         c = ['python', '-m', 'data_quality.main', 'run', config_path]
         subprocess.check_output(c)
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'the modules of the package are imported eagerly before Python 3.7')
+    def test_cli_startup_imports(self):
+        """Test that the CLI starts without importing the dependencies of the
+           tasks
+        """
+
+        code = ('import sys, data_quality.main; '
+                'print(" ".join(sorted(set({0!r}).intersection(sys.modules))))'
+               ).format(self.deferred_modules)
+        imported = subprocess.check_output([sys.executable, '-c', code])
+
+        self.assertEqual(imported.decode('utf-8').split(), [])
+
+    @benchmark
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'the modules of the package are imported eagerly before Python 3.7')
+    def test_cli_startup_benchmark(self):
+        """Test that the CLI starts within `startup_budget`"""
+
+        self.assertLess(self.get_startup_time(), self.startup_budget)
+
+    def get_startup_time(self):
+        """Return how long importing the CLI takes, in seconds, as measured
+           by `python -X importtime` where available
+        """
+
+        command = [sys.executable, '-c', 'import data_quality.main']
+        if sys.version_info < (3, 7):
+            start = timeit.default_timer()
+            subprocess.check_call(command)
+            return timeit.default_timer() - start
+        output = subprocess.check_output(command[:1] + ['-X', 'importtime'] + command[1:],
+                                         stderr=subprocess.STDOUT)
+        for line in output.decode('utf-8').splitlines():
+            timings = line.split('|')
+            # The cumulative time of a module includes the modules it imports
+            if len(timings) == 3 and timings[2].strip() == 'data_quality.main':
+                return int(timings[1]) / 1000000
+        raise AssertionError('No import time found for data_quality.main')
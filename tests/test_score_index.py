@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import mock
+from data_quality import compat, utilities
+from data_quality.score_index import ScoreIndex
+
+
+class TestScoreIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.result_file = os.path.join(self.data_dir, 'results.csv')
+        self.headers = ['id', 'source_id', 'score', 'run_id', 'timestamp']
+        with compat.UnicodeWriter(self.result_file) as result_file:
+            result_file.writerow(self.headers)
+        self.add_result('result1', 'source1', 50, '2016-08-08 17:42:12+00:00')
+        self.add_result('result2', 'source2', 60, '2016-08-08 17:42:12+00:00')
+        self.add_result('result3', 'source1', 70, '2016-08-09 17:42:12+00:00')
+        self.score_index = ScoreIndex(os.path.join(self.data_dir, 'latest_scores.json'),
+                                      self.result_file,
+                                      os.path.join(self.data_dir, 'latest_results.csv'))
+
+    def test_latest_scores_indexed(self):
+        self.score_index.update()
+        index = self.score_index.load()
+
+        self.assertEqual(index['sources'], {
+            'source1': {'score': 70, 'run_id': 'run', 'timestamp': '2016-08-09 17:42:12+00:00'},
+            'source2': {'score': 60, 'run_id': 'run', 'timestamp': '2016-08-08 17:42:12+00:00'}})
+        self.assertEqual(index['results_size'], os.path.getsize(self.result_file))
+
+    def test_new_results_read_from_index_end(self):
+        self.score_index.update()
+        indexed_size = os.path.getsize(self.result_file)
+        self.add_result('result4', 'source2', 80, '2016-08-10 17:42:12+00:00')
+        with mock.patch.object(utilities, 'iter_results',
+                               wraps=utilities.iter_results) as iter_results:
+            self.score_index.update()
+        index = self.score_index.load()
+
+        self.assertEqual(iter_results.call_args[0][2], indexed_size)
+        self.assertEqual(index['sources']['source2']['score'], 80)
+        self.assertEqual(index['sources']['source1']['score'], 70)
+
+    def test_index_dropped_when_results_rewritten(self):
+        self.score_index.update()
+        with compat.UnicodeWriter(self.result_file) as result_file:
+            result_file.writerow(self.headers)
+            result_file.writerow(['result9', 'source9', '10', 'run',
+                                  '2016-08-08 17:42:12+00:00'])
+        self.add_result('result3', 'source1', 70, '2016-08-09 17:42:12+00:00')
+        self.add_result('result4', 'source1', 70, '2016-08-09 17:42:12+00:00')
+
+        self.assertIsNone(self.score_index.load())
+        self.score_index.update()
+        self.assertEqual(sorted(self.score_index.load()['sources']), ['source1', 'source9'])
+
+    def test_index_dropped_when_results_edited_in_place(self):
+        for number in range(200):
+            self.add_result('result{0}'.format(number + 4), 'source3', 80,
+                            '2016-08-10 17:42:12+00:00')
+        self.score_index.update()
+        with io.open(self.result_file, mode='rb') as result_file:
+            contents = result_file.read()
+        with io.open(self.result_file, mode='wb') as result_file:
+            result_file.write(contents.replace(b'result1,source1,50', b'result1,source1,90'))
+
+        self.assertGreater(len(contents), 8192)
+        self.assertIsNone(self.score_index.load())
+
+    def add_result(self, result_id, source_id, score, timestamp):
+        with compat.UnicodeAppender(self.result_file) as result_file:
+            result_file.writerow([result_id, source_id, score, 'run', timestamp])
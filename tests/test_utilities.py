@@ -6,6 +6,10 @@ from __future__ import unicode_literals
 
 import unittest
 import os
+import shutil
+import tempfile
+import mock
+import requests
 from data_quality import utilities
 import datapackage
 
@@ -20,3 +24,65 @@ class TestUtilities(unittest.TestCase):
         datapackage = utilities.get_default_datapackage()
         self.assertGreater(len(datapackage.resources), 0)
 
+    def test_data_quality_spec_bundled_when_offline(self):
+        config = self.get_spec_config()
+        with mock.patch('requests.get', side_effect=requests.exceptions.ConnectionError):
+            dq_spec = utilities.get_data_quality_spec(config)
+        self.assertIn('structure', dq_spec)
+        self.assertFalse(os.path.exists(config['data_quality_spec']['data_quality_spec_file']))
+
+    def test_data_quality_spec_cached(self):
+        config = self.get_spec_config()
+        response = mock.Mock(status_code=200, content=b'{}', headers={'ETag': '"v1"'})
+        response.json.return_value = {'structure': {'0': {'weight': 5}}}
+        with mock.patch('requests.get', return_value=response) as get:
+            utilities.get_data_quality_spec(config)
+            utilities._data_quality_specs.clear()
+            dq_spec = utilities.get_data_quality_spec(config)
+            self.assertEqual(get.call_count, 1)
+
+            response.status_code = 304
+            refreshed_spec = utilities.get_data_quality_spec(config, refresh=True)
+            self.assertEqual(get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+        self.assertEqual(dq_spec, {'structure': {'0': {'weight': 5}}})
+        self.assertEqual(refreshed_spec, dq_spec)
+
+    def test_data_quality_spec_kept_in_cache_dir(self):
+        config = self.get_spec_config()
+        config['data_quality_spec']['data_quality_spec_file'] = 'dq_spec.json'
+        config['cache_dir'] = os.path.dirname(self.spec_path)
+        self.assertEqual(utilities.get_data_quality_spec_path(config), self.spec_path)
+
+        config['cache_dir'] = 'fetched'
+        response = mock.Mock(status_code=200, content=b'{}', headers={})
+        response.json.return_value = {'structure': {}}
+        with mock.patch('requests.get', return_value=response):
+            dq_spec = utilities.get_data_quality_spec(config)
+        self.assertEqual(dq_spec, {'structure': {}})
+        self.assertFalse(os.path.exists('dq_spec.json'))
+        self.assertFalse(os.path.exists(os.path.join('fetched', 'dq_spec.json')))
+
+    def test_data_quality_spec_used_when_cache_not_written(self):
+        config = self.get_spec_config()
+        response = mock.Mock(status_code=200, content=b'{}', headers={})
+        response.json.return_value = {'structure': {}}
+        with mock.patch('requests.get', return_value=response):
+            with mock.patch('io.open', side_effect=IOError):
+                dq_spec = utilities.get_data_quality_spec(config)
+                utilities._data_quality_specs.clear()
+                with self.assertRaises(IOError):
+                    utilities.get_data_quality_spec(config, refresh=True)
+        self.assertEqual(dq_spec, {'structure': {}})
+        self.assertFalse(os.listdir(os.path.dirname(self.spec_path)))
+
+    def get_spec_config(self):
+        """Return the default config with the spec cached in a temporary folder"""
+
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.addCleanup(utilities._data_quality_specs.clear)
+        utilities._data_quality_specs.clear()
+        config = utilities.load_json_config(None)
+        self.spec_path = os.path.join(temp_dir, 'dq_spec.json')
+        config['data_quality_spec']['data_quality_spec_file'] = self.spec_path
+        return config
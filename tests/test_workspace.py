@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from data_quality import tasks, utilities, compat
+from data_quality.tasks.check_datapackage import DataPackageChecker
+
+
+class TestWorkspace(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.config = utilities.load_json_config(os.path.join('tests', 'fixtures', 'dq.json'))
+        data_dir = os.path.join(self.temp_dir, 'data')
+        shutil.copytree(self.config['data_dir'], data_dir)
+        self.config['data_dir'] = data_dir
+        self.config['datapackage_file'] = os.path.join(data_dir, 'datapackage.json')
+
+    def test_datapackage_and_schemas_shared(self):
+        first_task = tasks.Task(self.config)
+        second_task = DataPackageChecker(self.config)
+        second_task.run()
+        resource = utilities.get_datapackage_resource(first_task.result_file,
+                                                      first_task.datapackage)
+
+        self.assertIs(second_task.workspace, first_task.workspace)
+        self.assertIs(second_task.datapackage, first_task.datapackage)
+        self.assertIs(first_task.workspace.get_schema(resource),
+                      second_task.workspace.get_schema(resource))
+        self.assertIs(first_task.workspace.get_row_converter(resource).schema,
+                      first_task.workspace.get_schema(resource))
+
+    def test_datapackage_loaded_again_when_changed(self):
+        task = tasks.Task(self.config)
+        resource = utilities.get_datapackage_resource(task.result_file, task.datapackage)
+        schema = task.workspace.get_schema(resource)
+        descriptor = task.datapackage.to_dict()
+        descriptor['title'] = 'Changed datapackage'
+        with io.open(self.config['datapackage_file'], mode='w+', encoding='utf-8') as datapkg_file:
+            datapkg_file.write(compat.str(json.dumps(descriptor, indent=4)))
+        changed_task = tasks.Task(self.config)
+        changed_resource = utilities.get_datapackage_resource(changed_task.result_file,
+                                                              changed_task.datapackage)
+
+        self.assertIsNot(changed_task.datapackage, task.datapackage)
+        self.assertEqual(changed_task.datapackage.descriptor['title'], 'Changed datapackage')
+        self.assertIsNot(changed_task.workspace.get_schema(changed_resource), schema)
+
+    def test_default_datapackage_unchanged(self):
+        self.config['goodtables']['arguments']['batch']['data_key'] = 'url'
+        task = tasks.Task(self.config)
+        default_datapkg = task.workspace.default_datapackage
+        source_resource = [resource for resource in default_datapkg.resources
+                           if resource.descriptor['name'] == 'source_file'][0]
+        schema = task.workspace.get_default_schema(source_resource, task.data_key)
+        field_names = [field['name'] for field in source_resource.descriptor['schema']['fields']]
+
+        self.assertIn('url', schema.headers)
+        self.assertIn('data', field_names)
+        self.assertNotIn('url', field_names)